@@ -0,0 +1,279 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from dataset_store import data_path
+
+"""This file provides the instrumentation of the Spotify API calls made by the crawler.
+
+    The spotipy client is wrapped by an instrumented client, recording per endpoint the number of calls, the items per
+    call, a latency histogram, errors and rate limit (HTTP 429) responses. Retries (including those made within the
+    pooled HTTP session) and forced sleeps are recorded too, as is the peak number of calls within the rate limit
+    window. The metrics are printed as live counters during a crawl, and saved as a JSON summary per crawl.
+"""
+
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]  # Upper bounds of the latency histogram buckets
+RATE_LIMIT_WINDOW = 30  # Seconds, the rolling window of the Spotify API rate limit
+
+
+class ApiMetrics:
+    """The class collects the Spotify API metrics of a crawl. All methods are thread-safe.
+
+    Attributes:
+        started (float): The time the metrics were created
+        endpoints (dict): The metrics of each endpoint (calls, items, errors, rate_limited, retries, latency)
+        sleeps (dict): The seconds spent in sleeps, per reason
+        recent (deque): The times of the calls within the last rate limit window
+        peak_window_calls (int): The maximum number of calls within any rate limit window
+        session_retries (dict): The number of requests retried within the pooled HTTP session, per HTTP status ('error' for requests failing without a response)
+        lock (Lock): Guards the metrics
+    """
+    directory = 'crawl_metrics'
+
+    def __init__(self):
+        """The initialization of the Api Metrics class"""
+        self.started = time.time()
+        self.endpoints = {}
+        self.sleeps = {}
+        self.recent = deque()
+        self.peak_window_calls = 0
+        self.session_retries = {}
+        self.lock = threading.Lock()
+
+    def endpoint(self, name: str):
+        """Method provides the metrics of an endpoint, creating them on first use (the lock must be held)
+
+        Args:
+            name (str): The name of the endpoint
+
+        Returns:
+            (dict): The metrics of the endpoint
+        """
+        if name not in self.endpoints:
+            self.endpoints[name] = {'calls': 0, 'items': 0, 'errors': 0, 'rate_limited': 0, 'retries': 0,
+                                    'latency_ms_total': 0.0, 'latency_ms_max': 0.0,
+                                    'latency_histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+        return self.endpoints[name]
+
+    def record_call(self, name: str, seconds: float, items: int = None, error: Exception = None):
+        """Method records a completed (or failed) API call
+
+        Args:
+            name (str): The name of the endpoint
+            seconds (float): The latency of the call
+            items (int): The number of items returned by the call
+            error (Exception): The error raised by the call, None if it succeeded
+        """
+        milliseconds = seconds * 1000
+        now = time.time()
+        with self.lock:
+            metrics = self.endpoint(name)
+            metrics['calls'] += 1
+            metrics['items'] += items if items is not None else 0
+            metrics['latency_ms_total'] += milliseconds
+            metrics['latency_ms_max'] = max(metrics['latency_ms_max'], milliseconds)
+            bucket = next((position for position, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound),
+                          len(LATENCY_BUCKETS_MS))
+            metrics['latency_histogram'][bucket] += 1
+            if error is not None:
+                metrics['errors'] += 1
+                if is_rate_limited(error):
+                    metrics['rate_limited'] += 1
+
+            self.recent.append(now)
+            while self.recent[0] < now - RATE_LIMIT_WINDOW:
+                self.recent.popleft()
+            self.peak_window_calls = max(self.peak_window_calls, len(self.recent))
+
+    def record_retry(self, name: str):
+        """Method records a retried API call
+
+        Args:
+            name (str): The name of the endpoint
+        """
+        with self.lock:
+            self.endpoint(name)['retries'] += 1
+
+    def record_session_retry(self, status: int = None, error: Exception = None):
+        """Method records a request retried within the pooled HTTP session (a retry listener, see
+        `spotify_client.notify_retry()`). Such retries are invisible to the wrapped API calls.
+
+        Args:
+            status (int): The HTTP status of the retried response, None if the request failed without a response
+            error (Exception): The connection or read error of the retried request, None if a response was received
+        """
+        key = str(status) if status is not None else 'error'
+        with self.lock:
+            self.session_retries[key] = self.session_retries.get(key, 0) + 1
+
+    def record_sleep(self, seconds: float, reason: str):
+        """Method records time spent sleeping
+
+        Args:
+            seconds (float): The duration of the sleep
+            reason (str): The reason of the sleep (e.g. `throttle` or `retry backoff`)
+        """
+        with self.lock:
+            self.sleeps[reason] = self.sleeps.get(reason, 0.0) + seconds
+
+    def summary(self):
+        """Method summarises the metrics
+
+        Returns:
+            (dict): The JSON serializable summary of the metrics
+        """
+        with self.lock:
+            endpoints = {}
+            for name, metrics in self.endpoints.items():
+                endpoints[name] = dict(metrics,
+                                       latency_histogram=dict(zip([f'<={bound}ms' for bound in LATENCY_BUCKETS_MS]
+                                                                  + [f'>{LATENCY_BUCKETS_MS[-1]}ms'],
+                                                                  metrics['latency_histogram'])),
+                                       items_per_call=metrics['items'] / metrics['calls'] if metrics['calls'] else 0,
+                                       latency_ms_mean=metrics['latency_ms_total'] / metrics['calls'] if metrics['calls'] else 0)
+            elapsed = time.time() - self.started
+            return {'started': datetime.fromtimestamp(self.started).strftime('%d-%m-%Y %H:%M:%S'),
+                    'elapsed_s': elapsed,
+                    'calls': sum(metrics['calls'] for metrics in self.endpoints.values()),
+                    'api_time_s': sum(metrics['latency_ms_total'] for metrics in self.endpoints.values()) / 1000,
+                    'sleep_s': dict(self.sleeps),
+                    'peak_calls_per_window': self.peak_window_calls,
+                    'session_retries': dict(self.session_retries),
+                    'rate_limit_window_s': RATE_LIMIT_WINDOW,
+                    'endpoints': endpoints}
+
+    def live(self):
+        """Method provides a single line of live counters
+
+        Returns:
+            (str): The call, item, retry and 429 counts per endpoint, the session retries, and the peak calls per rate limit window
+        """
+        with self.lock:
+            counters = ', '.join(f"{name}: {metrics['calls']} calls/{metrics['items']} items"
+                                 f"/{metrics['retries']} retries/{metrics['rate_limited']} 429s"
+                                 for name, metrics in self.endpoints.items())
+            session = f"{sum(self.session_retries.values())} session retries/{self.session_retries.get('429', 0)} 429s"
+            return f'[api] {counters} | {session} | peak {self.peak_window_calls} calls/{RATE_LIMIT_WINDOW}s | ' \
+                   f'slept {sum(self.sleeps.values()):.0f}s'
+
+    def save(self, path: str = None):
+        """Method saves the JSON summary of the metrics
+
+        Args:
+            path (str): The path to the summary file. Defaults to a timestamped file in `data/crawl_metrics`.
+
+        Returns:
+            (str): The path to the summary file
+        """
+        if path is None:
+            os.makedirs(data_path(self.directory), exist_ok=True)
+            stamp = datetime.fromtimestamp(self.started).strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(data_path(self.directory), f'crawl_{stamp}.json')
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+        return path
+
+
+def is_rate_limited(error: Exception):
+    """Method determines whether an API error is a rate limit (HTTP 429) response
+
+    Only the HTTP status of the error is inspected (`http_status` of a `SpotifyException`, or the status code of the
+    response of a requests `HTTPError`), never its message.
+
+    Args:
+        error (Exception): The error raised by an API call
+
+    Returns:
+        (bool): True if the error is a rate limit response
+    """
+    if getattr(error, 'http_status', None) == 429:
+        return True
+    return getattr(getattr(error, 'response', None), 'status_code', None) == 429
+
+
+def count_items(name: str, result):
+    """Method counts the items returned by an API call
+
+    Args:
+        name (str): The name of the endpoint
+        result: The result of the call
+
+    Returns:
+        (int): The number of items, None if the endpoint returns no list of items
+    """
+    if name == 'artists':
+        return len(result['artists'])
+    if name == 'audio_features':
+        return len(result)
+    if name == 'playlist_tracks':
+        return len(result['items'])
+    if name == 'featured_playlists':
+        return len(result['playlists']['items'])
+    return None
+
+
+class InstrumentedClient:
+    """The class wraps a spotipy client, recording the metrics of each API call.
+
+    Attribute access is forwarded to the wrapped client, with API methods wrapped to record their calls.
+
+    Note, the pooled HTTP session retries rate limited requests internally (honouring the Retry-After header). Such a
+    call is recorded once, with a latency that includes the internal waits, while each internal retry is recorded by
+    `ApiMetrics.record_session_retry()` (if the metrics are registered as a retry listener of `spotify_client`).
+
+    Attributes:
+        client (Spotipy Authorization): The wrapped spotipy client
+        metrics (ApiMetrics): The metrics the calls are recorded into
+    """
+    def __init__(self, client, metrics: ApiMetrics):
+        """The initialization of the Instrumented Client class
+
+        Args:
+            client (Spotipy Authorization): The spotipy client to be wrapped
+            metrics (ApiMetrics): The metrics the calls are recorded into
+        """
+        self.client = client
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        """Method forwards attribute access to the wrapped client, wrapping its methods
+
+        Args:
+            name (str): The name of the attribute
+
+        Returns:
+            The attribute of the wrapped client (methods are wrapped to record their calls)
+        """
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def instrumented(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception as error:
+                self.metrics.record_call(name, time.perf_counter() - start, error=error)
+                raise
+            self.metrics.record_call(name, time.perf_counter() - start, count_items(name, result))
+            return result
+
+        instrumented.__name__ = name
+        instrumented.metrics = self.metrics  # Allows retries of the call to be recorded
+        return instrumented
+
+
+def throttle(sp, seconds: float, reason: str = 'throttle'):
+    """Method sleeps between API calls, recording the sleep if the client is instrumented
+
+    Args:
+        sp (Spotipy Authorization): The (instrumented) spotipy client
+        seconds (float): The duration of the sleep
+        reason (str): The reason of the sleep
+    """
+    if isinstance(sp, InstrumentedClient):
+        sp.metrics.record_sleep(seconds, reason)
+    time.sleep(seconds)
@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+from dataset_store import UriIndex, data_path, load_versioned, save_versioned
+from feature_store import FeatureStore, normalize_rows
+from playlist_compression import PlaylistCompressor
+from ranking import RankedCursor
+from similarity import TracksCosineSimilarity
+
+"""This file provides a hierarchical (two-stage) cosine similarity through precomputed artist centroid vectors.
+
+    Tracks of the same artist share the artist popularity and the whole genre TFIDF block, such that the track feature
+    matrix is heavily structured along artists. The mean normalized track vector of each artist is precomputed, and a
+    playlist is first scored against the artist centroids. Only the tracks of the top-M artists are then scored
+    exactly. As there are far fewer artists than tracks, the first stage is a fraction of a full scan.
+"""
+
+
+class ArtistCentroidIndex:
+    """The class holds the centroid vector of each artist, and the feature matrix rows of the tracks of each artist.
+
+    The rows of the artist with id `a` are `rows[indptr[a]:indptr[a + 1]]`, in a CSR layout.
+
+    Attributes:
+        artists (ndarray): The artist uris, the position is the artist id
+        centroids (ndarray): The (artists, columns) mean L2 normalized track vector of each artist
+        centroid_norms (ndarray): The L2 norm of each centroid
+        row_artists (ndarray): The artist id of each row of the feature matrix (-1 for rows without a track)
+        indptr (ndarray): The CSR row pointer (int64) of the artist -> rows mapping
+        rows (ndarray): The CSR feature matrix rows (int64) of the artist -> rows mapping
+        version (str): The dataset version the index was built from
+    """
+    file_name = 'artist_centroids.npz'
+    chunk_rows = 4096  # Rows normalized per block
+
+    def __init__(self, artists, centroids, row_artists, version=None):
+        """The initialization of the Artist Centroid Index class
+
+        Args:
+            artists (ndarray): The artist uris, ordered by artist id
+            centroids (ndarray): The (artists, columns) centroid vector of each artist
+            row_artists (ndarray): The artist id of each row of the feature matrix (-1 for rows without a track)
+            version (str): The dataset version the index was built from
+        """
+        self.artists = np.asarray(artists)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.centroid_norms = np.linalg.norm(self.centroids, axis=1)
+        self.row_artists = np.asarray(row_artists, dtype=np.int32)
+
+        assigned = np.flatnonzero(self.row_artists >= 0)
+        self.rows = assigned[np.argsort(self.row_artists[assigned], kind='stable')].astype(np.int64)
+        self.indptr = np.zeros(self.artists.shape[0] + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(self.row_artists[assigned], minlength=self.artists.shape[0]))
+        self.version = version
+
+    @classmethod
+    def build(cls, matrix, norms, row_ids, tracks: pd.DataFrame, uri_index: UriIndex = None, version=None):
+        """Method computes the artist centroids of a track feature matrix
+
+        Args:
+            matrix (ndarray): The (rows, columns) track feature matrix
+            norms (ndarray): The L2 norm of each row of the matrix
+            row_ids (ndarray): The interned track id of each row of the matrix
+            tracks (DataFrame): The tracks dataframe, providing the `artist_uris` of each track
+            uri_index (UriIndex): The interned track ids of the rows. Defaults to the persisted uri index.
+            version (str): The dataset version of the matrix
+
+        Returns:
+            (ArtistCentroidIndex): The artist centroid index
+        """
+        from scipy import sparse
+
+        uri_index = uri_index if uri_index is not None else UriIndex.open()
+        artist_codes, artists = pd.factorize(tracks['artist_uris'].astype(object), sort=False)
+        track_ids = uri_index.encode(tracks['uris'])
+        track_artists = np.full(max(len(uri_index), int(np.max(row_ids, initial=-1)) + 1) + 1, -1, dtype=np.int64)
+        track_artists[track_ids] = artist_codes  # Track id -> artist id
+        row_artists = track_artists[row_ids]
+
+        assigned = row_artists >= 0
+        counts = np.bincount(row_artists[assigned], minlength=len(artists))
+        centroids = np.zeros((len(artists), matrix.shape[1]), dtype=np.float64)
+        for start in range(0, matrix.shape[0], cls.chunk_rows):  # Accumulate the mean normalized vector block by block
+            block_artists = row_artists[start: start + cls.chunk_rows]
+            block = normalize_rows(matrix[start: start + cls.chunk_rows], norms[start: start + cls.chunk_rows])
+            selected = np.flatnonzero(block_artists >= 0)
+            weights = 1 / counts[block_artists[selected]]
+            assignment = sparse.csr_matrix((weights, (block_artists[selected], selected)),
+                                           shape=(len(artists), block.shape[0]))
+            centroids += assignment @ block
+        return cls(np.asarray(artists, dtype=str), centroids, row_artists, version)
+
+    @classmethod
+    def publish(cls, feature_store: FeatureStore, tracks: pd.DataFrame, path: str = None):
+        """Method builds the artist centroid index of a published feature store and persists it alongside the dataset
+
+        Args:
+            feature_store (FeatureStore): The published feature store
+            tracks (DataFrame): The tracks dataframe the feature store was published from
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        index = cls.build(feature_store.features, feature_store.norms, feature_store.track_ids, tracks,
+                          version=feature_store.version())
+        save_versioned(path, index.version, artists=index.artists, centroids=index.centroids,
+                       row_artists=index.row_artists)
+
+    @classmethod
+    def open(cls, feature_store: FeatureStore, path: str = None):
+        """Method loads the persisted artist centroid index of a feature store (it is not built if it is missing or
+        stale, as building it costs more than the exact scan it speeds up)
+
+        Args:
+            feature_store (FeatureStore): The published feature store
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (ArtistCentroidIndex): The artist centroid index matching the feature store version, None if it is missing or stale
+        """
+        stored = load_versioned(path if path is not None else data_path(cls.file_name), feature_store.version())
+        if stored is None:
+            return None
+        return cls(stored['artists'], stored['centroids'], stored['row_artists'], feature_store.version())
+
+    def nbytes(self):
+        """Method determines the memory scanned in the first stage
+
+        Returns:
+            (int): The number of bytes of the centroids and their norms
+        """
+        return self.centroids.nbytes + self.centroid_norms.nbytes
+
+    def rows_of(self, artist_ids):
+        """Method gathers the feature matrix rows of the tracks of the given artists
+
+        Args:
+            artist_ids (ndarray): The artist ids
+
+        Returns:
+            (ndarray): The rows of the tracks of the artists
+        """
+        if len(artist_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self.rows[self.indptr[artist]: self.indptr[artist + 1]] for artist in artist_ids])
+
+
+class ArtistCentroidSimilarity(TracksCosineSimilarity):
+    """The class implements a two-stage cosine similarity: the playlist is scored against the artist centroids, after
+        which only the tracks of the top-M artists are scored exactly.
+
+        This class inherits the Cosine Similarity class (and therefore the Similarity interface), sharing its features,
+        playlist vectors and feature weighting.
+
+        Note, tracks outside the top-M artists keep the score of their artist centroid, capped below the lowest exact
+        score, such that ranking always favours the exactly scored tracks. Increasing M increases the recall (and the
+        cost) of the similarity. Without a published index (or a feature store), all tracks are scored exactly.
+
+        Attributes:
+            index (ArtistCentroidIndex): The artist centroid vectors, None if no index is published
+            top_artists (int): The number of best scoring artists (M) whose tracks are scored exactly
+            candidates (ndarray): The scored track positions (into `similarity`) that were scored exactly
+            vectors (ndarray): The playlist vector(s) of the last similarity calculation
+            blend (ndarray): The weight of each playlist vector of the last similarity calculation
+        """
+    def __init__(self, playlist: pd.DataFrame, tracks: pd.DataFrame, weighted_features: list,
+                 compressor: PlaylistCompressor = None, feature_store: FeatureStore = None,
+                 index: ArtistCentroidIndex = None, top_artists: int = 500):
+        """The initialization of the Artist Centroid Similarity class
+
+        Args:
+            playlist (DataFrame): The tracks dataset dataframe (before pipeline transformation)
+            tracks (DataFrame): The playlist tracks dataframe (before pipeline transformation)
+            weighted_features (list): A list of features to be weighted in order to prioritize feature importance in similarity calculation.
+            compressor (PlaylistCompressor): Optional playlist compressor, enabling multi-vector scoring against k playlist centroids.
+            feature_store (FeatureStore): Optional published feature store (see `TracksCosineSimilarity`).
+            index (ArtistCentroidIndex): The artist centroid index of the track features. If not given, the persisted index of the feature store is used (the tracks are scored exactly if there is none).
+            top_artists (int): The number of best scoring artists (M) whose tracks are scored exactly, the recall knob of the similarity.
+        """
+        super().__init__(playlist, tracks, weighted_features, compressor=compressor, feature_store=feature_store)
+        if index is None and feature_store is not None:
+            index = ArtistCentroidIndex.open(feature_store)
+        self.index = index
+        self.top_artists = top_artists
+        self.candidates = None
+        self.vectors = None
+        self.blend = None
+
+    def calculate_similarity(self):
+        """Method calculates the similarity between the playlist vector(s) and the tracks, scoring the artist centroids
+        first and then the tracks of the top-M artists exactly
+
+        This calculation populates the `self.similarity` field. Without an index, all tracks are scored exactly.
+        """
+        if self.index is None:
+            return super().calculate_similarity()
+        if self.compressor is None:
+            vectors, blend = self.vectorize_playlist(), np.ones(1)
+        else:
+            vectors, blend = self.vectorize_playlist_centroids()
+        self.vectors, self.blend = vectors, blend
+
+        artist_scores = self.centroid_similarity(vectors) @ blend
+        count = min(self.top_artists, artist_scores.shape[0])
+        top = np.argpartition(-artist_scores, count - 1)[:count] if 0 < count < artist_scores.shape[0] else np.arange(count)
+
+        selected = np.zeros(self.track_matrix.shape[0], dtype=bool)  # Bitmap over the rows of the top-M artists
+        selected[self.index.rows_of(top)] = True
+        self.candidates = np.flatnonzero(selected[self.track_positions])
+        exact = self.cosine_similarity(vectors, positions=self.track_positions[self.candidates]) @ blend
+
+        row_artists = self.index.row_artists[self.track_positions]
+        similarity_score = np.where(row_artists >= 0, artist_scores[row_artists], -1.0)
+        similarity_score = np.minimum(similarity_score, exact.min(initial=np.inf))  # Cap artist scores below candidates
+        similarity_score[self.candidates] = exact
+
+        uris = self.tracks['uris'].to_numpy()[self.dataset_rows(self.track_positions)]
+        self.similarity = pd.Series(similarity_score, index=uris, name='sim_score')
+
+    def centroid_similarity(self, vectors):
+        """Method calculates the cosine similarity between the weighted artist centroids and the given vectors
+
+        Args:
+            vectors (ndarray): A (k, n_features) matrix of playlist vectors
+
+        Returns:
+            (ndarray): A (n_artists, k) matrix of the similarity of each artist centroid to each vector
+        """
+        dots = self.index.centroids @ (vectors * self.weights).T
+        weighted = np.flatnonzero(self.weights != 1)
+        squared = self.index.centroid_norms ** 2 + (self.index.centroids[:, weighted] ** 2) @ (self.weights[weighted] ** 2 - 1)
+        norms = np.sqrt(np.maximum(squared, 0))[:, None] * np.linalg.norm(vectors, axis=1)[None, :]
+        return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+    def cursor(self):
+        """Method provides a cursor over the ranked tracks, scoring each chunk exactly before it is served (such that
+        paging beyond the tracks of the top-M artists remains exact)
+
+        Returns:
+            (RankedCursor): The cursor over the tracks scored by `calculate_similarity()`
+        """
+        if self.index is None:
+            return super().cursor()
+        return RankedCursor(self.similarity.to_numpy(), self.select_tracks,
+                            refine=lambda positions: self.cosine_similarity(
+                                self.vectors, positions=self.track_positions[positions]) @ self.blend)
@@ -0,0 +1,430 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import UriIndex, data_path
+from similarity_interface import RankedSimilarity
+from track_filters import MetadataIndex
+
+"""This file provides a playlist co-occurrence (item-item) similarity, built from the crawled playlist membership.
+
+    Each crawled track is recorded with the playlist it was collected from. The membership of every crawl is kept as a
+    sparse track x playlist incidence matrix A, from which a top-k pruned item-item co-occurrence matrix C = A A^T is
+    maintained. A playlist is scored with a single sparse matrix-vector product against C, without touching the dense
+    acoustic feature matrix.
+
+    Note, the tracks dataset keeps a single (latest) playlist per track, the incidence is therefore accumulated at
+    ingest, before de-duplication. Playlists are identified by their name together with their ingest time (see
+    `playlist_keys()`), such that same-named playlists of different ingests (e.g. a chart crawled weekly, or a user
+    submission named like a chart) remain distinct.
+"""
+
+
+def playlist_keys(df: pd.DataFrame):
+    """Method determines the incidence key of the playlist each track was collected from
+
+    The key is `<ingested_at>/<playlist_name>`, or the playlist name alone for tracks saved before ingest times were
+    recorded.
+
+    Args:
+        df (DataFrame): The collected tracks, with their `playlist_name` (and `ingested_at`, if recorded)
+
+    Returns:
+        (Series): The playlist key of each track
+    """
+    names = df['playlist_name'].astype(object).fillna('').astype(str)
+    if 'ingested_at' not in df.columns:
+        return names
+    ingested_at = df['ingested_at'].astype(object)
+    keys = ingested_at.fillna('').astype(str) + '/' + names
+    return keys.where(ingested_at.notna(), names)
+
+
+class PlaylistIncidence:
+    """The class holds the playlist membership of the crawled tracks, as (track id, playlist id) edges.
+
+    Track ids are the interned ids of the `UriIndex`, and playlist ids are positions in `playlists`.
+
+    Attributes:
+        playlists (list): The playlist keys (see `playlist_keys()`), the position in the list is the playlist id
+        track_ids (ndarray): The int32 track id of each edge
+        playlist_ids (ndarray): The int32 playlist id of each edge
+    """
+    file_name = 'playlist_incidence.npz'
+
+    def __init__(self, playlists=None, track_ids=None, playlist_ids=None):
+        """The initialization of the Playlist Incidence class
+
+        Args:
+            playlists (list): The playlist keys, ordered by playlist id
+            track_ids (ndarray): The track id of each edge
+            playlist_ids (ndarray): The playlist id of each edge
+        """
+        self.playlists = list(playlists) if playlists is not None else []
+        self.playlist_codes = {key: playlist_id for playlist_id, key in enumerate(self.playlists)}
+        self.track_ids = np.asarray(track_ids if track_ids is not None else [], dtype=np.int32)
+        self.playlist_ids = np.asarray(playlist_ids if playlist_ids is not None else [], dtype=np.int32)
+
+    def __len__(self):
+        """Method determines the number of membership edges
+
+        Returns:
+            (int): The number of (track, playlist) edges
+        """
+        return self.track_ids.shape[0]
+
+    @classmethod
+    def load(cls, path=None):
+        """Method loads the persisted playlist incidence
+
+        Args:
+            path (str): The path to the incidence file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (PlaylistIncidence): The loaded incidence, or None if no incidence has been persisted.
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            return cls(stored['playlists'].tolist(), stored['track_ids'], stored['playlist_ids'])
+
+    @classmethod
+    def open(cls, df: pd.DataFrame = None, uri_index: UriIndex = None):
+        """Method loads the persisted playlist incidence, or builds it from the playlist of each dataset track
+
+        Args:
+            df (DataFrame): The tracks dataframe, used if no incidence has been persisted
+            uri_index (UriIndex): The uri index of the dataset layer. Defaults to the persisted uri index.
+
+        Returns:
+            (PlaylistIncidence): The playlist incidence
+        """
+        incidence = cls.load()
+        if incidence is not None:
+            return incidence
+        incidence = cls()
+        if df is not None and df.shape[0] != 0:
+            uri_index = uri_index if uri_index is not None else UriIndex.open()
+            incidence.update(uri_index.encode(df['uris']), playlist_keys(df))
+        return incidence
+
+    def save(self, path=None):
+        """Method persists the playlist incidence
+
+        Args:
+            path (str): The path to the incidence file. Defaults to the file alongside the tracks dataset.
+        """
+        path = path if path is not None else data_path(self.file_name)
+        np.savez(path, playlists=np.asarray(self.playlists, dtype=str), track_ids=self.track_ids,
+                 playlist_ids=self.playlist_ids)
+
+    def update(self, track_ids, keys):
+        """Method records the playlist membership of newly collected tracks
+
+        Args:
+            track_ids (ndarray): The track id of each collected track
+            keys (Series): The key of the playlist each track was collected from (see `playlist_keys()`)
+
+        Returns:
+            (ndarray): The ids of the playlists that gained tracks
+        """
+        playlist_ids = np.empty(len(track_ids), dtype=np.int32)
+        for position, key in enumerate(pd.Series(keys).fillna('').astype(str).tolist()):
+            if key not in self.playlist_codes:
+                self.playlist_codes[key] = len(self.playlists)
+                self.playlists.append(key)
+            playlist_ids[position] = self.playlist_codes[key]
+
+        keys = self.edge_keys(self.track_ids, self.playlist_ids)
+        new_keys = np.setdiff1d(self.edge_keys(np.asarray(track_ids), playlist_ids), keys)  # Unique unseen edges
+        self.track_ids = np.concatenate([self.track_ids, (new_keys >> 32).astype(np.int32)])
+        self.playlist_ids = np.concatenate([self.playlist_ids, (new_keys & 0xFFFFFFFF).astype(np.int32)])
+        return np.unique((new_keys & 0xFFFFFFFF).astype(np.int32))
+
+    @staticmethod
+    def edge_keys(track_ids, playlist_ids):
+        """Method packs (track id, playlist id) edges into single int64 keys
+
+        Args:
+            track_ids (ndarray): The track id of each edge
+            playlist_ids (ndarray): The playlist id of each edge
+
+        Returns:
+            (ndarray): The int64 key of each edge
+        """
+        return (np.asarray(track_ids, dtype=np.int64) << 32) | np.asarray(playlist_ids, dtype=np.int64)
+
+    def matrix(self, rows: int = None):
+        """Method provides the binary track x playlist incidence matrix
+
+        Args:
+            rows (int): The number of track rows. Defaults to the largest track id + 1.
+
+        Returns:
+            (csr_matrix): The (tracks, playlists) incidence matrix
+        """
+        from scipy import sparse
+
+        rows = rows if rows is not None else int(self.track_ids.max(initial=-1)) + 1
+        data = np.ones(self.track_ids.shape[0], dtype=np.float32)
+        return sparse.csr_matrix((data, (self.track_ids, self.playlist_ids)), shape=(rows, len(self.playlists)))
+
+    def tracks_in(self, playlist_ids):
+        """Method determines the tracks belonging to any of the given playlists
+
+        Args:
+            playlist_ids (ndarray): The playlist ids
+
+        Returns:
+            (ndarray): The unique track ids of the playlists
+        """
+        return np.unique(self.track_ids[np.isin(self.playlist_ids, playlist_ids)])
+
+
+class CooccurrenceIndex:
+    """The class holds the top-k pruned item-item co-occurrence matrix of the crawled tracks.
+
+    Row i of the matrix holds the (at most) `neighbours` tracks sharing the most playlists with track i, valued by the
+    number of shared playlists. As a new edge of playlist p only changes the co-occurrence of tracks within p, the
+    index is updated incrementally by recomputing the rows of the tracks in the playlists that gained tracks.
+
+    Attributes:
+        matrix (csr_matrix): The (tracks, tracks) pruned co-occurrence counts, indexed by track id
+        degrees (ndarray): The number of playlists containing each track
+        neighbours (int): The maximum number of neighbours kept per track
+        edges (int): The number of incidence edges the index reflects, used to detect a stale index
+    """
+    file_name = 'track_cooccurrence.npz'
+    chunk_rows = 2048  # Rows multiplied per block, bounding the memory of the unpruned product
+
+    def __init__(self, matrix, degrees, neighbours: int = 50, edges: int = 0):
+        """The initialization of the Co-occurrence Index class
+
+        Args:
+            matrix (csr_matrix): The (tracks, tracks) pruned co-occurrence counts
+            degrees (ndarray): The number of playlists containing each track
+            neighbours (int): The maximum number of neighbours kept per track
+            edges (int): The number of incidence edges the index reflects
+        """
+        self.matrix = matrix
+        self.degrees = degrees
+        self.neighbours = neighbours
+        self.edges = edges
+
+    @classmethod
+    def build(cls, incidence: PlaylistIncidence, neighbours: int = 50):
+        """Method builds the co-occurrence index of all tracks of the incidence
+
+        Args:
+            incidence (PlaylistIncidence): The playlist membership of the crawled tracks
+            neighbours (int): The maximum number of neighbours kept per track
+
+        Returns:
+            (CooccurrenceIndex): The co-occurrence index
+        """
+        incidence_matrix = incidence.matrix()
+        rows = np.arange(incidence_matrix.shape[0])
+        matrix = cls.compute_rows(incidence_matrix, rows, neighbours)
+        degrees = np.asarray(incidence_matrix.sum(axis=1)).ravel()
+        return cls(matrix, degrees, neighbours, len(incidence))
+
+    @classmethod
+    def compute_rows(cls, incidence_matrix, rows, neighbours: int):
+        """Method computes the pruned co-occurrence rows of the given tracks
+
+        Args:
+            incidence_matrix (csr_matrix): The (tracks, playlists) incidence matrix
+            rows (ndarray): The track ids of the rows to compute
+            neighbours (int): The maximum number of neighbours kept per row
+
+        Returns:
+            (csr_matrix): A (tracks, tracks) matrix holding the computed rows (all other rows are empty)
+        """
+        from scipy import sparse
+
+        size = incidence_matrix.shape[0]
+        blocks = [sparse.csr_matrix((size, size), dtype=np.float32)]
+        for start in range(0, rows.shape[0], cls.chunk_rows):
+            block_rows = rows[start: start + cls.chunk_rows]
+            block = (incidence_matrix[block_rows] @ incidence_matrix.T).tocoo()
+            block_rows, columns, counts = block_rows[block.row], block.col, block.data
+            keep = block_rows != columns  # A track is not its own neighbour
+            block_rows, columns, counts = block_rows[keep], columns[keep], counts[keep]
+
+            order = np.lexsort((columns, -counts, block_rows))  # Per row, by descending count (ties by track id)
+            block_rows, columns, counts = block_rows[order], columns[order], counts[order]
+            starts = np.searchsorted(block_rows, block_rows, side='left')
+            keep = np.arange(block_rows.shape[0]) - starts < neighbours  # Rank within the row
+            blocks.append(sparse.csr_matrix((counts[keep], (block_rows[keep], columns[keep])), shape=(size, size)))
+        return sum(blocks[1:], blocks[0]).tocsr()
+
+    def update(self, incidence: PlaylistIncidence, playlist_ids):
+        """Method updates the index after the incidence gained tracks in the given playlists
+
+        Args:
+            incidence (PlaylistIncidence): The updated playlist membership of the crawled tracks
+            playlist_ids (ndarray): The ids of the playlists that gained tracks (see `PlaylistIncidence.update()`)
+        """
+        from scipy import sparse
+
+        incidence_matrix = incidence.matrix()
+        size = incidence_matrix.shape[0]
+        matrix = self.matrix.copy()
+        matrix.resize((size, size))  # New tracks extend the index
+        rows = incidence.tracks_in(playlist_ids)
+        if rows.shape[0] != 0:
+            keep = np.ones(size, dtype=np.float32)
+            keep[rows] = 0
+            matrix = sparse.diags(keep) @ matrix + self.compute_rows(incidence_matrix, rows, self.neighbours)
+            matrix.eliminate_zeros()
+        self.matrix = matrix.tocsr()
+        self.degrees = np.asarray(incidence_matrix.sum(axis=1)).ravel()
+        self.edges = len(incidence)
+
+    @classmethod
+    def load(cls, path=None):
+        """Method loads the persisted co-occurrence index
+
+        Args:
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (CooccurrenceIndex): The loaded index, or None if no index has been persisted.
+        """
+        from scipy import sparse
+
+        path = path if path is not None else data_path(cls.file_name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            size = stored['indptr'].shape[0] - 1
+            matrix = sparse.csr_matrix((stored['data'], stored['indices'], stored['indptr']), shape=(size, size))
+            return cls(matrix, stored['degrees'], int(stored['neighbours']), int(stored['edges']))
+
+    @classmethod
+    def open(cls, incidence: PlaylistIncidence, neighbours: int = 50):
+        """Method loads the persisted co-occurrence index of an incidence, building it if it is missing or stale
+
+        Args:
+            incidence (PlaylistIncidence): The playlist membership of the crawled tracks
+            neighbours (int): The maximum number of neighbours kept per track, if the index is built
+
+        Returns:
+            (CooccurrenceIndex): The co-occurrence index reflecting the incidence
+        """
+        index = cls.load()
+        if index is not None and index.edges == len(incidence):
+            return index
+        return cls.build(incidence, neighbours)
+
+    def save(self, path=None):
+        """Method persists the co-occurrence index
+
+        Args:
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+        """
+        path = path if path is not None else data_path(self.file_name)
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                     degrees=self.degrees, neighbours=self.neighbours, edges=self.edges)
+        os.replace(path + '.tmp', path)
+
+    def score(self, track_ids):
+        """Method scores every track against a set of tracks, with a sparse matrix-vector product
+
+        The score of track j is sum_i C_ij / sqrt(d_i d_j), over the given tracks i, where d is the number of playlists
+        containing a track. This normalization prevents tracks of many (or large) playlists from dominating.
+
+        Args:
+            track_ids (ndarray): The track ids of the set (e.g. a playlist). Tracks unknown to the index are ignored.
+
+        Returns:
+            (ndarray): The score of each track id of the index
+        """
+        size = self.matrix.shape[0]
+        track_ids = np.asarray(track_ids)
+        track_ids = track_ids[(track_ids >= 0) & (track_ids < size)]
+        degrees = np.sqrt(np.maximum(self.degrees, 1))
+        query = np.zeros(size, dtype=np.float32)
+        query[track_ids] = 1 / degrees[track_ids]
+        return (self.matrix.T @ query) / degrees
+
+
+class CooccurrenceSimilarity(RankedSimilarity):
+    """The class implements a playlist co-occurrence similarity, scoring tracks by how often they share crawled
+        playlists with the tracks of the given playlist.
+
+        This class inherits the Similarity interface, and the ranking and filtering of `RankedSimilarity` (the scored
+        positions are rows of the tracks dataframe).
+
+        Note, playlist tracks that were never crawled carry no co-occurrence signal. Tracks without any co-occurrence
+        with the playlist receive a score of 0.
+
+        Attributes:
+            playlist (DataFrame): The playlist tracks dataframe
+            tracks (DataFrame): The tracks dataset dataframe
+            index (CooccurrenceIndex): The item-item co-occurrence index
+            uri_index (UriIndex): The interned track ids of the dataset layer
+            track_ids (ndarray): The interned track id of each row of the tracks dataframe
+            playlist_ids (ndarray): The interned track id of each playlist track
+            track_positions (ndarray): The rows of the tracks dataframe that are scored (tracks not in the playlist, satisfying any metadata filters)
+            unfiltered_positions (ndarray): The rows of the tracks dataframe that are scored when no metadata filters are applied
+            metadata_index (MetadataIndex): Optional prebuilt metadata index of the tracks dataframe, used to resolve filters. If None, filters are resolved by a plain mask.
+            similarity (Series): The similarity of each scored track to the playlist (The index is uris)
+        """
+    def __init__(self, playlist: pd.DataFrame, tracks: pd.DataFrame, weighted_features: list = None,
+                 index: CooccurrenceIndex = None, metadata_index: MetadataIndex = None):
+        """The initialization of the Co-occurrence Similarity class
+
+        Args:
+            playlist (DataFrame): The playlist tracks dataframe
+            tracks (DataFrame): The tracks dataset dataframe
+            weighted_features (list): Accepted for interface compatibility (see `weight_features()`)
+            index (CooccurrenceIndex): The co-occurrence index. Defaults to the persisted index (built if missing or stale).
+            metadata_index (MetadataIndex): Optional metadata index of the tracks dataframe, built once and shared across requests (see `filter_tracks()`).
+        """
+        self.playlist = playlist
+        self.tracks = tracks
+        self.uri_index = UriIndex.open()
+        self.track_ids = self.uri_index.encode(tracks['uris'])
+        self.playlist_ids = self.uri_index.encode(playlist['uris'])
+        self.index = index if index is not None else CooccurrenceIndex.open(PlaylistIncidence.open(tracks, self.uri_index))
+
+        in_playlist = self.uri_index.membership(self.playlist_ids)[self.track_ids]
+        self.track_positions = np.flatnonzero(~in_playlist)
+        self.unfiltered_positions = self.track_positions
+        self.metadata_index = metadata_index
+        self.similarity = None
+        self.weight_features(weighted_features if weighted_features is not None else [])
+
+    def calculate_similarity(self):
+        """Method calculates the co-occurrence similarity of each track to the playlist
+
+        This calculation populates the `self.similarity` field.
+        """
+        scores = self.index.score(self.playlist_ids)
+        track_ids = self.track_ids[self.track_positions]
+        similarity_score = np.zeros(track_ids.shape[0], dtype=np.float64)
+        indexed = track_ids < scores.shape[0]  # Tracks added after the index was built have no co-occurrence
+        similarity_score[indexed] = scores[track_ids[indexed]]
+        uris = self.tracks['uris'].to_numpy()[self.track_positions]
+        self.similarity = pd.Series(similarity_score, index=uris, name='sim_score')
+
+    def access_similarity_scores(self):
+        """Getter method to access the `similarity` class field.
+
+        Returns:
+            (Series): The track similarity to the playlist. Similarity is a Series using uris as the index.
+        """
+        return self.similarity
+
+    def weight_features(self, weighted_columns: list):
+        """Method records the weighted features. Co-occurrence does not use track features, weighting therefore has no
+        effect on this similarity.
+
+        Args:
+            weighted_columns: The columns to be weighted.
+        """
+        self.weighted_features = list(weighted_columns)
@@ -0,0 +1,121 @@
+from crawl_jobs import call_with_retries
+
+"""This file provides the crawl-level batching of the Spotify artist and audio feature requests.
+
+    Playlists are first listed into their own track stores. The artist and track ids needed by all listed playlists are
+    then de-duplicated and requested in full batches (50 artists, 100 audio features per call), and the results are
+    fanned back out to each playlist store. Tracks and artists shared between playlists are requested once per crawl.
+"""
+
+AUDIO_FEATURES = {'danceability': 'danceability', 'energy': 'energy', 'keys': 'key', 'loudness': 'loudness',
+                  'modes': 'mode', 'speechiness': 'speechiness', 'acousticness': 'acousticness',
+                  'instrumentalness': 'instrumentalness', 'liveness': 'liveness', 'valences': 'valence',
+                  'tempos': 'tempo', 'types': 'type', 'ids': 'id', 'track_hrefs': 'track_href',
+                  'analysis_urls': 'analysis_url', 'durations_ms': 'duration_ms', 'time_signatures': 'time_signature'}
+
+
+class CrawlBatcher:
+    """The class coalesces the artist and audio feature requests of many playlist stores into full, de-duplicated
+    batches.
+
+    Resolved artists and audio features are cached for the lifetime of the batcher (e.g. a crawl), such that ids
+    repeated across playlists are only requested once.
+
+    Attributes:
+        sp (Spotipy Authorization): The authorized spotipy credentials object
+        pending (list): The listed playlist stores awaiting artist and audio feature information
+        artists (dict): The resolved (popularity, genres) of each artist id, None if the API returned no artist
+        audio_features (dict): The resolved audio features of each track id, None if the API returned no features
+        requests (dict): The number of API calls issued per endpoint
+    """
+    artist_limit = 50  # Maximum ids per `artists()` call
+    track_limit = 100  # Maximum ids per `audio_features()` call
+
+    def __init__(self, sp):
+        """The initialization of the Crawl Batcher class
+
+        Args:
+            sp (Spotipy Authorization): The authorized spotipy credentials object
+        """
+        self.sp = sp
+        self.pending = []
+        self.artists = {}
+        self.audio_features = {}
+        self.requests = {'artists': 0, 'audio_features': 0}
+
+    def add(self, store):
+        """Method queues a listed playlist store (containing the track uris and artist uris) to be resolved
+
+        Args:
+            store (dict): The track storage object of a playlist
+        """
+        self.pending.append(store)
+
+    def resolve(self):
+        """Method requests the artist and audio feature information of all queued stores in full batches, and fans the
+        results out to each store. Tracks whose artist or audio features could not be resolved are dropped.
+
+        Note, requests are retried (see `crawl_jobs.call_with_retries()`), after which a failed request raises, leaving
+        the queued stores unresolved.
+
+        Returns:
+            (list): The resolved playlist stores
+        """
+        stores, self.pending = self.pending, []
+        self.fetch_artists([artist for store in stores for artist in store['artist_uris']])
+        self.fetch_audio_features([uri for store in stores for uri in store['uris']])
+        for store in stores:
+            self.fan_out(store)
+        return stores
+
+    def fetch_artists(self, artist_ids: list):
+        """Method requests the artists not resolved yet, in batches of `artist_limit`
+
+        Args:
+            artist_ids (list): The artist ids (may contain duplicates)
+        """
+        missing = list(dict.fromkeys(artist for artist in artist_ids if artist not in self.artists))  # Ordered unique
+        for offset in range(0, len(missing), self.artist_limit):
+            batch = missing[offset: offset + self.artist_limit]
+            self.requests['artists'] += 1
+            artists_info = call_with_retries(self.sp.artists, batch)['artists']  # Failures propagate to the caller
+            for artist_id, artist in zip(batch, artists_info):
+                self.artists[artist_id] = (artist['popularity'], artist['genres']) if artist is not None else None
+
+    def fetch_audio_features(self, track_ids: list):
+        """Method requests the audio features of the tracks not resolved yet, in batches of `track_limit`
+
+        Args:
+            track_ids (list): The track ids (may contain duplicates)
+        """
+        missing = list(dict.fromkeys(track for track in track_ids if track not in self.audio_features))
+        for offset in range(0, len(missing), self.track_limit):
+            batch = missing[offset: offset + self.track_limit]
+            self.requests['audio_features'] += 1
+            track_info = call_with_retries(self.sp.audio_features, batch)
+            for track_id, track in zip(batch, track_info):
+                self.audio_features[track_id] = track  # The API returns None for tracks without audio features
+
+    def fan_out(self, store):
+        """Method fills a listed playlist store with the resolved artist and audio feature information
+
+        Args:
+            store (dict): The track storage object of a playlist
+        """
+        resolved = [self.artists.get(artist) is not None and self.audio_features.get(uri) is not None
+                    for artist, uri in zip(store['artist_uris'], store['uris'])]
+        if not all(resolved):
+            print(f'Dropping {resolved.count(False)} tracks without artist or audio feature information')
+            for key, values in store.items():
+                if len(values) == len(resolved):  # Only the listed columns are filled at this point
+                    store[key] = [value for value, keep in zip(values, resolved) if keep]
+
+        for artist in store['artist_uris']:
+            popularity, genres = self.artists[artist]
+            store['artist_pop'].append(popularity)  # Access artist popularity
+            store['artist_genres'].append(genres)  # Access artist genres
+
+        for uri in store['uris']:
+            track = self.audio_features[uri]
+            for key, feature in AUDIO_FEATURES.items():
+                store[key].append(track[feature])
@@ -0,0 +1,244 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from dataset_store import data_path
+
+"""This file provides the persisted state of a resumable crawl, and the retrying of Spotify API calls.
+
+    A crawl flushes each completed playlist to a staging file, and records its progress (the playlists discovered per
+    country, the completed countries and playlists, the page offset of the playlist being listed and the failed
+    playlists) in a checkpoint. A crashed or rate-limited crawl is resumed from its checkpoint, rather than restarted.
+"""
+
+
+def call_with_retries(call, *args, attempts: int = 3, backoff: float = 2.0, **kwargs):
+    """Method calls a (Spotify API) function, retrying failed calls with an exponential backoff
+
+    Note, retries of the methods of an `api_metrics.InstrumentedClient` are recorded in its metrics.
+
+    Args:
+        call (callable): The function to be called
+        *args: The positional arguments of the call
+        attempts (int): The maximum number of attempts
+        backoff (float): The number of seconds waited after the first failed attempt, doubled after each further failure
+        **kwargs: The keyword arguments of the call
+
+    Returns:
+        The result of the call
+
+    Raises:
+        Exception: The error of the last attempt, if all attempts failed
+    """
+    metrics = getattr(call, 'metrics', None)  # Calls of an instrumented client record their retries
+    name = getattr(call, '__name__', 'call')
+    for attempt in range(attempts):
+        try:
+            return call(*args, **kwargs)
+        except Exception as error:
+            if attempt == attempts - 1:
+                raise
+            wait = backoff * 2 ** attempt
+            print(f'Retrying {name} in {wait:.0f}s after error: {error}')
+            if metrics is not None:
+                metrics.record_retry(name)
+                metrics.record_sleep(wait, 'retry backoff')
+            time.sleep(wait)
+
+
+class CrawlCheckpoint:
+    """The class holds the persisted progress of a crawl, and the staged tracks of its completed playlists.
+
+    Note, the tracks of a playlist are staged before the playlist is recorded as completed. A crash in between stages
+    the playlist twice on resume, which the de-duplication of `data_processing.save_data()` resolves.
+
+    Attributes:
+        countries (list): The country codes of the crawl
+        started (str): The start time of the crawl
+        playlists (dict): The discovered (uri, name) playlists of each country
+        completed_countries (list): The countries whose playlists have all been attempted
+        completed_playlists (list): The uris of the staged playlists
+        failures (dict): The number of failed attempts of each playlist that has not been staged
+        partial (dict): The listing progress of the playlist being listed (uri, page offset and listed tracks), or None
+    """
+    directory = 'crawl'
+    checkpoint_name = 'checkpoint.json'
+    staged_name = 'staged_tracks.csv'
+
+    def __init__(self, countries: list, started: str = None, playlists: dict = None, completed_countries: list = None,
+                 completed_playlists: list = None, failures: dict = None, partial: dict = None):
+        """The initialization of the Crawl Checkpoint class
+
+        Args:
+            countries (list): The country codes of the crawl
+            started (str): The start time of the crawl
+            playlists (dict): The discovered (uri, name) playlists of each country
+            completed_countries (list): The countries whose playlists have all been attempted
+            completed_playlists (list): The uris of the staged playlists
+            failures (dict): The number of failed attempts of each playlist that has not been staged
+            partial (dict): The listing progress of the playlist being listed, or None
+        """
+        self.countries = list(countries)
+        self.started = started if started is not None else datetime.now().strftime('%d-%m-%Y %H:%M:%S')
+        self.playlists = playlists if playlists is not None else {}
+        self.completed_countries = completed_countries if completed_countries is not None else []
+        self.completed_playlists = completed_playlists if completed_playlists is not None else []
+        self.failures = failures if failures is not None else {}
+        self.partial = partial
+
+    @classmethod
+    def path(cls, name=''):
+        """Method determines the path of a file in the crawl directory
+
+        Args:
+            name (str): The name of the file
+
+        Returns:
+            (str): The absolute path to the file
+        """
+        return os.path.join(data_path(cls.directory), name)
+
+    @classmethod
+    def start(cls, countries: list):
+        """Method starts a new crawl, discarding the checkpoint and staged tracks of any previous crawl
+
+        Args:
+            countries (list): The country codes of the crawl
+
+        Returns:
+            (CrawlCheckpoint): The checkpoint of the new crawl
+        """
+        shutil.rmtree(cls.path(), ignore_errors=True)
+        os.makedirs(cls.path(), exist_ok=True)
+        checkpoint = cls(countries)
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def load(cls):
+        """Method loads the checkpoint of an unfinished crawl
+
+        Returns:
+            (CrawlCheckpoint): The checkpoint, or None if no crawl is in progress
+        """
+        if not os.path.exists(cls.path(cls.checkpoint_name)):
+            return None
+        with open(cls.path(cls.checkpoint_name), 'r') as file:
+            return cls(**json.load(file))
+
+    def save(self):
+        """Method atomically persists the checkpoint"""
+        state = {'countries': self.countries, 'started': self.started, 'playlists': self.playlists,
+                 'completed_countries': self.completed_countries, 'completed_playlists': self.completed_playlists,
+                 'failures': self.failures, 'partial': self.partial}
+        with open(self.path(self.checkpoint_name + '.tmp'), 'w') as file:
+            json.dump(state, file)
+        os.replace(self.path(self.checkpoint_name + '.tmp'), self.path(self.checkpoint_name))
+
+    def discover(self, country: str, uris: list, names: list):
+        """Method records the playlists discovered for a country, such that a resumed crawl uses the same playlists
+
+        Args:
+            country (str): The country code
+            uris (list): The uris of the discovered playlists
+            names (list): The names of the discovered playlists
+        """
+        self.playlists[country] = [[uri, name] for uri, name in zip(uris, names)]
+        self.save()
+
+    def record_page(self, uri: str, offset: int, store: dict):
+        """Method records the listing progress of a playlist, after a page of its tracks has been listed
+
+        Args:
+            uri (str): The uri of the playlist
+            offset (int): The offset of the next page
+            store (dict): The track storage object holding the listed tracks
+        """
+        self.partial = {'uri': uri, 'offset': offset, 'store': {key: list(values) for key, values in store.items()}}
+        self.save()
+
+    def resume_listing(self, uri: str):
+        """Method provides the listing progress of a playlist, if its listing was interrupted
+
+        Args:
+            uri (str): The uri of the playlist
+
+        Returns:
+            store (dict): The track storage object holding the listed tracks, or None if there is no progress
+            offset (int): The offset of the next page (0 if there is no progress)
+        """
+        if self.partial is None or self.partial['uri'] != uri:
+            return None, 0
+        return {key: list(values) for key, values in self.partial['store'].items()}, self.partial['offset']
+
+    def is_completed(self, uri: str):
+        """Method determines whether a playlist has been staged
+
+        Args:
+            uri (str): The uri of the playlist
+
+        Returns:
+            (bool): True if the playlist tracks have been staged
+        """
+        return uri in self.completed_playlists
+
+    def stage(self, uri: str, store: dict):
+        """Method flushes the tracks of a completed playlist to the staging file, and records its completion
+
+        Args:
+            uri (str): The uri of the playlist
+            store (dict): The track storage object of the playlist
+        """
+        staged_path = self.path(self.staged_name)
+        pd.DataFrame.from_dict(store).to_csv(staged_path, mode='a', header=not os.path.exists(staged_path), index=False)
+        self.completed_playlists.append(uri)
+        self.failures.pop(uri, None)
+        self.partial = None
+        self.save()
+
+    def fail(self, uri: str):
+        """Method records a failed attempt of a playlist. Its listing progress is kept, such that a retry resumes it.
+
+        Args:
+            uri (str): The uri of the playlist
+        """
+        self.failures[uri] = self.failures.get(uri, 0) + 1
+        self.save()
+
+    def complete_country(self, country: str):
+        """Method records that all playlists of a country have been attempted
+
+        Args:
+            country (str): The country code
+        """
+        self.completed_countries.append(country)
+        self.save()
+
+    def retryable_playlists(self, max_attempts: int):
+        """Method determines the failed playlists that have attempts left
+
+        Args:
+            max_attempts (int): The maximum number of attempts per playlist
+
+        Returns:
+            (list): The (uri, name) of each retryable playlist
+        """
+        return [(uri, name) for playlists in self.playlists.values() for uri, name in playlists
+                if not self.is_completed(uri) and 0 < self.failures.get(uri, 0) < max_attempts]
+
+    def staged_tracks(self):
+        """Method reads the staged tracks of the crawl
+
+        Returns:
+            (DataFrame): The staged tracks (empty if no playlist has been staged)
+        """
+        staged_path = self.path(self.staged_name)
+        return pd.read_csv(staged_path) if os.path.exists(staged_path) else pd.DataFrame()
+
+    def finish(self):
+        """Method discards the checkpoint and staged tracks, once they have been saved into the tracks dataset"""
+        shutil.rmtree(self.path(), ignore_errors=True)
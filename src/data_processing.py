@@ -1,10 +1,20 @@
-import os
-import time
 from datetime import datetime
+import numpy as np
 import pandas as pd
-import spotipy
-import streamlit as st
-from spotipy import SpotifyClientCredentials
+
+from api_metrics import ApiMetrics, InstrumentedClient, throttle
+from artist_centroids import ArtistCentroidIndex
+from cooccurrence import CooccurrenceIndex, PlaylistIncidence, playlist_keys
+from crawl_batching import CrawlBatcher
+from crawl_jobs import CrawlCheckpoint, call_with_retries
+from dataset_store import (DatasetExports, DatasetLock, TrackPartitions, TrackSample, UriIndex, data_path,
+                           dataset_version, write_csv)
+from feature_store import FeatureStore
+from genres import GenreIndex, GenreVocabulary
+from playlist_cache import PlaylistCache
+from projection import FeatureProjection
+from quantised_similarity import QuantisedIndex
+from spotify_client import retry_listeners
 
 """This file forms the basis of Spotify data processing.
 
@@ -13,21 +23,42 @@ from spotipy import SpotifyClientCredentials
 """
 
 
-def target_playlist_extraction(sp, url, name):
+def target_playlist_extraction(sp, url, name, save=False, cache: PlaylistCache = None):
     """This method extracts all track information from a given target playlist
+
+    Note, by default nothing is written to disk, such that the playlist can be scored in memory on the request path.
+
+    If a playlist cache is given, the snapshot id of the playlist is requested first. An unchanged playlist is served
+    from the cache (counted by `PlaylistCache.hits`), while a changed playlist requests the artist and audio features
+    of its new tracks only.
+
     Args:
         sp (Spotipy Authorization): The authorized spotipy credentials object
         url (str): The url of the playlist from which to extract information
         name (str): The name of the playlist
+        save (bool): If True, the playlist is saved to the `target.csv` file.
+        cache (PlaylistCache): Optional cache of extracted playlists, keyed by playlist id and snapshot id
 
     Returns:
         (dict): A dictionary containing all features and information pertaining to the target playlist.
     """
     uri = url2uri(url)  # Extract the uri
-    store = construct_storage()  # Create the info storage
-    extract_tracks(sp, uri, store)  # Extract track information
+    if cache is None:
+        store = construct_storage()  # Create the info storage
+        extract_tracks(sp, uri, store)  # Extract track information
+    else:
+        snapshot_id = call_with_retries(sp.playlist, uri, fields='snapshot_id')['snapshot_id']  # Metadata call only
+        store = cache.get(uri, snapshot_id)
+        if store is None:  # New or changed playlist
+            store = construct_storage()
+            batcher = CrawlBatcher(sp)
+            cache.seed(uri, batcher)  # Tracks of the cached version are not requested again
+            extract_tracks(sp, uri, store, batcher)
+            batcher.resolve()
+            cache.put(uri, snapshot_id, store)
     add_playlist_tracking(name, store)  # Add playlist information (name)
-    save_data(store, 'target.csv')  # Save the data (Update tracks.csv) dataset
+    if save:
+        save_data(store, 'target.csv')  # Save the data (Update target.csv)
     return store
 
 
@@ -42,61 +73,220 @@ def url2uri(url):
     return url.split('/')[-1].split('?')[0]
 
 
-def top_playlist_extraction(sp):
+def top_playlist_extraction(sp, resume=True, max_attempts=3):
     """Method extracts the tracks in the 20 top-performing playlists from a selection of countries
      The countries include: Australia, UK, USA, Canada, Jamaica, South Africa
 
      This method does not return any information, but stores it in the tracks.csv dataset file.
 
+     The crawl is checkpointed (see `crawl_jobs.CrawlCheckpoint`): each completed playlist is flushed to a staging
+     file, such that only a single playlist is held in memory. An interrupted crawl resumes from its checkpoint, and
+     failed playlists are retried at the end of the crawl. The staged tracks are saved into the dataset once.
+
+     The API calls of the crawl are instrumented (see `api_metrics.py`): live counters are printed after each playlist,
+     and a JSON summary of the crawl is saved to `data/crawl_metrics`.
+
      Args:
          sp (Spotipy Authorization): The authorized spotipy credentials object
+         resume (bool): If True, an unfinished crawl is resumed from its checkpoint. If False, a new crawl is started.
+         max_attempts (int): The maximum number of attempts per playlist
     """
     countries = ['AU', 'GB', 'US', 'CA', 'JM', 'ZA']
+    metrics = ApiMetrics()
+    sp = InstrumentedClient(sp, metrics)  # Record the calls, latencies, retries and sleeps of the crawl
+    retry_listeners.append(metrics.record_session_retry)  # Record the retries made within the pooled session
+    try:
+        checkpoint = CrawlCheckpoint.load() if resume else None
+        if checkpoint is None:
+            checkpoint = CrawlCheckpoint.start(countries)
+        else:
+            print(f'Resuming crawl started {checkpoint.started} ({len(checkpoint.completed_playlists)} playlists staged)')
+        batcher = CrawlBatcher(sp)  # Caches the artists and audio features requested during the crawl
+
+        for country in checkpoint.countries:  # Iterate through countries
+            if country in checkpoint.completed_countries:
+                continue
+            print(f'Country: {country}')
+            if country not in checkpoint.playlists:
+                top_playlists, names = find_top_playlists(sp, country)  # Find top 20 playlists in each country
+                checkpoint.discover(country, top_playlists, names)
+
+            for playlist, name in checkpoint.playlists[country]:  # Iterate through playlists
+                if not checkpoint.is_completed(playlist):
+                    crawl_playlist(sp, playlist, name, batcher, checkpoint)
+                    print(metrics.live())
+            checkpoint.complete_country(country)
+            print('-----------------------------------------------------------------------------')
+
+        for attempt in range(1, max_attempts):  # Retry the failed playlists
+            for playlist, name in checkpoint.retryable_playlists(max_attempts):
+                print(f'Retrying playlist {name} (attempt {attempt + 1})')
+                crawl_playlist(sp, playlist, name, batcher, checkpoint)
+    finally:
+        retry_listeners.remove(metrics.record_session_retry)  # Also if the crawl is interrupted
+    print(metrics.live())
+    print(f'API metrics saved to {metrics.save()}')
+
+    staged = checkpoint.staged_tracks()
+    if staged.shape[0] != 0:
+        save_data(staged.to_dict('list'), source='crawl')  # Save the data into a new crawl partition
+    checkpoint.finish()
+
+
+def crawl_playlist(sp, playlist_uri, name, batcher: CrawlBatcher, checkpoint: CrawlCheckpoint):
+    """Method extracts the tracks of a single playlist during a crawl, and flushes them to the crawl staging file
+
+    A failure is recorded on the checkpoint (keeping the listing progress), such that the playlist can be retried.
 
-    tracks_store = construct_storage()  # Construct track info storage
+    Args:
+        sp (Spotipy Authorization): The authorized spotipy credentials object
+        playlist_uri (str): The URI of the Spotify playlist
+        name (str): The name of the playlist
+        batcher (CrawlBatcher): The crawl-level batcher, caching artists and audio features across playlists
+        checkpoint (CrawlCheckpoint): The checkpoint of the crawl
+    """
+    try:
+        print(f'Playlist name: {name}')
+        store, offset = checkpoint.resume_listing(playlist_uri)
+        store = store if store is not None else construct_storage()
+        list_playlist_tracks(sp, playlist_uri, store, offset, checkpoint)
+        add_playlist_tracking(name, store)
+        batcher.add(store)
+        batcher.resolve()  # Request the artists and audio features not requested earlier in the crawl
+        checkpoint.stage(playlist_uri, store)  # Flush the playlist tracks
+        throttle(sp, 2)  # Respect APi limits through a forced sleep
+    except Exception as error:
+        print(f'Error accessing playlist {name} tracks: {error}')
+        checkpoint.fail(playlist_uri)
+
+
+def save_data(tracks_store, name='tracks.csv', source='submission'):
+    """Method deals with saving collected track data
 
-    for country in countries:  # Iterate through countries
-        print(f'Country: {country}')
-        top_playlists, names = find_top_playlists(sp, country)  # Find top 20 playlists in each country
+    Note, this method removes all duplicate tracks, such that all tracks within the dataset are unique, always keeping
+    most up-to-date representation of each track. De-duplication is performed on the interned track ids of the
+    `UriIndex`. Saving to the tracks dataset also updates the persisted uri index, the playlist co-occurrence index
+    (from the playlist membership of all collected tracks, before de-duplication) and the derived dataset artifacts.
 
-        for playlist, name in zip(top_playlists[:], names[:]):  # Iterate through playlists
-            try:
-                print(f'Playlist name: {name}')
-                store = construct_storage()
-                extract_tracks(sp, playlist, store)
-                add_playlist_tracking(name, store)
-                merge_stores(tracks_store, store)  # Merge the playlist information, by merging the data stored.
-                time.sleep(2)  # Respect APi limits through a forced sleep
-            except Exception:
-                print(f"Error accessing playlist {name} tracks")
-        print('-----------------------------------------------------------------------------')
+    The whole read-modify-write is performed under the cross-process `DatasetLock`, and the file is replaced
+    atomically, such that concurrent writers never lose each other's updates, and readers never observe a partially
+    written file.
 
-    save_data(tracks_store)  # Save the data
+    The collected tracks are stamped with their ingest time (`ingested_at`) and written to the partitions of the tracks
+    dataset (see `TrackPartitions`): a crawl creates a new partition, while submitted playlists are merged into the
+    submission partition of the current crawl interval. `tracks.csv` remains the merged view of all partitions. A
+    dataset saved before partitioning was introduced is first migrated into a single `legacy` partition.
 
+    Args:
+        tracks_store (dict): The dictionary containing all information extracted about the tracks
+        name (str): The name of the file to save the information to. Default is the tracks.csv dataset file.
+        source (str): The source of the tracks, `crawl` (creating a crawl partition) or `submission` (submitted playlists)
 
-def save_data(tracks_store, name='tracks.csv'):
-    """Method deals with saving collected track data
+    Returns:
+        (DataFrame): The saved dataframe, None if the submitted tracks were all in the dataset already (nothing is saved)
+    """
+    with DatasetLock():  # Excludes concurrent writers (e.g. the write-behind queues of other processes)
+        file_path = data_path(name)
+        df_new = pd.DataFrame.from_dict(tracks_store)  # Create a dataframe from the collected data
+        df_old = pd.read_csv(file_path, index_col=0)  # Create dataframe from old values
+        if name == 'tracks.csv':
+            ingested_at = datetime.now()
+            df_new['ingested_at'] = ingested_at.strftime(TrackPartitions.timestamp_format)
+            partitions = TrackPartitions.open(df_old)  # Migrates an unpartitioned dataset into the legacy partition
+
+        if df_old.shape[0] != 0 and name == "tracks.csv":  # Previously saved songs, requiring further processing to have unique values only
+            uri_index = UriIndex.open()
+            old_ids = uri_index.encode(df_old['uris'])
+            if source == 'submission' and uri_index.membership(old_ids)[uri_index.lookup(df_new['uris'])].all():
+                return None  # Every submitted track is in the dataset already (e.g. playlists served from the cache)
+            new_ids = uri_index.encode(df_new['uris'])
+            update_playlist_cooccurrence(df_old, df_new, uri_index)
+            _, first = np.unique(new_ids, return_index=True)  # Drop duplicates within the new tracks (keeping the first)
+            df_new = df_new.iloc[np.sort(first)]
+            replaced = uri_index.membership(new_ids)[old_ids]  # Drop old tracks that were collected again (keeping most up to date)
+            df_unique = pd.concat([df_new, df_old[~replaced]], axis=0)
+            df_unique = df_unique.reset_index(drop=True)
+            write_csv(df_unique, file_path, mode='w')
+            uri_index.save()
+            partition = partitions.append(df_new, ingested_at, source)
+            update_dataset_artifacts(df_unique, partitions, partition, deferred=source == 'submission')
+            return df_unique
+        else:
+            write_csv(df_new, file_path, mode='w')
+            if name == 'tracks.csv':
+                uri_index = UriIndex.open()
+                uri_index.encode(df_new['uris'])
+                update_playlist_cooccurrence(df_old, df_new, uri_index)
+                uri_index.save()
+                partition = partitions.append(df_new, ingested_at, source)
+                update_dataset_artifacts(df_new, partitions, partition, deferred=source == 'submission')
+            return df_new
 
-    Note, this method removes all duplicate tracks, such that all tracks within the dataset are unique, always keeping
-    most up-to-date representation of each track.
+
+def update_playlist_cooccurrence(df_old, df_collected, uri_index):
+    """Method records the playlist membership of collected tracks, and incrementally updates the playlist
+    co-occurrence index (see `cooccurrence.py`).
+
+    Note, the membership is recorded before de-duplication, as the tracks dataset only keeps the latest playlist of
+    each track.
 
     Args:
-        tracks_store (dict): The dictionary containing all information extracted about the tracks
-        name (str): The name of the file to save the information to. Default is the tracks.csv dataset file.
+        df_old (DataFrame): The previously saved tracks, from which the incidence is built if none has been persisted
+        df_collected (DataFrame): The collected tracks (before de-duplication)
+        uri_index (UriIndex): The uri index of the dataset layer
+    """
+    incidence = PlaylistIncidence.open(df_old, uri_index)
+    index = CooccurrenceIndex.open(incidence)  # The index matching the incidence, before the collected tracks
+    playlist_ids = incidence.update(uri_index.encode(df_collected['uris']), playlist_keys(df_collected))
+    index.update(incidence, playlist_ids)
+    incidence.save()
+    index.save()
+
+
+def update_dataset_artifacts(df, partitions: TrackPartitions = None, partition: str = None, deferred: bool = False):
+    """Method updates the artifacts derived from the tracks dataset, after the dataset has been saved.
+
+    The artifacts include:
+    - The persisted genre vocabulary (`data/genre_vocabulary.npz`), interning the genres of newly added artists.
+    - The inverted genre index (`data/genre_index.npz`), from which similarity candidates are generated.
+    - The published feature store (`data/track_features.mias`), shared read-only by all recommender processes. For a
+      partitioned dataset, only the newly ingested partition is encoded (see `FeatureStore.publish_partitions()`).
+    - The int8 quantised index of the feature store (`data/track_features_int8.npz`).
+    - The truncated SVD projection of the feature store (`data/track_features_svd.npz`).
+    - The artist centroid vectors of the feature store (`data/artist_centroids.npz`).
+    - The reservoir sample of tracks (`data/tracks_sample.csv`), used by the dataset page.
+    - The compressed, versioned download artifacts (`data/exports`), served by the dataset page.
+
+    Note, the genres of each artist are parsed once at ingest, such that the pipeline computes genre features from
+    integer codes rather than re-tokenizing the `artist_genres` strings.
+
+    Deferred updates (the write-behind flushes of submitted playlists) only refresh the incremental artifacts. The
+    quantised index, projection, artist centroids and export artifacts are rebuilt by the next crawl, and the engines
+    scan the feature store exactly while they are stale.
 
+    Args:
+        df (DataFrame): The dataframe containing all stored tracks
+        partitions (TrackPartitions): The partitions of the tracks dataset, None if the dataset is not partitioned
+        partition (str): The name of the newly ingested partition
+        deferred (bool): If True, the rebuild of the vector indexes and export artifacts is deferred to the next crawl
     """
-    root_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
-    file_path = os.path.join(root_path, 'data', name)
-    df_new = pd.DataFrame.from_dict(tracks_store)  # Create a dataframe from the collected data
-    df_old = pd.read_csv(file_path, index_col=0)  # Create dataframe from old values
-
-    if df_old.shape[0] != 0 and name == "tracks.csv":  # Previously saved songs, requiring further processing to have unique values only
-        df_combined = pd.concat([df_new, df_old], axis=0)
-        df_unique = df_combined.drop_duplicates(subset='uris', keep='first')  # Drop duplicates (keeping most up to date)
-        df_unique = df_unique.reset_index(drop=True)
-        df_unique.to_csv(file_path, mode='w')
+    vocabulary = GenreVocabulary.publish(df)  # Persisted (under the dataset lock) if artists were interned
+    GenreIndex.publish(df, vocabulary)
+    if partitions is not None:
+        feature_store = FeatureStore(FeatureStore.publish_partitions(df, partitions, partition))
     else:
-        df_new.to_csv(file_path, mode='w')
+        feature_store = FeatureStore(FeatureStore.publish(df))
+
+    sample = TrackSample.load()
+    sample = sample if sample is not None else TrackSample()
+    sample.update(df, UriIndex.open(), version=dataset_version())
+    sample.save()
+    if deferred:
+        return
+    QuantisedIndex.publish(feature_store)
+    FeatureProjection.publish(feature_store)
+    ArtistCentroidIndex.publish(feature_store, df)
+    DatasetExports.publish()
 
 
 def construct_storage():
@@ -178,65 +368,6 @@ def process_items(store, items):
     return store
 
 
-def extract_artist_info(store, sp):
-    """Method deals with extracting artist information from the `artists()` API call through Spotipy
-
-    Args:
-        store (dict): The object in which to store extracted information
-        sp (Spotipy Authorization): The authorized spotipy credentials object
-    """
-    limit = 50
-    offset = 0
-    while offset < len(store['artist_uris']):
-        if offset + limit > len(store['artist_uris']):  # If else, deals with batching
-            artists_info = sp.artists(store['artist_uris'][offset: len(store['artist_uris'])])  # Gather artis info through API
-        else:
-            artists_info = sp.artists(store['artist_uris'][offset: offset + limit])  # Gather artis info through API
-
-        for artist in artists_info['artists']:  # Extract popularity and genres from each artist
-            store['artist_pop'].append(artist['popularity'])  # Access artist popularity
-            store['artist_genres'].append(artist['genres'])  # Access artist genres
-
-        offset = offset + limit
-
-
-def extract_audio_features(store, sp):
-    """Method deal with extracting audio analysis features for a given batch of tracks
-
-    Args:
-        store (dict): The object in which to store extracted information
-        sp (Spotipy Authorization): The authorized spotipy credentials object
-    """
-    limit = 100
-    offset = 0
-    while offset < len(store['uris']):
-        if offset + limit > len(store['uris']):   # If else, deals with batching of acoustic features
-            track_info = sp.audio_features(store['uris'][offset: len(store['uris'])])
-        else:
-            track_info = sp.audio_features(store['uris'][offset: offset + limit])
-
-        for track in track_info:  # For each track extract the necessary features and store it
-            store['danceability'].append(track['danceability'])
-            store['energy'].append(track['energy'])
-            store['keys'].append(track['key'])
-            store['loudness'].append(track['loudness'])
-            store['modes'].append(track['mode'])
-            store['speechiness'].append(track['speechiness'])
-            store['acousticness'].append(track['acousticness'])
-            store['instrumentalness'].append(track['instrumentalness'])
-            store['liveness'].append(track['liveness'])
-            store['valences'].append(track['valence'])
-            store['tempos'].append(track['tempo'])
-            store['types'].append(track['type'])
-            store['ids'].append(track['id'])
-            store['track_hrefs'].append(track['track_href'])
-            store['analysis_urls'].append(track['analysis_url'])
-            store['durations_ms'].append(track['duration_ms'])
-            store['time_signatures'].append(track['time_signature'])
-
-        offset = offset + limit
-
-
 def merge_stores(tracks_store, store):
     """Method deals with merging one store into another
     Args:
@@ -247,28 +378,51 @@ def merge_stores(tracks_store, store):
         tracks_store[key].extend(value)
 
 
-def extract_tracks(sp, playlist_uri, store):
+def extract_tracks(sp, playlist_uri, store, batcher: CrawlBatcher = None):
     """Method deals with extracting tracks from a given playlist
     Note, this method forms the cornerstone of extraction, providing track access from a playlist.
 
+    The artist and audio feature information of the tracks is requested through a `CrawlBatcher`. If a batcher is
+    given, the store is queued on it and only filled once `batcher.resolve()` is called (coalescing the requests of
+    many playlists). Otherwise, the store is filled immediately.
+
     Args:
         sp (Spotipy Authorization): The authorized spotipy credentials object
         playlist_uri (str): The URI of the Spotify playlist
         store (dict): The object in which to store extracted information
+        batcher (CrawlBatcher): Optional crawl-level batcher, deferring the artist and audio feature requests
+    """
+    list_playlist_tracks(sp, playlist_uri, store)
+
+    if batcher is None:
+        batcher = CrawlBatcher(sp)
+        batcher.add(store)
+        batcher.resolve()  # Extract the artist and audio features for each track
+    else:
+        batcher.add(store)
+
+
+def list_playlist_tracks(sp, playlist_uri, store, offset=0, checkpoint: CrawlCheckpoint = None):
+    """Method lists the tracks of a playlist page by page into a store (without artist and audio feature information)
+
+    Args:
+        sp (Spotipy Authorization): The authorized spotipy credentials object
+        playlist_uri (str): The URI of the Spotify playlist
+        store (dict): The object in which to store extracted information
+        offset (int): The offset of the first page to be listed (e.g. when resuming an interrupted listing)
+        checkpoint (CrawlCheckpoint): Optional crawl checkpoint, recording the listing progress after each page
     """
-    offset = 0
     limit = 100
-    playlist = sp.playlist_tracks(playlist_uri, limit=2, offset=offset)  # Retrieve the initial batch of songs
+    playlist = call_with_retries(sp.playlist_tracks, playlist_uri, limit=2, offset=0)  # Retrieve the initial batch of songs
     total_songs = playlist['total']  # Extract the total number of songs
 
     while offset < total_songs:
-        time.sleep(2)
-        playlist = sp.playlist_tracks(playlist_uri, limit=100, offset=offset)  # Retrieve batch of songs in playlist
+        throttle(sp, 2)
+        playlist = call_with_retries(sp.playlist_tracks, playlist_uri, limit=limit, offset=offset)  # Retrieve batch of songs in playlist
         store = retrieve_batch_info(playlist, store)  # Retrieve batch information
         offset = offset + limit  # Update offset
-
-    extract_artist_info(store, sp)  # Extract the artist features for each track
-    extract_audio_features(store, sp)  # Extract the audio features for each track
+        if checkpoint is not None:
+            checkpoint.record_page(playlist_uri, offset, store)
 
 
 def find_top_playlists(sp, country):
@@ -284,7 +438,7 @@ def find_top_playlists(sp, country):
     """
     uris = []
     names = []
-    playlists = sp.featured_playlists(country=country, limit=20)
+    playlists = call_with_retries(sp.featured_playlists, country=country, limit=20)
     playlist_items = playlists['playlists']['items']
 
     for item in playlist_items:  # Extract the uri and name from each playlist
@@ -303,30 +457,33 @@ def add_playlist_tracking(name, store):
     store['playlist_name'] = [name] * len(store['uris'])
 
 
-def update_tracking(df):
+def update_tracking(df, deferred: bool = False):
     """Method updates the `dataset_growth.csv` file when new tracks are added to the dataset to record dataset growth
 
     Args:
         df (DataFrame): The dataframe containing all stored tracks, including new additions
+        deferred (bool): If True, the export artifacts of the growth dataset are published by the next crawl instead
     """
-    root_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))  # Read in the growth dataset
-    file_path = os.path.join(root_path, 'data', 'dataset_growth.csv')
-    tracking_df = pd.read_csv(file_path, index_col=0)
+    file_path = data_path('dataset_growth.csv')  # Read in the growth dataset
+    with DatasetLock():
+        tracking_df = pd.read_csv(file_path, index_col=0)
 
-    current_time = datetime.now()  # Extract new features to update the growth dataset with
-    new_length = df.shape[0]
-    new_entry = pd.DataFrame.from_dict({'date': [current_time.strftime("%d-%m-%Y")],
-                                        'time': [current_time.strftime("%H:%M:%S")],
-                                        'track_count': [new_length]})
+        current_time = datetime.now()  # Extract new features to update the growth dataset with
+        new_length = df.shape[0]
+        new_entry = pd.DataFrame.from_dict({'date': [current_time.strftime("%d-%m-%Y")],
+                                            'time': [current_time.strftime("%H:%M:%S")],
+                                            'track_count': [new_length]})
 
-    tracking_df = pd.concat([tracking_df, new_entry], axis=0, ignore_index=True)  # Update growth dataset
-    tracking_df.reset_index(drop=True)
-    tracking_df.to_csv(file_path, mode='w')
+        tracking_df = pd.concat([tracking_df, new_entry], axis=0, ignore_index=True)  # Update growth dataset
+        tracking_df.reset_index(drop=True)
+        write_csv(tracking_df, file_path, mode='w')
+        if not deferred:
+            DatasetExports.publish()  # Update the download artifacts of the growth dataset
 
 
 if __name__ == "__main__":
-    client_credentials_manager = SpotifyClientCredentials(client_id=st.secrets['CLIENT_ID'],
-                                                          client_secret=st.secrets[
-                                                              'CLIENT_SECRET'])  # Set up Spotify Credentials
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+    import streamlit as st  # Only the crawler requires the secrets, not the modules importing this file
+    from spotify_client import shared_client
+
+    sp = shared_client(st.secrets['CLIENT_ID'], st.secrets['CLIENT_SECRET'])  # Pooled client, reusing its access token
     top_playlist_extraction(sp)
\ No newline at end of file
@@ -0,0 +1,858 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, zstd compressed csv exports are skipped without it
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # fcntl is unavailable on Windows, where the dataset lock only excludes threads of the process
+    fcntl = None
+
+"""This file forms the dataset layer of the MIAS application.
+
+    It provides access to the files stored in the `data` directory, and maintains the persistent structures derived
+    from the tracks dataset, such as the interned track identities, the time partitions of ingested tracks and the
+    reservoir sample of tracks.
+"""
+
+
+redirected_directories = []  # The directories replacing the `data` directory (see `redirect_data()`), innermost last
+
+
+def data_path(name):
+    """Method determines the path of a file stored in the `data` directory (or the directory it is redirected to)
+
+    Args:
+        name (str): The name of the file
+
+    Returns:
+        (str): The absolute path to the file
+    """
+    if len(redirected_directories) != 0:
+        return os.path.join(redirected_directories[-1], name)
+    root_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+    return os.path.join(root_path, 'data', name)
+
+
+@contextmanager
+def redirect_data(directory: str):
+    """Method redirects the files of the `data` directory to another directory within the context, such that offline
+    tools (e.g. the evaluation harness) persist the artifacts they derive there, rather than into the dataset.
+
+    Note, the redirect applies to the whole process, and is not intended for use by the recommender.
+
+    Args:
+        directory (str): The directory replacing the `data` directory
+    """
+    redirected_directories.append(os.path.abspath(directory))
+    try:
+        yield directory
+    finally:
+        redirected_directories.pop()
+
+
+def file_key(path):
+    """Method determines a cheap key of the state of a file on disk
+
+    Args:
+        path (str): The path to the file
+
+    Returns:
+        (tuple): The modification time and size of the file, None if the file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_csv(df: pd.DataFrame, path: str, **kwargs):
+    """Method atomically writes a dataframe to a csv file, such that readers never observe a partially written file
+
+    Args:
+        df (DataFrame): The dataframe to be written
+        path (str): The path to the csv file
+        **kwargs: The keyword arguments of `DataFrame.to_csv()`
+    """
+    df.to_csv(path + '.tmp', **kwargs)
+    os.replace(path + '.tmp', path)
+
+
+def save_versioned(path: str, version: str, **arrays):
+    """Method atomically persists the arrays of an artifact derived from a dataset version (e.g. an index of the feature
+    store), together with the version
+
+    Args:
+        path (str): The path to the artifact file
+        version (str): The dataset version the artifact was derived from
+        **arrays: The named arrays of the artifact
+    """
+    with open(path + '.tmp', 'wb') as file:
+        np.savez(file, version=np.asarray(str(version), dtype=str), **arrays)
+    os.replace(path + '.tmp', path)
+
+
+def load_versioned(path: str, version: str):
+    """Method loads the arrays of an artifact persisted by `save_versioned()`, if it was derived from the given version
+
+    Args:
+        path (str): The path to the artifact file
+        version (str): The current dataset version
+
+    Returns:
+        (dict): The named arrays of the artifact (without the version), None if the artifact is missing or stale
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as stored:
+        if str(stored['version']) != str(version):
+            return None
+        return {name: stored[name] for name in stored.files if name != 'version'}
+
+
+class DatasetLock:
+    """The class provides the exclusive, cross-process lock of the dataset files, held for the whole
+    read-modify-write of the tracks dataset (and the structures maintained with it).
+
+    The lock is an advisory `flock` of `data/dataset.lock`. It is re-entrant within a thread, such that a method holding
+    the lock may call further methods taking it. All instances share the lock state of the process.
+
+    Usage:
+        with DatasetLock():
+            ...
+    """
+    file_name = 'dataset.lock'
+    thread_lock = threading.RLock()  # Excludes the other threads of the process
+    depth = 0  # The re-entrant depth of the holding thread
+    file = None  # The open lock file, while the lock is held
+
+    def __enter__(self):
+        """Method acquires the lock, blocking until it is released by any other thread or process"""
+        DatasetLock.thread_lock.acquire()
+        if DatasetLock.depth == 0:
+            DatasetLock.file = open(data_path(self.file_name), 'a')
+            if fcntl is not None:
+                fcntl.flock(DatasetLock.file.fileno(), fcntl.LOCK_EX)
+        DatasetLock.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Method releases the lock (once the outermost holder exits)"""
+        DatasetLock.depth -= 1
+        if DatasetLock.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(DatasetLock.file.fileno(), fcntl.LOCK_UN)
+            DatasetLock.file.close()
+            DatasetLock.file = None
+        DatasetLock.thread_lock.release()
+
+
+versions = {}  # The (file key, version) of each hashed dataset file, such that unchanged files are hashed once
+
+
+def dataset_version(name='tracks.csv'):
+    """Method determines the version of a dataset file, as a digest of its contents
+
+    Note, derived artifacts (e.g. the feature store) record the version of the dataset they were built from, such that
+    stale artifacts can be detected. The digest is only recomputed once the modification time or size of the file
+    changes, such that version checks on the request path cost a `stat` call.
+
+    Args:
+        name (str): The name of the dataset file in the `data` directory
+
+    Returns:
+        (str): The hex digest of the file contents, or None if the file does not exist.
+    """
+    path = data_path(name)
+    key = file_key(path)
+    if key is None:
+        return None
+    cached = versions.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    versions[path] = (key, digest.hexdigest()[:16])
+    return versions[path][1]
+
+
+class UriIndex:
+    """The class interns track uris as dense int32 ids.
+
+    Ids are assigned in order of first appearance and never change, such that feature matrices, similarity scores,
+    playlist membership and de-duplication can use integer positions, bitmaps and array indexing instead of string
+    labels.
+
+    The persisted index is loaded once per process by `open()`, and reloaded only if the file has changed on disk.
+
+    Attributes:
+        uris (list): The track uris, the position in the list is the track id
+        ids (dict): The mapping of track uri to track id
+        lock (Lock): Guards the interning of new uris, as the opened index is shared by all threads of the process
+    """
+    file_name = 'uri_index.npz'
+    opened = {}  # The process-wide (file key, index) of each opened uri index path
+    opened_lock = threading.Lock()
+
+    def __init__(self, uris=None):
+        """The initialization of the Uri Index class
+
+        Args:
+            uris (list): The track uris, ordered by track id
+        """
+        self.uris = list(uris) if uris is not None else []
+        self.ids = {uri: track_id for track_id, uri in enumerate(self.uris)}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Method determines the number of interned uris
+
+        Returns:
+            (int): The number of interned uris
+        """
+        return len(self.uris)
+
+    @classmethod
+    def load(cls, path=None):
+        """Method loads the persisted uri index
+
+        Args:
+            path (str): The path to the uri index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (UriIndex): The loaded uri index, or None if no index has been persisted.
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            return cls(uris=stored['uris'].tolist())
+
+    @classmethod
+    def open(cls, path=None):
+        """Method provides the process-wide uri index, loading the persisted index on first use (or once it has changed
+        on disk). An empty index is created if none has been persisted.
+
+        Args:
+            path (str): The path to the uri index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (UriIndex): The uri index, shared within the process
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        with cls.opened_lock:
+            key = file_key(path)
+            cached = cls.opened.get(path)
+            if cached is None or (key is not None and cached[0] != key):
+                index = cls.load(path)
+                cls.opened[path] = (key, index if index is not None else cls())
+            return cls.opened[path][1]
+
+    def save(self, path=None):
+        """Method atomically persists the uri index
+
+        Args:
+            path (str): The path to the uri index file. Defaults to the file alongside the tracks dataset.
+        """
+        path = path if path is not None else data_path(self.file_name)
+        with self.lock:
+            uris = np.asarray(self.uris, dtype=str)
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, uris=uris)
+        os.replace(path + '.tmp', path)
+        with UriIndex.opened_lock:
+            if UriIndex.opened.get(path, (None, None))[1] is self:  # The saved index remains the opened index
+                UriIndex.opened[path] = (file_key(path), self)
+
+    def encode(self, uris):
+        """Method maps track uris to track ids, interning any new uris
+
+        Args:
+            uris (Series | list): The track uris
+
+        Returns:
+            (ndarray): The int32 track id of each uri
+        """
+        uris = pd.Series(uris, dtype=object).reset_index(drop=True)
+        ids = uris.map(self.ids)
+        missing = ids.isna().to_numpy()
+        if missing.any():  # Intern the unseen uris, in order of first appearance
+            with self.lock:
+                unseen = [uri for uri in pd.unique(uris[missing]) if uri not in self.ids]
+                self.ids.update(zip(unseen, range(len(self.uris), len(self.uris) + len(unseen))))
+                self.uris.extend(unseen)
+                ids[missing] = uris[missing].map(self.ids)
+        return ids.to_numpy(dtype=np.int32)
+
+    def lookup(self, uris):
+        """Method maps track uris to track ids, without interning new uris
+
+        Args:
+            uris (Series | list): The track uris
+
+        Returns:
+            (ndarray): The int32 track id of each uri, -1 for uris not in the index
+        """
+        return pd.Series(uris, dtype=object).map(self.ids).fillna(-1).to_numpy(dtype=np.int32)
+
+    def decode(self, track_ids):
+        """Method maps track ids back to track uris
+
+        Args:
+            track_ids (ndarray): The track ids
+
+        Returns:
+            (ndarray): The track uri of each id
+        """
+        return np.asarray(self.uris, dtype=object)[track_ids]
+
+    def membership(self, track_ids):
+        """Method creates a membership bitmap of a set of track ids
+
+        Args:
+            track_ids (ndarray): The track ids of the set (ids of -1 are ignored)
+
+        Returns:
+            (ndarray): A boolean bitmap over all track ids, True for members of the set. The bitmap holds an additional
+                trailing False entry, such that indexing the bitmap with an id of -1 (unknown uri) yields False.
+        """
+        bitmap = np.zeros(len(self.uris) + 1, dtype=bool)
+        track_ids = np.asarray(track_ids)
+        bitmap[track_ids[track_ids >= 0]] = True
+        return bitmap
+
+
+class TrackSchema:
+    """The class defines the compact in-memory schema of the raw tracks dataframe, applied when the tracks dataset is
+    loaded.
+
+    - Repeated strings (artists, genres, playlists, types and ingest timestamps) are held as categoricals.
+    - Small integer columns (keys, modes, time signatures and popularity) are held as narrow integers.
+    - The url columns derivable from the track uri (`ids`, `track_hrefs` and `analysis_urls`) are not loaded, and are
+      derived on demand by `derive()`.
+
+    Note, float columns remain float64, such that features (and similarity scores) are unaffected by the schema. The
+    dataset files themselves keep the full schema.
+    """
+    categorical_columns = ['artist_names', 'artist_uris', 'artist_genres', 'types', 'playlist_name', 'ingested_at']
+    integer_columns = {'artist_pop': 'int8', 'track_pop': 'int8', 'keys': 'int8', 'modes': 'int8',
+                       'time_signatures': 'int8', 'durations_ms': 'int32'}
+    derived_columns = {'ids': '', 'track_hrefs': 'https://api.spotify.com/v1/tracks/',
+                       'analysis_urls': 'https://api.spotify.com/v1/audio-analysis/'}  # Prefix of the track uri
+
+    @classmethod
+    def read(cls, path: str = None, usecols: list = None):
+        """Method reads the tracks dataset in the compact schema
+
+        Args:
+            path (str): The path to the tracks dataset. Defaults to `data/tracks.csv`.
+            usecols (list): The columns to be read. Defaults to all columns (except the derived url columns).
+
+        Returns:
+            (DataFrame): The compact tracks dataframe
+        """
+        path = path if path is not None else data_path('tracks.csv')
+        if usecols is None:  # The derived url columns are skipped while parsing
+            df = pd.read_csv(path, index_col=0, usecols=lambda column: column not in cls.derived_columns,
+                             dtype={column: 'category' for column in cls.categorical_columns})
+        else:
+            columns = [column for column in usecols if column not in cls.derived_columns]
+            df = pd.read_csv(path, usecols=columns,
+                             dtype={column: 'category' for column in cls.categorical_columns if column in columns})
+        return cls.compact(df)
+
+    @classmethod
+    def compact(cls, df: pd.DataFrame):
+        """Method converts a raw tracks dataframe into the compact schema
+
+        Note, integer columns containing missing values (or values outside of the narrow range) keep their dtype.
+
+        Args:
+            df (DataFrame): The raw tracks dataframe
+
+        Returns:
+            (DataFrame): The compact tracks dataframe
+        """
+        df = df.drop(columns=[column for column in cls.derived_columns if column in df.columns])
+        conversions = {column: 'category' for column in cls.categorical_columns
+                       if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype)}
+        for column, dtype in cls.integer_columns.items():
+            if column in df.columns and df[column].notna().all() and df[column].shape[0] != 0:
+                limits = np.iinfo(dtype)
+                if limits.min <= df[column].min() and df[column].max() <= limits.max:
+                    conversions[column] = dtype
+        return df.astype(conversions)
+
+    @classmethod
+    def derive(cls, df: pd.DataFrame, columns: list = None):
+        """Method derives the url columns of a compact tracks dataframe from the track uris
+
+        Args:
+            df (DataFrame): The compact tracks dataframe
+            columns (list): The derived columns to be added. Defaults to all derived columns.
+
+        Returns:
+            (DataFrame): A dataframe with the derived columns added
+        """
+        columns = columns if columns is not None else list(cls.derived_columns)
+        uris = df['uris'].astype(str)
+        return df.assign(**{column: cls.derived_columns[column] + uris for column in columns})
+
+    @classmethod
+    def memory_report(cls, path: str = None):
+        """Method measures the memory of the tracks dataframe in the raw and in the compact schema
+
+        Args:
+            path (str): The path to the tracks dataset. Defaults to `data/tracks.csv`.
+
+        Returns:
+            (DataFrame): The raw and compact dtype and bytes (including string contents) of each column
+        """
+        path = path if path is not None else data_path('tracks.csv')
+        raw = pd.read_csv(path, index_col=0)
+        compact = cls.read(path)
+        report = pd.DataFrame({'raw_dtype': raw.dtypes.astype(str),
+                               'raw_bytes': raw.memory_usage(index=False, deep=True),
+                               'compact_dtype': compact.dtypes.astype(str),
+                               'compact_bytes': compact.memory_usage(index=False, deep=True)})
+        report['compact_bytes'] = report['compact_bytes'].fillna(0).astype(np.int64)  # Derived columns are not held
+        report.loc['total'] = ['', report['raw_bytes'].sum(), '', report['compact_bytes'].sum()]
+        return report
+
+
+class TrackPartitions:
+    """The class manages the time partitions of the tracks dataset.
+
+    Each crawl is written to its own partition file, with the ingest timestamp of its tracks recorded in the
+    `ingested_at` column, and listed in a manifest (`data/partitions/manifest.json`) in ingest order. Submitted
+    playlists (flushed by the write-behind queue) are collected into a single `submission` partition per crawl interval,
+    rather than a partition per flush. Queries over recent tracks (e.g. the last N crawls) are pruned to the partitions
+    in the window, such that they read O(recent data) rather than the full dataset.
+
+    Note, `tracks.csv` is the source of truth of the dataset (and is kept under version control), while the partitions
+    are derived from it: `tracks.csv` is the merged view of all partitions (the latest version of each track), and a
+    dataset without partitions is migrated into a single `legacy` partition, without an ingest timestamp. The manifest
+    is only modified under the `DatasetLock`.
+
+    Attributes:
+        partitions (list): The name, ingest timestamp, number of rows and source (`crawl`, `submission`, or None for the legacy partition) of each partition, in ingest order
+    """
+    directory = 'partitions'
+    manifest_name = 'manifest.json'
+    legacy_name = 'legacy'
+    timestamp_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, partitions: list = None):
+        """The initialization of the Track Partitions class
+
+        Args:
+            partitions (list): The name, ingest timestamp and number of rows of each partition, in ingest order
+        """
+        self.partitions = partitions if partitions is not None else []
+
+    @classmethod
+    def path(cls, name=''):
+        """Method determines the path of a file in the partitions directory
+
+        Args:
+            name (str): The name of the file
+
+        Returns:
+            (str): The absolute path to the file
+        """
+        return os.path.join(data_path(cls.directory), name)
+
+    @classmethod
+    def load(cls):
+        """Method loads the partitions manifest
+
+        Returns:
+            (TrackPartitions): The partitions of the tracks dataset, or None if the dataset has not been partitioned
+        """
+        if not os.path.exists(cls.path(cls.manifest_name)):
+            return None
+        with open(cls.path(cls.manifest_name), 'r') as file:
+            return cls(json.load(file))
+
+    @classmethod
+    def open(cls, df: pd.DataFrame = None):
+        """Method loads the partitions manifest, partitioning the tracks dataset if it has not been partitioned yet
+
+        Args:
+            df (DataFrame): The tracks dataset, written to the `legacy` partition if the dataset is not partitioned
+
+        Returns:
+            (TrackPartitions): The partitions of the tracks dataset
+        """
+        with DatasetLock():
+            partitions = cls.load()
+            if partitions is not None:
+                return partitions
+            partitions = cls()
+            os.makedirs(cls.path(), exist_ok=True)
+            if df is not None and df.shape[0] != 0:
+                legacy = df if 'ingested_at' in df.columns else df.assign(ingested_at=np.nan)
+                partitions.write(cls.legacy_name, legacy, None)
+            partitions.save()
+            return partitions
+
+    def save(self):
+        """Method atomically persists the partitions manifest"""
+        with open(self.path(self.manifest_name + '.tmp'), 'w') as file:
+            json.dump(self.partitions, file, indent=2)
+        os.replace(self.path(self.manifest_name + '.tmp'), self.path(self.manifest_name))
+
+    def write(self, name: str, df: pd.DataFrame, ingested_at: str, source: str = None):
+        """Method writes the tracks of a partition, and records the partition in the manifest (without saving it)
+
+        Args:
+            name (str): The name of the partition
+            df (DataFrame): The tracks of the partition
+            ingested_at (str): The ingest timestamp of the partition, None if unknown
+            source (str): The source of the partition's tracks (`crawl` or `submission`), None if unknown
+        """
+        write_csv(df.reset_index(drop=True), self.path(name + '.csv'), mode='w')
+        self.partitions.append({'name': name, 'ingested_at': ingested_at, 'rows': int(df.shape[0]), 'source': source})
+
+    def append(self, df: pd.DataFrame, ingested_at: datetime = None, source: str = 'crawl'):
+        """Method writes the tracks of an ingest to the partitions, under the `DatasetLock`
+
+        The tracks of a crawl are written to a new partition. Submitted tracks are merged into the latest partition if it
+        is a submission partition (the latest version of each track is kept), and written to a new submission partition
+        otherwise (i.e. after a crawl).
+
+        Args:
+            df (DataFrame): The ingested tracks
+            ingested_at (datetime): The ingest time. Defaults to the current time.
+            source (str): The source of the tracks, `crawl` or `submission`
+
+        Returns:
+            (str): The name of the partition the tracks were written to
+        """
+        ingested_at = ingested_at if ingested_at is not None else datetime.now()
+        timestamp = ingested_at.strftime(self.timestamp_format)
+        df = df.assign(ingested_at=timestamp)
+        with DatasetLock():
+            stored = self.load()  # The manifest may have been modified since it was loaded
+            self.partitions = stored.partitions if stored is not None else self.partitions
+            latest = self.partitions[-1] if len(self.partitions) != 0 else None
+            if source == 'submission' and latest is not None and latest.get('source') == 'submission':
+                name = latest['name']
+                previous = pd.read_csv(self.path(name + '.csv'), index_col=0)
+                df = pd.concat([df, previous], axis=0, ignore_index=True).drop_duplicates('uris', keep='first')
+                self.partitions.pop()
+            else:
+                name = f'{source}_{ingested_at.strftime("%Y%m%d-%H%M%S")}'
+                names = self.names()
+                suffix = 1
+                while (name if suffix == 1 else f'{name}_{suffix}') in names:  # Ingests within the same second
+                    suffix += 1
+                name = name if suffix == 1 else f'{name}_{suffix}'
+            self.write(name, df, timestamp, source)
+            self.save()
+        return name
+
+    def names(self, last: int = None, since: datetime = None):
+        """Method selects the partitions within a crawl window (partition pruning)
+
+        Args:
+            last (int): Only the partitions of the latest `last` crawls (and the submissions ingested since) are selected. Defaults to all partitions.
+            since (datetime): Only partitions ingested at or after this time are selected. Defaults to all partitions.
+
+        Returns:
+            (list): The names of the selected partitions, in ingest order
+        """
+        partitions = self.partitions
+        if last is not None:
+            crawls = [position for position, partition in enumerate(self.partitions)
+                      if partition.get('source', 'crawl') == 'crawl' and partition['name'] != self.legacy_name]
+            partitions = [] if last <= 0 else self.partitions[crawls[-last]:] if last <= len(crawls) else partitions
+        if since is not None:
+            threshold = since.strftime(self.timestamp_format)  # Timestamps sort chronologically as strings
+            partitions = [partition for partition in partitions
+                          if partition['ingested_at'] is not None and partition['ingested_at'] >= threshold]
+        return [partition['name'] for partition in partitions]
+
+    def read(self, names: list = None, last: int = None, since: datetime = None, usecols: list = None):
+        """Method reads the tracks of the selected partitions, in the compact schema (see `TrackSchema`)
+
+        Tracks ingested in several of the selected partitions are de-duplicated on their interned track ids, keeping
+        the latest version of each track.
+
+        Args:
+            names (list): The names of the partitions to read. Defaults to the partitions selected by `last` and `since`.
+            last (int): Only the latest `last` partitions are read (see `names()`)
+            since (datetime): Only partitions ingested at or after this time are read (see `names()`)
+            usecols (list): The columns to be read. Defaults to all columns (except the derived url columns).
+
+        Returns:
+            (DataFrame): The tracks of the selected partitions, the most recently ingested first
+        """
+        names = names if names is not None else self.names(last, since)
+        columns = None if usecols is None else list(dict.fromkeys(list(usecols) + ['uris']))
+        frames = [TrackSchema.read(self.path(name + '.csv'), usecols=columns) for name in reversed(names)]
+        if len(frames) == 0:
+            return TrackSchema.read(data_path('tracks.csv'), usecols=columns).iloc[:0]
+        df = pd.concat(frames, axis=0, ignore_index=True) if len(frames) > 1 else frames[0].reset_index(drop=True)
+        if len(frames) > 1:
+            _, first = np.unique(UriIndex.open().encode(df['uris']), return_index=True)  # Keep the latest version
+            df = df.iloc[np.sort(first)].reset_index(drop=True)
+            df = TrackSchema.compact(df)  # Categoricals of differing categories are widened by the concatenation
+        return df if usecols is None else df[list(usecols)]
+
+    def feature_path(self, name: str):
+        """Method determines the path of the feature store of a partition
+
+        Args:
+            name (str): The name of the partition
+
+        Returns:
+            (str): The absolute path to the feature store file of the partition
+        """
+        return self.path(name + '.mias')
+
+
+class TrackSample:
+    """The class maintains a fixed-size reservoir sample of the tracks dataset, persisted alongside the dataset.
+
+    The sample is updated at ingest using reservoir sampling: tracks are streamed in order of their `UriIndex` id, such
+    that only tracks added since the last update are processed, and every track ever added has an equal chance of
+    being in the sample. The sample allows the dataset page to visualize the dataset without reading and resampling the
+    full tracks dataset.
+
+    Attributes:
+        size (int): The (maximum) number of tracks in the sample
+        tracks (DataFrame): The sampled tracks
+        seen (int): The number of tracks streamed into the sample (the next `UriIndex` id to be streamed)
+        version (str): The dataset version the sample was last updated at
+    """
+    file_name = 'tracks_sample.csv'
+    meta_name = 'tracks_sample.json'
+
+    def __init__(self, size: int = 1000, tracks: pd.DataFrame = None, seen: int = 0, version: str = None):
+        """The initialization of the Track Sample class
+
+        Args:
+            size (int): The (maximum) number of tracks in the sample
+            tracks (DataFrame): The sampled tracks
+            seen (int): The number of tracks streamed into the sample
+            version (str): The dataset version the sample was last updated at
+        """
+        self.size = size
+        self.tracks = tracks
+        self.seen = seen
+        self.version = version
+
+    @classmethod
+    def load(cls):
+        """Method loads the persisted track sample
+
+        Returns:
+            (TrackSample): The loaded track sample, or None if no sample has been persisted.
+        """
+        if not (os.path.exists(data_path(cls.file_name)) and os.path.exists(data_path(cls.meta_name))):
+            return None
+        with open(data_path(cls.meta_name), 'r') as file:
+            meta = json.load(file)
+        tracks = TrackSchema.read(data_path(cls.file_name))
+        return cls(size=meta['size'], tracks=tracks, seen=meta['seen'], version=meta['version'])
+
+    def save(self):
+        """Method persists the track sample"""
+        write_csv(self.tracks, data_path(self.file_name), mode='w')
+        with open(data_path(self.meta_name), 'w') as file:
+            json.dump({'size': self.size, 'seen': self.seen, 'version': self.version}, file)
+
+    def update(self, df: pd.DataFrame, uri_index: UriIndex, version: str = None, random_state: int = None):
+        """Method streams the tracks added to the dataset since the last update into the reservoir sample
+
+        The sample is held in the compact schema (see `TrackSchema`), whether the given dataframe is raw or compact.
+
+        Args:
+            df (DataFrame): The dataframe containing all stored tracks
+            uri_index (UriIndex): The uri index of the dataset layer
+            version (str): The dataset version of the dataframe
+            random_state (int): The seed of the reservoir sampling
+        """
+        rng = np.random.default_rng(random_state)
+        track_ids = uri_index.encode(df['uris'])
+        added = np.flatnonzero(track_ids >= self.seen)
+        added = added[np.argsort(track_ids[added], kind='stable')]  # Stream new tracks in order of their id
+
+        rows = [] if self.tracks is None else [None] * self.tracks.shape[0]  # None marks a previously sampled track
+        for position in added:
+            if len(rows) < self.size:  # Fill the reservoir
+                rows.append(position)
+            else:
+                slot = rng.integers(0, self.seen + 1)  # Replace a sampled track with probability size / seen
+                if slot < self.size:
+                    rows[slot] = position
+            self.seen += 1
+        self.seen = max(self.seen, int(track_ids.max(initial=-1)) + 1)
+
+        kept = [slot for slot, row in enumerate(rows) if row is None]
+        new_rows = [row for row in rows if row is not None]
+        frames = [] if self.tracks is None else [self.tracks.iloc[kept]]
+        tracks = pd.concat(frames + [TrackSchema.compact(df.iloc[new_rows])], axis=0).reset_index(drop=True)
+        self.tracks = TrackSchema.compact(tracks)  # Categories of the sampled and new tracks differ, and are re-unified
+        self.version = version
+
+
+class DatasetExports:
+    """The class publishes compressed, versioned export artifacts of the dataset files for download.
+
+    Artifacts are produced once per dataset version, and described by a manifest (`data/exports/manifest.json`) holding
+    the version, file name, size and sha256 checksum of each artifact. Formats:
+    - `csv.gz`: gzip compressed csv
+    - `csv.zst`: zstandard compressed csv (only if the optional `zstandard` package is installed)
+    - `parquet`: zstd compressed parquet (only if a parquet engine, e.g. `pyarrow`, is installed)
+
+    Attributes:
+        manifest (dict): The mapping of dataset file name to its version and artifacts
+    """
+    directory = 'exports'
+    manifest_name = 'manifest.json'
+    datasets = ['tracks.csv', 'dataset_growth.csv']
+    media_types = {'csv.gz': 'application/gzip', 'csv.zst': 'application/zstd', 'parquet': 'application/vnd.apache.parquet'}
+
+    def __init__(self, manifest: dict = None):
+        """The initialization of the Dataset Exports class
+
+        Args:
+            manifest (dict): The mapping of dataset file name to its version and artifacts
+        """
+        self.manifest = manifest if manifest is not None else {}
+
+    @classmethod
+    def export_path(cls, name=''):
+        """Method determines the path of a file in the exports directory
+
+        Args:
+            name (str): The name of the file
+
+        Returns:
+            (str): The absolute path to the file
+        """
+        return os.path.join(data_path(cls.directory), name)
+
+    @classmethod
+    def load(cls):
+        """Method loads the exports manifest
+
+        Returns:
+            (DatasetExports): The published exports (empty if nothing has been published)
+        """
+        path = cls.export_path(cls.manifest_name)
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as file:
+            return cls(json.load(file))
+
+    @classmethod
+    def publish(cls):
+        """Method produces the export artifacts of each dataset file whose version changed since the last publication.
+        Artifacts of previous versions are removed.
+
+        Returns:
+            (DatasetExports): The published exports
+        """
+        exports = cls.load()
+        os.makedirs(cls.export_path(), exist_ok=True)
+        for name in cls.datasets:
+            version = dataset_version(name)
+            if version is None or exports.manifest.get(name, {}).get('version') == version:
+                continue
+            previous = exports.manifest.get(name, {}).get('artifacts', {})
+            exports.manifest[name] = {'version': version, 'artifacts': cls.write_artifacts(name, version)}
+            for artifact in previous.values():  # Remove the artifacts of the previous version
+                if os.path.exists(cls.export_path(artifact['file'])):
+                    os.remove(cls.export_path(artifact['file']))
+
+        temporary_path = cls.export_path(cls.manifest_name + '.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(exports.manifest, file, indent=2)
+        os.replace(temporary_path, cls.export_path(cls.manifest_name))
+        return exports
+
+    @classmethod
+    def write_artifacts(cls, name: str, version: str):
+        """Method writes the export artifacts of a dataset file
+
+        Args:
+            name (str): The name of the dataset file in the `data` directory
+            version (str): The dataset version of the file
+
+        Returns:
+            (dict): The mapping of format to artifact description (file, bytes, sha256)
+        """
+        stem = name.rsplit('.', 1)[0]
+        artifacts = {}
+
+        file_name = f'{stem}-{version}.csv.gz'
+        with open(data_path(name), 'rb') as source, gzip.open(cls.export_path(file_name), 'wb', compresslevel=9) as target:
+            shutil.copyfileobj(source, target)
+        artifacts['csv.gz'] = cls.describe(file_name)
+
+        if zstandard is not None:
+            file_name = f'{stem}-{version}.csv.zst'
+            with open(data_path(name), 'rb') as source, open(cls.export_path(file_name), 'wb') as target:
+                zstandard.ZstdCompressor(level=19).copy_stream(source, target)
+            artifacts['csv.zst'] = cls.describe(file_name)
+
+        file_name = f'{stem}-{version}.parquet'
+        try:
+            pd.read_csv(data_path(name), index_col=0).to_parquet(cls.export_path(file_name), compression='zstd')
+            artifacts['parquet'] = cls.describe(file_name)
+        except ImportError:  # No parquet engine installed
+            pass
+        return artifacts
+
+    @classmethod
+    def describe(cls, file_name: str):
+        """Method describes an artifact for the manifest
+
+        Args:
+            file_name (str): The name of the artifact in the exports directory
+
+        Returns:
+            (dict): The artifact file name, size in bytes and sha256 checksum
+        """
+        digest = hashlib.sha256()
+        with open(cls.export_path(file_name), 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return {'file': file_name, 'bytes': os.path.getsize(cls.export_path(file_name)), 'sha256': digest.hexdigest()}
+
+    def artifacts(self, name: str):
+        """Method lists the published artifacts of a dataset file
+
+        Args:
+            name (str): The name of the dataset file
+
+        Returns:
+            (dict): The mapping of format to artifact description, with the artifact path added
+        """
+        artifacts = self.manifest.get(name, {}).get('artifacts', {})
+        return {artifact_format: dict(artifact, path=self.export_path(artifact['file']))
+                for artifact_format, artifact in artifacts.items()
+                if os.path.exists(self.export_path(artifact['file']))}
+
+
+if __name__ == "__main__":
+    report = TrackSchema.memory_report()  # Measure the memory of the tracks dataframe in the raw and compact schema
+    print(report.to_string())
+    print(f"Compact schema: {report.loc['total', 'raw_bytes'] / report.loc['total', 'compact_bytes']:.1f}x smaller")
@@ -0,0 +1,354 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from artist_centroids import ArtistCentroidIndex, ArtistCentroidSimilarity
+from cooccurrence import CooccurrenceIndex, CooccurrenceSimilarity, PlaylistIncidence, playlist_keys
+from dataset_store import TrackSchema, UriIndex, data_path, redirect_data
+from feature_store import FeatureStore
+from genres import GenreIndex
+from playlist_compression import PlaylistCompressor
+from projection import FeatureProjection, ProjectedCosineSimilarity
+from quantised_similarity import QuantisedCosineSimilarity, QuantisedIndex
+from similarity import TracksCosineSimilarity
+
+"""This file provides the offline evaluation harness of the similarity engines.
+
+    Every registered engine (an implementation of the `Similarity` interface, with any index it requires) is run over a
+    dataset and a set of playlists (`data/target.csv` plus synthetic playlists sampled from the crawled playlists). The
+    top-k of each engine is compared against the exact `TracksCosineSimilarity` ranking, and the recall@k, NDCG@k,
+    p50/p99 query latency, build time and index memory of each engine are reported as a comparison table.
+
+    Usage (from the project root):
+        python src/evaluation.py --playlists 20 --k 30
+"""
+
+
+class Engine:
+    """The class describes a similarity engine registered with the evaluation harness.
+
+    Attributes:
+        name (str): The name of the engine
+        build (callable): Builds the shared state of the engine (e.g. an index) from the tracks dataframe, build(tracks)
+        create (callable): Creates the similarity object of a playlist, create(playlist, tracks, state, weighted_features)
+        memory (callable): Measures the bytes of the structures scanned by a similarity object, memory(similarity)
+    """
+    def __init__(self, name: str, build, create, memory):
+        """The initialization of the Engine class
+
+        Args:
+            name (str): The name of the engine
+            build (callable): Builds the shared state of the engine from the tracks dataframe
+            create (callable): Creates the similarity object of a playlist
+            memory (callable): Measures the bytes of the structures scanned by a similarity object
+        """
+        self.name = name
+        self.build = build
+        self.create = create
+        self.memory = memory
+
+
+ENGINES = {}
+
+
+def register_engine(engine: Engine):
+    """Method registers a similarity engine with the evaluation harness
+
+    Args:
+        engine (Engine): The engine to be registered
+    """
+    ENGINES[engine.name] = engine
+
+
+def build_feature_store(tracks: pd.DataFrame):
+    """Method publishes the features of the tracks dataframe to a feature store in the artifact directory of the
+    evaluation (see `evaluate()`)
+
+    Note, publishing a feature store persists the uri index (and genre vocabulary) in the artifact directory.
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+
+    Returns:
+        (FeatureStore): The mapped feature store
+    """
+    return FeatureStore(FeatureStore.publish(tracks, version='evaluation'))
+
+
+def build_quantised_index(tracks: pd.DataFrame):
+    """Method builds the feature store and int8 quantised index of the tracks dataframe
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+
+    Returns:
+        (tuple): The feature store and the quantised index
+    """
+    feature_store = build_feature_store(tracks)
+    return feature_store, QuantisedIndex.build(feature_store.features, feature_store.norms)
+
+
+def build_projection(tracks: pd.DataFrame):
+    """Method builds the feature store and truncated SVD projection of the tracks dataframe, reporting the energy kept
+    by the projection
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+
+    Returns:
+        (tuple): The feature store and the projection
+    """
+    feature_store = build_feature_store(tracks)
+    projection = FeatureProjection.build(feature_store.features, feature_store.norms)
+    print(f'Projection: {projection.components.shape[0]} -> {projection.components.shape[1]} dimensions, '
+          f'{projection.kept:.4%} of the (uncentred) energy kept')
+    return feature_store, projection
+
+
+def build_cooccurrence_index(tracks: pd.DataFrame):
+    """Method builds the playlist co-occurrence index of the tracks dataframe (from the playlist of each track)
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+
+    Returns:
+        (CooccurrenceIndex): The co-occurrence index
+    """
+    incidence = PlaylistIncidence()
+    incidence.update(UriIndex.open().encode(tracks['uris']), playlist_keys(tracks))
+    return CooccurrenceIndex.build(incidence)
+
+
+def matrix_bytes(similarity):
+    """Method measures the bytes of the feature matrix (and norms) scanned by a cosine similarity
+
+    Args:
+        similarity (TracksCosineSimilarity): The similarity object
+
+    Returns:
+        (int): The number of bytes
+    """
+    return similarity.track_matrix.nbytes + similarity.track_norms.nbytes
+
+
+def sparse_bytes(matrix):
+    """Method measures the bytes of a sparse CSR matrix
+
+    Args:
+        matrix (csr_matrix): The sparse matrix
+
+    Returns:
+        (int): The number of bytes
+    """
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+register_engine(Engine('cosine',
+                       build=lambda tracks: None,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       TracksCosineSimilarity(playlist, tracks, weighted_features),
+                       memory=matrix_bytes))
+register_engine(Engine('cosine (feature store)',
+                       build=build_feature_store,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       TracksCosineSimilarity(playlist, tracks, weighted_features, feature_store=state),
+                       memory=matrix_bytes))
+register_engine(Engine('cosine (playlist centroids)',
+                       build=build_feature_store,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       TracksCosineSimilarity(playlist, tracks, weighted_features, compressor=PlaylistCompressor(),
+                                              feature_store=state),
+                       memory=matrix_bytes))
+register_engine(Engine('cosine (genre candidates)',
+                       build=lambda tracks: (build_feature_store(tracks), GenreIndex.build(tracks)),
+                       create=lambda playlist, tracks, state, weighted_features:
+                       TracksCosineSimilarity(playlist, tracks, weighted_features, feature_store=state[0],
+                                              genre_index=state[1]),
+                       memory=lambda similarity: similarity.track_matrix[similarity.track_positions].nbytes))
+register_engine(Engine('quantised int8',
+                       build=build_quantised_index,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       QuantisedCosineSimilarity(playlist, tracks, weighted_features, feature_store=state[0],
+                                                 index=state[1]),
+                       memory=lambda similarity: similarity.index.nbytes()))
+register_engine(Engine('projected svd',
+                       build=build_projection,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       ProjectedCosineSimilarity(playlist, tracks, weighted_features, feature_store=state[0],
+                                                 index=state[1]),
+                       memory=lambda similarity: similarity.index.nbytes()))
+register_engine(Engine('projected svd (scan only)',
+                       build=build_projection,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       ProjectedCosineSimilarity(playlist, tracks, weighted_features, feature_store=state[0],
+                                                 index=state[1], rescore=0),
+                       memory=lambda similarity: similarity.index.nbytes()))
+for top_artists in (100, 500, 2000):  # The recall knob of the artist centroid engine
+    register_engine(Engine(f'artist centroids (M={top_artists})',
+                           build=lambda tracks: (lambda store: (store, ArtistCentroidIndex.build(
+                               store.features, store.norms, store.track_ids, tracks)))(build_feature_store(tracks)),
+                           create=lambda playlist, tracks, state, weighted_features, top_artists=top_artists:
+                           ArtistCentroidSimilarity(playlist, tracks, weighted_features, feature_store=state[0],
+                                                    index=state[1], top_artists=top_artists),
+                           memory=lambda similarity: similarity.index.nbytes()))
+register_engine(Engine('co-occurrence',
+                       build=build_cooccurrence_index,
+                       create=lambda playlist, tracks, state, weighted_features:
+                       CooccurrenceSimilarity(playlist, tracks, weighted_features, index=state),
+                       memory=lambda similarity: sparse_bytes(similarity.index.matrix)))
+
+
+def synthetic_playlists(tracks: pd.DataFrame, count: int = 20, size: int = 30, random_state: int = 1):
+    """Method samples synthetic playlists from the crawled playlists of the tracks dataframe
+
+    Each synthetic playlist samples `size` tracks of a random crawled playlist (with at least `size` tracks), such that
+    its tracks are as coherent as a real playlist.
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+        count (int): The number of synthetic playlists
+        size (int): The number of tracks per synthetic playlist
+        random_state (int): The seed of the sampling
+
+    Returns:
+        (list): The (name, playlist dataframe) of each synthetic playlist
+    """
+    rng = np.random.default_rng(random_state)
+    sizes = tracks['playlist_name'].value_counts()
+    names = sizes[sizes >= size].index.to_numpy()
+    playlists = []
+    for name in rng.choice(names, size=min(count, names.shape[0]), replace=False):
+        rows = np.flatnonzero((tracks['playlist_name'] == name).to_numpy())
+        playlists.append((f'synthetic: {name}', tracks.iloc[rng.choice(rows, size=size, replace=False)]))
+    return playlists
+
+
+def recall_at_k(exact_top, top, k: int):
+    """Method determines the fraction of the exact top-k tracks that are returned in the top-k of an engine
+
+    Args:
+        exact_top (list): The exact top-k track uris, in ranked order
+        top (list): The top-k track uris of the engine, in ranked order
+        k (int): The number of top tracks compared
+
+    Returns:
+        (float): The recall@k
+    """
+    return len(set(exact_top[:k]) & set(top[:k])) / max(min(k, len(exact_top)), 1)
+
+
+def ndcg_at_k(exact_top, top, k: int):
+    """Method determines the normalized discounted cumulative gain of the top-k of an engine
+
+    The relevance of a track is graded by its exact rank: (k - rank) / k for the exact top-k tracks, 0 otherwise.
+
+    Args:
+        exact_top (list): The exact top-k track uris, in ranked order
+        top (list): The top-k track uris of the engine, in ranked order
+        k (int): The number of top tracks compared
+
+    Returns:
+        (float): The NDCG@k
+    """
+    relevance = {uri: (k - rank) / k for rank, uri in enumerate(exact_top[:k])}
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    gains = np.asarray([relevance.get(uri, 0.0) for uri in top[:k]])
+    ideal = np.asarray(sorted(relevance.values(), reverse=True))
+    ideal_gain = (ideal * discounts[:ideal.shape[0]]).sum()
+    return float((gains * discounts[:gains.shape[0]]).sum() / ideal_gain) if ideal_gain > 0 else 1.0
+
+
+def evaluate(tracks: pd.DataFrame, playlists: list, engines: list = None, k: int = 30, weighted_features: list = None):
+    """Method evaluates the registered engines against the exact cosine similarity ranking
+
+    The `data` directory is redirected to a temporary directory for the duration of the evaluation, such that the
+    artifacts built by the engines (feature stores, uri index, genre vocabulary) never touch the dataset, and are
+    removed once the evaluation completes.
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+        playlists (list): The (name, playlist dataframe) of each evaluated playlist
+        engines (list): The names of the engines to be evaluated. Defaults to all registered engines.
+        k (int): The number of top tracks compared
+        weighted_features (list): The weighted features of every query
+
+    Returns:
+        (DataFrame): The comparison table, with a row per engine
+    """
+    with tempfile.TemporaryDirectory(prefix='mias_evaluation_') as directory, redirect_data(directory):
+        return evaluate_engines(tracks, playlists, engines, k, weighted_features)
+
+
+def evaluate_engines(tracks: pd.DataFrame, playlists: list, engines: list = None, k: int = 30,
+                     weighted_features: list = None):
+    """Method evaluates the registered engines against the exact cosine similarity ranking (see `evaluate()`), within
+    the current artifact directory
+
+    Args:
+        tracks (DataFrame): The tracks dataframe
+        playlists (list): The (name, playlist dataframe) of each evaluated playlist
+        engines (list): The names of the engines to be evaluated. Defaults to all registered engines.
+        k (int): The number of top tracks compared
+        weighted_features (list): The weighted features of every query
+
+    Returns:
+        (DataFrame): The comparison table, with a row per engine
+    """
+    weighted_features = weighted_features if weighted_features is not None else []
+    exact_tops = []
+    for _, playlist in playlists:  # The exact reference ranking of each playlist
+        exact = TracksCosineSimilarity(playlist, tracks, weighted_features)
+        exact.calculate_similarity()
+        exact_tops.append(exact.get_top_n(k)['uris'].tolist())
+
+    rows = []
+    for name in (engines if engines is not None else list(ENGINES)):
+        engine = ENGINES[name]
+        start = time.perf_counter()
+        state = engine.build(tracks)
+        build_time = time.perf_counter() - start
+
+        recalls, ndcgs, latencies, memory = [], [], [], 0
+        for (_, playlist), exact_top in zip(playlists, exact_tops):
+            start = time.perf_counter()
+            similarity = engine.create(playlist, tracks, state, weighted_features)
+            similarity.calculate_similarity()
+            top = similarity.get_top_n(k)['uris'].tolist()
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(recall_at_k(exact_top, top, k))
+            ndcgs.append(ndcg_at_k(exact_top, top, k))
+            memory = engine.memory(similarity)
+
+        rows.append({'engine': name,
+                     f'recall@{k}': np.mean(recalls),
+                     f'ndcg@{k}': np.mean(ndcgs),
+                     'p50_ms': np.percentile(latencies, 50),
+                     'p99_ms': np.percentile(latencies, 99),
+                     'build_s': build_time,
+                     'index_mb': memory / 1e6})
+    return pd.DataFrame(rows).set_index('engine')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluate the recall and latency of the similarity engines')
+    parser.add_argument('--dataset', default=data_path('tracks.csv'), help='The path to the tracks dataset')
+    parser.add_argument('--target', default=data_path('target.csv'), help='The path to a target playlist (if it exists)')
+    parser.add_argument('--playlists', type=int, default=20, help='The number of synthetic playlists')
+    parser.add_argument('--size', type=int, default=30, help='The number of tracks per synthetic playlist')
+    parser.add_argument('--k', type=int, default=30, help='The number of top tracks compared')
+    parser.add_argument('--weights', nargs='*', default=[], help='The weighted features of every query')
+    parser.add_argument('--engines', nargs='*', default=None, help='The engines to evaluate (default: all)')
+    arguments = parser.parse_args()
+
+    dataset = TrackSchema.read(arguments.dataset)
+    evaluation_playlists = synthetic_playlists(dataset, arguments.playlists, arguments.size)
+    if os.path.exists(arguments.target):
+        evaluation_playlists.insert(0, ('target', pd.read_csv(arguments.target, index_col=0)))
+
+    table = evaluate(dataset, evaluation_playlists, arguments.engines, arguments.k, arguments.weights)
+    print(f'{len(evaluation_playlists)} playlists, {dataset.shape[0]} tracks')
+    print(table.to_string(float_format=lambda value: f'{value:.3f}'))
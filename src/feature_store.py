@@ -0,0 +1,275 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import TrackPartitions, UriIndex, data_path, dataset_version
+from genres import GenreVocabulary
+from pipeline import FeatureEncoder
+
+"""This file provides the feature store, a read-only memory-mapped track feature matrix.
+
+    The feature matrix (and its row norms) is published once per dataset version to a single binary file. Each worker
+    process maps the file read-only, such that all processes on a host share the same physical pages (through the
+    operating system page cache) and access the features as zero-copy NumPy views.
+
+    A partitioned tracks dataset (see `TrackPartitions`) is encoded per partition, with the partition stores merged into
+    the published feature store.
+
+    File layout:
+    - 8 byte magic (`MIASFS01`) and 8 byte header length (little-endian uint64)
+    - JSON header (schema, dataset version, encoder state, the number of tracks the encoder was fitted on and block
+      offsets), padded to a 64 byte boundary
+    - features block: float64 (rows, columns), C-contiguous
+    - norms block: float64 (rows)
+    - track ids block: int32 (rows), the `UriIndex` id of each row
+"""
+
+MAGIC = b'MIASFS01'
+ALIGNMENT = 64
+
+
+def normalize_rows(block, norms):
+    """Method L2 normalizes a block of track feature rows (e.g. of the feature store), given the norm of each row
+
+    Args:
+        block (ndarray): The block of track feature rows
+        norms (ndarray): The L2 norm of each row of the block
+
+    Returns:
+        (ndarray): The float64 normalized rows (rows with a norm of 0 remain 0)
+    """
+    block = np.asarray(block, dtype=np.float64)
+    norms = np.asarray(norms, dtype=np.float64)[:, None]
+    return np.divide(block, norms, out=np.zeros_like(block), where=norms > 0)
+
+
+class FeatureStore:
+    """The class provides read-only, memory-mapped access to a published track feature matrix.
+
+    Attributes:
+        path (str): The path to the feature store file
+        header (dict): The file header (schema, dataset version, encoder state and block offsets)
+        columns (list): The feature column names
+        features (memmap): The read-only (rows, columns) feature matrix
+        norms (memmap): The read-only L2 norm of each feature row
+        track_ids (memmap): The read-only `UriIndex` track id of each feature row
+    """
+    file_name = 'track_features.mias'
+
+    def __init__(self, path: str = None):
+        """The initialization of the Feature Store class, mapping a published feature store file
+
+        Args:
+            path (str): The path to the feature store file. Defaults to the file alongside the tracks dataset.
+        """
+        self.path = path if path is not None else data_path(self.file_name)
+        with open(self.path, 'rb') as file:
+            magic, header_length = struct.unpack('<8sQ', file.read(16))
+            if magic != MAGIC:
+                raise ValueError(f'{self.path} is not a MIAS feature store file')
+            self.header = json.loads(file.read(header_length).decode('utf-8'))
+
+        rows, width = self.header['rows'], len(self.header['columns'])
+        offsets = self.header['offsets']
+        self.columns = self.header['columns']
+        self.features = np.memmap(self.path, dtype=np.float64, mode='r', offset=offsets['features'], shape=(rows, width))
+        self.norms = np.memmap(self.path, dtype=np.float64, mode='r', offset=offsets['norms'], shape=(rows,))
+        self.track_ids = np.memmap(self.path, dtype=np.int32, mode='r', offset=offsets['track_ids'], shape=(rows,))
+
+    @classmethod
+    def open(cls, path: str = None):
+        """Method maps the published feature store, if one exists
+
+        Args:
+            path (str): The path to the feature store file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (FeatureStore): The mapped feature store, or None if no feature store has been published.
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        return cls(path) if os.path.exists(path) else None
+
+    @staticmethod
+    def publish(df, path: str = None, version: str = None, encoder: FeatureEncoder = None, fitted_rows: int = None):
+        """Method encodes the tracks dataset and publishes the feature matrix as a feature store file
+
+        The file is written to a temporary path and atomically moved into place, such that processes still mapping the
+        previous version are unaffected.
+
+        Args:
+            df (DataFrame): The dataframe containing the raw data from the `data/tracks.csv` file
+            path (str): The path to the feature store file. Defaults to the file alongside the tracks dataset.
+            version (str): The dataset version of the features. Defaults to the version of `data/tracks.csv`.
+            encoder (FeatureEncoder): A fitted encoder (e.g. of a previous store) the tracks are encoded with. By default, an encoder is fitted on the tracks.
+            fitted_rows (int): The number of tracks the given encoder was fitted on. Defaults to the number of tracks.
+
+        Returns:
+            (str): The path to the published feature store file
+        """
+        path = path if path is not None else data_path(FeatureStore.file_name)
+        encoder = encoder if encoder is not None else FeatureEncoder(vocabulary=GenreVocabulary.open(df)).fit(df)
+        features = encoder.transform(df)
+        norms = np.linalg.norm(features, axis=1)
+        uri_index = UriIndex.open()
+        track_ids = uri_index.encode(df['uris'])
+        uri_index.save()
+
+        header = {'version': version if version is not None else dataset_version(),
+                  'schema': encoder.schema.fingerprint(),
+                  'columns': encoder.schema.columns(),
+                  'rows': features.shape[0],
+                  'fitted_rows': fitted_rows if fitted_rows is not None else features.shape[0],
+                  'encoder': encoder.state()}
+        return FeatureStore.write(path, header, features, norms, track_ids)
+
+    @staticmethod
+    def write(path: str, header: dict, features, norms, track_ids):
+        """Method atomically writes a feature store file
+
+        Args:
+            path (str): The path to the feature store file
+            header (dict): The file header (without the block offsets)
+            features (ndarray): The (rows, columns) feature matrix
+            norms (ndarray): The L2 norm of each feature row
+            track_ids (ndarray): The `UriIndex` track id of each feature row
+
+        Returns:
+            (str): The path to the written feature store file
+        """
+        blocks = [('features', np.asarray(features, dtype=np.float64)), ('norms', np.asarray(norms, dtype=np.float64)),
+                  ('track_ids', np.asarray(track_ids, dtype=np.int32))]
+
+        header_length = len(json.dumps(header).encode('utf-8')) + 512  # Reserve space for the block offsets
+        offset = FeatureStore.align(16 + header_length)
+        header['offsets'] = {}
+        for name, block in blocks:
+            header['offsets'][name] = offset
+            offset = FeatureStore.align(offset + block.nbytes)
+        encoded_header = json.dumps(header).encode('utf-8').ljust(header_length)
+
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(struct.pack('<8sQ', MAGIC, header_length))
+            file.write(encoded_header)
+            for name, block in blocks:
+                file.seek(header['offsets'][name])
+                file.write(np.ascontiguousarray(block).tobytes())
+        os.replace(temporary_path, path)
+        return path
+
+    @staticmethod
+    def merge(paths: list, path: str = None, version: str = None):
+        """Method merges feature stores encoded by the same encoder (e.g. of the dataset partitions) into one store
+
+        Tracks held by several stores are de-duplicated on their track ids, keeping the row of the first store.
+
+        Note, the rows of all stores are copied into the merged store, the cost of a merge is therefore proportional to
+        the size of the dataset (no parsing or encoding is performed).
+
+        Args:
+            paths (list): The paths to the feature stores, the most recently ingested first
+            path (str): The path to the merged feature store file. Defaults to the file alongside the tracks dataset.
+            version (str): The dataset version of the merged store. Defaults to the version of `data/tracks.csv`.
+
+        Returns:
+            (str): The path to the merged feature store file
+        """
+        path = path if path is not None else data_path(FeatureStore.file_name)
+        stores = [FeatureStore(store_path) for store_path in paths]
+        encoder = json.dumps(stores[0].header['encoder'], sort_keys=True)
+        if any(json.dumps(store.header['encoder'], sort_keys=True) != encoder for store in stores[1:]):
+            raise ValueError('Feature stores encoded by different encoders can not be merged')
+
+        track_ids = np.concatenate([store.track_ids for store in stores])
+        _, first = np.unique(track_ids, return_index=True)  # Keep the row of the most recent store
+        rows = np.sort(first)
+        header = {key: value for key, value in stores[0].header.items() if key != 'offsets'}
+        header.update(version=version if version is not None else dataset_version(), rows=int(rows.shape[0]))
+        features = np.concatenate([store.features for store in stores])[rows]
+        norms = np.concatenate([store.norms for store in stores])[rows]
+        return FeatureStore.write(path, header, features, norms, track_ids[rows])
+
+    @staticmethod
+    def publish_partitions(df, partitions: TrackPartitions, partition: str = None, refit_growth: float = 0.2):
+        """Method publishes the feature store of a partitioned tracks dataset, encoding each partition into its own
+        store (`data/partitions/<partition>.mias`) and merging the partition stores.
+
+        The encoder of the published store is kept (frozen) while the dataset has grown by less than `refit_growth` since
+        it was fitted, such that only the newly ingested partition is parsed and encoded, i.e. the encoding costs
+        O(recent data). Once the dataset has outgrown the encoder (or partition stores are missing), the encoder is
+        refitted on the full dataset, and all partitions are encoded again.
+
+        Note, the merge (see `merge()`) still copies the rows of every partition store into the published store, i.e. a
+        publish costs a sequential O(dataset) copy of the feature rows in addition to the O(recent data) encoding.
+
+        Args:
+            df (DataFrame): The dataframe containing all stored tracks (the merged view of the partitions)
+            partitions (TrackPartitions): The partitions of the tracks dataset
+            partition (str): The name of the newly ingested partition
+            refit_growth (float): The fraction of tracks added since the encoder was fitted, beyond which it is refitted
+
+        Returns:
+            (str): The path to the published feature store file
+        """
+        current = FeatureStore.open()
+        fitted_rows = current.header.get('fitted_rows') if current is not None else None
+        names = partitions.names()
+        missing = [name for name in names if not os.path.exists(partitions.feature_path(name))]
+        if fitted_rows is not None and df.shape[0] <= fitted_rows * (1 + refit_growth) and set(missing) <= {partition}:
+            encoder = current.encoder()
+            stale = missing if partition is None else list(dict.fromkeys(missing + [partition]))
+        else:
+            encoder = FeatureEncoder(vocabulary=GenreVocabulary.open(df)).fit(df)
+            fitted_rows = df.shape[0]
+            stale = names
+            print(f'Refitted the feature encoder on {fitted_rows} tracks')
+
+        for name in stale:
+            tracks = pd.read_csv(partitions.path(name + '.csv'), index_col=0)
+            FeatureStore.publish(tracks, partitions.feature_path(name), version=name, encoder=encoder,
+                                 fitted_rows=fitted_rows)
+        return FeatureStore.merge([partitions.feature_path(name) for name in reversed(names)])
+
+    @staticmethod
+    def align(offset: int):
+        """Method rounds a file offset up to the block alignment
+
+        Args:
+            offset (int): The file offset
+
+        Returns:
+            (int): The aligned file offset
+        """
+        return -(-offset // ALIGNMENT) * ALIGNMENT
+
+    def version(self):
+        """Method provides the dataset version the feature store was published from
+
+        Returns:
+            (str): The dataset version
+        """
+        return self.header['version']
+
+    def is_current(self):
+        """Method determines whether the feature store was published from the current tracks dataset
+
+        Returns:
+            (bool): True if the feature store matches the current version of `data/tracks.csv`
+        """
+        return self.header['version'] == dataset_version()
+
+    def encoder(self, vocabulary: GenreVocabulary = None):
+        """Method restores the fitted feature encoder the store was published with, allowing further tracks (e.g. a
+        playlist) to be encoded in the same feature space.
+
+        Args:
+            vocabulary (GenreVocabulary): The interned genre vocabulary. The persisted vocabulary is used if not given.
+
+        Returns:
+            (FeatureEncoder): The fitted feature encoder
+        """
+        vocabulary = vocabulary if vocabulary is not None else GenreVocabulary.load()
+        return FeatureEncoder.from_state(self.header['encoder'], vocabulary)
@@ -0,0 +1,455 @@
+import ast
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import DatasetLock, UriIndex, data_path, dataset_version, load_versioned, save_versioned
+
+"""This file provides the interned genre vocabulary of the tracks dataset.
+
+    The `artist_genres` column is stored in `tracks.csv` as a stringified Python list. This file parses each artist's
+    genres once at ingest, interning every genre as an integer id, and persists an artist -> genre-id CSR mapping
+    alongside the dataset, such that genre features (TFIDF) can be computed from integer codes.
+
+    An inverted index from genre id to track ids is built with the dataset too, enabling similarity calculations to
+    generate candidates (the tracks sharing a genre with the playlist) rather than scoring every track.
+"""
+
+
+def parse_genres(value):
+    """Method parses the genres of an artist, as stored in the `artist_genres` column
+
+    Args:
+        value (str | list): The stringified list of genres (as stored in `tracks.csv`), or a list of genres.
+
+    Returns:
+        (list): The list of genre names
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return list(value)
+    if not isinstance(value, str) or value == '':
+        return []
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return []
+    return [genre for genre in parsed if isinstance(genre, str)] if isinstance(parsed, (list, tuple)) else []
+
+
+class GenreVocabulary:
+    """The class interns the genres of all artists in the dataset as integer ids.
+
+    Artist genres are held in a CSR (compressed sparse row) mapping, where the genre ids of the artist with id `a` are
+    `indices[indptr[a]:indptr[a + 1]]`.
+
+    Attributes:
+        terms (list): The genre names, the position in the list is the genre id
+        term_ids (dict): The mapping of genre name to genre id
+        artists (list): The artist uris, the position in the list is the artist id
+        artist_ids (dict): The mapping of artist uri to artist id
+        indptr (ndarray): The CSR row pointer (int64) of the artist -> genre mapping
+        indices (ndarray): The CSR genre ids (int32) of the artist -> genre mapping
+        sources (ndarray): The stringified genres each artist was interned from, ordered by artist id
+    """
+    file_name = 'genre_vocabulary.npz'
+
+    def __init__(self, terms=None, artists=None, indptr=None, indices=None, sources=None):
+        """The initialization of the Genre Vocabulary class
+
+        Args:
+            terms (list): The genre names, ordered by genre id
+            artists (list): The artist uris, ordered by artist id
+            indptr (ndarray): The CSR row pointer of the artist -> genre mapping
+            indices (ndarray): The CSR genre ids of the artist -> genre mapping
+            sources (ndarray): The stringified genres each artist was interned from. Unknown sources are empty strings.
+        """
+        self.terms = list(terms) if terms is not None else []
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        self.artists = list(artists) if artists is not None else []
+        self.artist_ids = {artist: artist_id for artist_id, artist in enumerate(self.artists)}
+        self.indptr = np.asarray(indptr, dtype=np.int64) if indptr is not None else np.zeros(1, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32) if indices is not None else np.zeros(0, dtype=np.int32)
+        self.sources = np.asarray(sources, dtype=object) if sources is not None else np.full(len(self.artists), '', dtype=object)
+
+    @classmethod
+    def build(cls, df):
+        """Method builds the genre vocabulary from a tracks dataframe
+
+        Args:
+            df (DataFrame): The dataframe containing the `artist_uris` and `artist_genres` columns
+
+        Returns:
+            (GenreVocabulary): The genre vocabulary of the dataframe artists
+        """
+        vocabulary = cls()
+        vocabulary.update(df)
+        return vocabulary
+
+    @staticmethod
+    def default_path():
+        """Method determines the path of the persisted genre vocabulary, stored alongside the tracks dataset
+
+        Returns:
+            (str): The path to the genre vocabulary file
+        """
+        return data_path(GenreVocabulary.file_name)
+
+    @classmethod
+    def load(cls, path=None):
+        """Method loads a persisted genre vocabulary
+
+        Args:
+            path (str): The path to the genre vocabulary file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (GenreVocabulary): The loaded genre vocabulary, or None if no vocabulary has been persisted.
+        """
+        path = path if path is not None else cls.default_path()
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            sources = stored['sources'].astype(object) if 'sources' in stored.files else None
+            return cls(terms=stored['terms'].tolist(), artists=stored['artists'].tolist(),
+                       indptr=stored['indptr'], indices=stored['indices'], sources=sources)
+
+    @classmethod
+    def open(cls, df):
+        """Method loads the persisted genre vocabulary and interns (in memory) the artists of the dataframe it does not
+        contain yet (or whose genres changed).
+
+        Note, nothing is written to disk, such that the vocabulary can be opened on the request path. The vocabulary is
+        persisted at ingest by `publish()`.
+
+        Args:
+            df (DataFrame): The dataframe containing the `artist_uris` and `artist_genres` columns
+
+        Returns:
+            (GenreVocabulary): A genre vocabulary covering all artists in the dataframe
+        """
+        vocabulary = cls.load()
+        vocabulary = vocabulary if vocabulary is not None else cls()
+        vocabulary.update(df)
+        return vocabulary
+
+    @classmethod
+    def publish(cls, df):
+        """Method interns the artists of the tracks dataset into the persisted genre vocabulary, and persists it if it
+        was built or changed, such that the genres of each artist are parsed once
+
+        The read-modify-write is performed under the cross-process `DatasetLock`.
+
+        Args:
+            df (DataFrame): The dataframe containing all stored tracks
+
+        Returns:
+            (GenreVocabulary): A genre vocabulary covering all artists in the dataframe
+        """
+        with DatasetLock():
+            vocabulary = cls.load()
+            vocabulary = vocabulary if vocabulary is not None else cls()
+            if vocabulary.update(df) or not os.path.exists(cls.default_path()):
+                vocabulary.save()
+            return vocabulary
+
+    def save(self, path=None):
+        """Method atomically persists the genre vocabulary
+
+        Args:
+            path (str): The path to the genre vocabulary file. Defaults to the file alongside the tracks dataset.
+        """
+        path = path if path is not None else self.default_path()
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, terms=np.asarray(self.terms, dtype=str), artists=np.asarray(self.artists, dtype=str),
+                     indptr=self.indptr, indices=self.indices, sources=np.asarray(self.sources, dtype=str))
+        os.replace(path + '.tmp', path)
+
+    def intern(self, genre):
+        """Method determines the id of a genre, adding the genre to the vocabulary if it is new
+
+        Args:
+            genre (str): The genre name
+
+        Returns:
+            (int): The genre id
+        """
+        term_id = self.term_ids.get(genre)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.terms.append(genre)
+            self.term_ids[genre] = term_id
+        return term_id
+
+    def update(self, df):
+        """Method interns the genres of all artists in the dataframe not yet contained in the vocabulary, and re-interns
+        the artists whose genres changed.
+
+        Note, the genres of each artist are parsed only once per change, regardless of the number of tracks of the
+        artist. Changes are detected by comparing the stringified genres (the most recent row of each artist is kept).
+
+        Args:
+            df (DataFrame): The dataframe containing the `artist_uris` and `artist_genres` columns
+
+        Returns:
+            (bool): True if any artist was interned or re-interned
+        """
+        artists = df[['artist_uris', 'artist_genres']].drop_duplicates(subset='artist_uris')
+        uris = artists['artist_uris'].to_numpy(dtype=object)
+        sources = artists['artist_genres'].astype(str).to_numpy(dtype=object)
+        codes = np.fromiter((self.artist_ids.get(artist, -1) for artist in uris), dtype=np.int64, count=uris.shape[0])
+        known = np.flatnonzero(codes >= 0)
+        changed = known[self.sources[codes[known]] != sources[known]]
+        new = np.flatnonzero(codes < 0)
+        if changed.shape[0] == 0 and new.shape[0] == 0:
+            return False
+
+        if changed.shape[0] != 0:  # Rebuild the CSR mapping with the re-interned genres of the changed artists
+            segments = [self.indices[start: end] for start, end in zip(self.indptr[:-1], self.indptr[1:])]
+            for position in changed:
+                segments[codes[position]] = np.asarray(self.genre_ids(artists['artist_genres'].iloc[position]),
+                                                       dtype=np.int32)
+                self.sources[codes[position]] = sources[position]
+            self.indptr = np.zeros(len(segments) + 1, dtype=np.int64)
+            self.indptr[1:] = np.cumsum([segment.shape[0] for segment in segments])
+            self.indices = np.concatenate(segments + [np.zeros(0, dtype=np.int32)]).astype(np.int32)
+
+        lengths = []
+        genre_ids = []
+        for position in new:
+            ids = self.genre_ids(artists['artist_genres'].iloc[position])
+            self.artist_ids[uris[position]] = len(self.artists)
+            self.artists.append(uris[position])
+            lengths.append(len(ids))
+            genre_ids.extend(ids)
+
+        self.indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(lengths, dtype=np.int64)])
+        self.indices = np.concatenate([self.indices, np.asarray(genre_ids, dtype=np.int32)])
+        self.sources = np.concatenate([self.sources, sources[new]])
+        return True
+
+    def genre_ids(self, genres):
+        """Method interns the genres of an artist
+
+        Args:
+            genres (str | list): The stringified list of genres (as stored in `tracks.csv`), or a list of genres
+
+        Returns:
+            (list): The unique genre ids of the artist, in order of appearance
+        """
+        return list(dict.fromkeys(self.intern(genre) for genre in parse_genres(genres)))
+
+    def lookup(self, genres):
+        """Method maps the genres of an artist to their ids without modifying the vocabulary (genres not contained in
+        the vocabulary are skipped), such that a shared vocabulary can be read concurrently
+
+        Args:
+            genres (str | list): The stringified list of genres (as stored in `tracks.csv`), or a list of genres
+
+        Returns:
+            (list): The unique known genre ids of the artist, in order of appearance
+        """
+        return list(dict.fromkeys(term_id for term_id in map(self.term_ids.get, parse_genres(genres))
+                                  if term_id is not None))
+
+    def artist_codes(self, artist_uris):
+        """Method maps artist uris to artist ids
+
+        Args:
+            artist_uris (Series): The artist uris (each must be contained in the vocabulary)
+
+        Returns:
+            (ndarray): The artist id of each artist uri
+        """
+        return pd.Series(artist_uris).map(self.artist_ids).to_numpy(dtype=np.int64)
+
+    def track_genres(self, artist_codes):
+        """Method gathers the genre ids of each track from the artist -> genre CSR mapping
+
+        Args:
+            artist_codes (ndarray): The artist id of each track
+
+        Returns:
+            rows (ndarray): The track position of each (track, genre) pair
+            genres (ndarray): The genre id of each (track, genre) pair
+        """
+        starts = self.indptr[artist_codes]
+        lengths = self.indptr[artist_codes + 1] - starts
+        rows = np.repeat(np.arange(len(artist_codes)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return rows, self.indices[np.repeat(starts, lengths) + offsets]
+
+    def document_frequency(self, artist_codes):
+        """Method counts the number of tracks containing each genre
+
+        Args:
+            artist_codes (ndarray): The artist id of each track
+
+        Returns:
+            (ndarray): The number of tracks containing each genre, indexed by genre id
+        """
+        track_counts = np.bincount(artist_codes, minlength=len(self.artists))  # Tracks per artist
+        artist_lengths = np.diff(self.indptr)
+        return np.bincount(self.indices, weights=np.repeat(track_counts, artist_lengths), minlength=len(self.terms))
+
+
+class GenreIndex:
+    """The class holds the inverted index from genre id to the (interned) ids of the tracks of the genre.
+
+    The track ids of the genre with id `g` are `track_ids[indptr[g]:indptr[g + 1]]`, in a CSR layout.
+
+    The persisted index of the current dataset version is loaded once per process by `open()`.
+
+    Attributes:
+        vocabulary (GenreVocabulary): The genre vocabulary the genre ids refer to
+        indptr (ndarray): The CSR row pointer (int64) of the genre -> track mapping
+        track_ids (ndarray): The CSR track ids (int32) of the genre -> track mapping
+        version (str): The dataset version the index was built from
+    """
+    file_name = 'genre_index.npz'
+    opened = None  # The process-wide genre index of the latest opened dataset version
+    opened_lock = threading.Lock()
+
+    def __init__(self, vocabulary: GenreVocabulary, indptr, track_ids, version=None):
+        """The initialization of the Genre Index class
+
+        Args:
+            vocabulary (GenreVocabulary): The genre vocabulary the genre ids refer to
+            indptr (ndarray): The CSR row pointer of the genre -> track mapping
+            track_ids (ndarray): The CSR track ids of the genre -> track mapping
+            version (str): The dataset version the index was built from
+        """
+        self.vocabulary = vocabulary
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.track_ids = np.asarray(track_ids, dtype=np.int32)
+        self.version = version
+
+    @classmethod
+    def build(cls, df, vocabulary: GenreVocabulary = None, uri_index: UriIndex = None, version=None):
+        """Method builds the inverted genre index of a tracks dataframe
+
+        Args:
+            df (DataFrame): The dataframe containing the `uris`, `artist_uris` and `artist_genres` columns
+            vocabulary (GenreVocabulary): The genre vocabulary. Defaults to the persisted vocabulary (updated with the dataframe artists).
+            uri_index (UriIndex): The interned track ids. Defaults to the persisted uri index.
+            version (str): The dataset version of the dataframe
+
+        Returns:
+            (GenreIndex): The inverted genre index
+        """
+        vocabulary = vocabulary if vocabulary is not None else GenreVocabulary.open(df)
+        vocabulary.update(df)
+        uri_index = uri_index if uri_index is not None else UriIndex.open()
+        rows, genres = vocabulary.track_genres(vocabulary.artist_codes(df['artist_uris']))
+        track_ids = uri_index.encode(df['uris'])[rows]
+
+        order = np.lexsort((track_ids, genres))  # Group by genre, ordering the tracks of each genre
+        genres, track_ids = genres[order], track_ids[order]
+        unique = np.ones(genres.shape[0], dtype=bool)  # Drop repeated (genre, track) pairs (e.g. duplicated rows)
+        unique[1:] = (genres[1:] != genres[:-1]) | (track_ids[1:] != track_ids[:-1])
+        genres, track_ids = genres[unique], track_ids[unique]
+
+        indptr = np.zeros(len(vocabulary.terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(genres, minlength=len(vocabulary.terms)))
+        return cls(vocabulary, indptr, track_ids, version)
+
+    @classmethod
+    def publish(cls, df, vocabulary: GenreVocabulary = None, path=None):
+        """Method builds and persists the inverted genre index of the current tracks dataset
+
+        Args:
+            df (DataFrame): The dataframe containing all stored tracks
+            vocabulary (GenreVocabulary): The genre vocabulary. Defaults to the persisted vocabulary.
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (GenreIndex): The published genre index
+        """
+        index = cls.build(df, vocabulary, version=dataset_version())
+        index.save(path)
+        return index
+
+    @classmethod
+    def load(cls, version: str, vocabulary: GenreVocabulary = None, path=None):
+        """Method loads the persisted genre index of a dataset version
+
+        Args:
+            version (str): The dataset version of the index
+            vocabulary (GenreVocabulary): The genre vocabulary. Defaults to the persisted vocabulary.
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (GenreIndex): The loaded genre index, or None if no index (or vocabulary) has been persisted, or the index is stale.
+        """
+        stored = load_versioned(path if path is not None else data_path(cls.file_name), version)
+        vocabulary = vocabulary if vocabulary is not None or stored is None else GenreVocabulary.load()
+        if stored is None or vocabulary is None:
+            return None
+        return cls(vocabulary, stored['indptr'], stored['track_ids'], version)
+
+    @classmethod
+    def open(cls, df):
+        """Method provides the process-wide genre index of the current dataset version, loading the persisted index on
+        first use (or once the dataset has changed). If the persisted index is missing or stale, an index is built (in
+        memory) from the dataframe, and is not shared.
+
+        Args:
+            df (DataFrame): The dataframe containing all stored tracks
+
+        Returns:
+            (GenreIndex): The genre index of the current tracks dataset
+        """
+        version = dataset_version()
+        with cls.opened_lock:
+            if cls.opened is not None and cls.opened.version == version:
+                return cls.opened
+            index = cls.load(version)
+            if index is not None:
+                cls.opened = index
+                return index
+        return cls.build(df)
+
+    def save(self, path=None):
+        """Method persists the genre index
+
+        Args:
+            path (str): The path to the index file. Defaults to the file alongside the tracks dataset.
+        """
+        save_versioned(path if path is not None else data_path(self.file_name), self.version, indptr=self.indptr,
+                       track_ids=self.track_ids)
+
+    def top_genres(self, playlist, count: int = 5):
+        """Method determines the most frequent genres of the tracks of a playlist
+
+        Args:
+            playlist (DataFrame): The playlist dataframe containing the `artist_uris` and `artist_genres` columns
+            count (int): The maximum number of genres
+
+        Returns:
+            (ndarray): The genre ids, in descending order of the number of playlist tracks of the genre
+        """
+        codes = pd.Series(playlist['artist_uris']).map(self.vocabulary.artist_ids)
+        known = codes.notna().to_numpy()
+        _, genres = self.vocabulary.track_genres(codes[known].to_numpy(dtype=np.int64))
+        # The shared vocabulary is read-only here, the genres of artists not in the dataset are looked up instead
+        unknown = [genre for artist_genres in playlist['artist_genres'][~known]
+                   for genre in self.vocabulary.lookup(artist_genres)]
+        genres = np.concatenate([genres, np.asarray(unknown, dtype=genres.dtype)])
+        frequency = np.bincount(genres[genres < self.indptr.shape[0] - 1], minlength=self.indptr.shape[0] - 1)
+        ranked = np.argsort(-frequency, kind='stable')[:count]
+        return ranked[frequency[ranked] > 0]
+
+    def tracks_of(self, genre_ids):
+        """Method gathers the tracks of any of the given genres
+
+        Args:
+            genre_ids (ndarray): The genre ids
+
+        Returns:
+            (ndarray): The unique track ids of the genres
+        """
+        genre_ids = np.asarray(genre_ids, dtype=np.int64)
+        if genre_ids.shape[0] == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.track_ids[self.indptr[genre]: self.indptr[genre + 1]] for genre in genre_ids]))
+
@@ -1,15 +1,20 @@
 import streamlit as st
 import os
+import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-import seaborn as sns
-from sklearn.preprocessing import MinMaxScaler
 import re
 
+from dataset_store import DatasetExports, TrackPartitions, TrackSample, TrackSchema, UriIndex
+
 
 class Monitor:
     """Monitor class serves as a dataset monitor
 
+    Note, the tracks dataset is loaded lazily, column by column, as columns are requested, in the compact in-memory
+    schema (see `dataset_store.TrackSchema`). Sampled features are served from the persisted reservoir sample built at
+    ingest (see `dataset_store.TrackSample`). If a crawl window is set, only the partitions of the last crawls are read
+    (see `dataset_store.TrackPartitions`), and the sample is drawn from the tracks within the window.
+
     Attributes:
         history_name (str): Name of the history dataset file name
         tracks_name (str): Name of the tracks dataset file name
@@ -17,7 +22,10 @@ class Monitor:
         hist_path (Path): Path to the history dataset
         track_path (Path): Path to the tracks dataset
         history (DataFrame): History dataset as a dataframe
-        tracks (DataFrame): Track dataset as a dataframe
+        columns (dict): The loaded track dataset columns, mapping column name to Series
+        sample (TrackSample): The reservoir sample of the tracks dataset (loaded on first use)
+        crawl_window (int): Only the tracks ingested by the last `crawl_window` crawls are analysed (0 = all tracks)
+        partitions (TrackPartitions): The partitions of the tracks dataset, None if the dataset is not partitioned
     """
     def __init__(self):
         """Method constructs the dataset monitor for data analysis within this page"""
@@ -28,11 +36,71 @@ class Monitor:
         self.track_path = os.path.join(self.root_path, 'data', self.tracks_name)
 
         self.history = pd.read_csv(self.hist_path)
-        self.tracks = pd.read_csv(self.track_path)
+        self.columns = {}
+        self.sample = None
+        self.crawl_window = 0
+        self.partitions = TrackPartitions.load()
 
         self.history['date'] = pd.to_datetime(self.history['date'], format="%d-%m-%Y")  # Format the date
         self.history['time'] = pd.to_datetime(self.history['time'], format='%H:%M:%S')  # Format the time
 
+    def set_crawl_window(self, last_crawls: int):
+        """Method limits the analysed tracks to those ingested by the last crawls, dropping the loaded columns and sample
+        if the window changes.
+
+        Args:
+            last_crawls (int): The number of most recent crawls to be analysed (0 = all tracks)
+        """
+        last_crawls = last_crawls if self.partitions is not None else 0  # An unpartitioned dataset has no crawl window
+        if last_crawls != self.crawl_window:
+            self.crawl_window = last_crawls
+            self.columns = {}
+            self.sample = None
+
+    def access_columns(self, selection: list):
+        """Method provides the requested columns of the tracks dataset, reading only the columns not loaded yet.
+
+        The url columns (see `TrackSchema.derived_columns`) are not read, but derived from the track uris.
+
+        Args:
+            selection (list): A list of column names
+
+        Returns:
+            (DataFrame): A dataframe containing the requested columns
+        """
+        derived = [column for column in selection if column in TrackSchema.derived_columns]
+        parsed = [column for column in selection if column not in derived] + (['uris'] if len(derived) != 0 else [])
+        missing = [column for column in dict.fromkeys(parsed) if column not in self.columns]
+        if len(missing) != 0:
+            if self.crawl_window > 0:  # Partition pruning: parse the partitions within the window only
+                loaded = self.partitions.read(last=self.crawl_window, usecols=missing)
+            else:
+                loaded = TrackSchema.read(self.track_path, usecols=missing)  # Projection: parse the missing columns only
+            for column in missing:
+                self.columns[column] = loaded[column]
+        for column in derived:
+            if column not in self.columns:
+                self.columns[column] = TrackSchema.derive(pd.DataFrame({'uris': self.columns['uris']}), [column])[column]
+        return pd.DataFrame({column: self.columns[column] for column in selection})
+
+    def access_sample(self):
+        """Method provides the reservoir sample of the tracks dataset, loading it on first use.
+
+        If no sample has been persisted yet (or a crawl window is set), a sample is built in memory from the tracks.
+
+        Returns:
+            (DataFrame): The sampled tracks
+        """
+        if self.sample is None and self.crawl_window > 0:
+            self.sample = TrackSample()
+            self.sample.update(self.partitions.read(last=self.crawl_window), UriIndex(), random_state=1)
+        if self.sample is None:
+            self.sample = TrackSample.load()
+            if self.sample is None:
+                self.sample = TrackSample()
+                self.sample.update(TrackSchema.read(self.track_path), UriIndex(), random_state=1)
+        return self.sample.tracks
+
     def determine_date_range(self):
         """Method determines the date range in the dataset history file.
 
@@ -46,11 +114,12 @@ class Monitor:
         """Method samples the tracks dataset and selects acoustic features for visualization in the pairplot.
 
         Note, sampling is used here as the size of the tracks dataset would take a long time to render in a pairplot.
+        The persisted reservoir sample is used, rather than resampling the tracks dataset.
 
         Returns:
             (DataFrame): Sampled tracks dataframe containing select acoustic features.
         """
-        track_sample = self.tracks.sample(frac=0.1, random_state=1)
+        track_sample = self.access_sample()
         acoustics_df = track_sample[['danceability', 'energy', 'loudness', 'speechiness',
                                     'acousticness', 'instrumentalness']]
         return acoustics_df
@@ -66,10 +135,8 @@ class Monitor:
             (DataFrame): A dataframe containing the specified feature.
         """
         if sample:
-            track_sample = self.tracks.sample(frac=0.1, random_state=2)
-        else:
-            track_sample = self.tracks
-        return track_sample[selection]
+            return self.access_sample()[selection].copy()
+        return self.access_columns(selection)
 
     def access_artist_names(self):
         """Method determines the unique artist names in the tracks dataset.
@@ -77,7 +144,7 @@ class Monitor:
         Returns:
             (list): A list of unique artists available in the tracks dataset.
         """
-        names = self.tracks['artist_names'].unique().tolist()
+        names = self.access_columns(['artist_names'])['artist_names'].unique().tolist()
         return names
 
     def access_feature_definitions(self):
@@ -92,29 +159,73 @@ class Monitor:
             return contents
 
 
+@st.cache_resource
+def read_export(path: str):
+    """Method reads a published export artifact, shared by all sessions of the process.
+
+    Note, artifact file names contain the dataset version, such that a new version is read (and cached) once.
+
+    Args:
+        path (str): The path to the export artifact
+
+    Returns:
+        (bytes): The artifact contents
+    """
+    with open(path, 'rb') as file:
+        return file.read()
+
+
 def datasets_download_section():
-    """Method prepares the `tracks.csv` and the `dataset_growth.csv` files for download."""
-    # Tracks download
-    with open(st.session_state.monitor.track_path, 'rb') as file:
-        data = file.read()
-
-    st.download_button(
-        label='Click to download tracks dataset',
-        data=data,
-        file_name='tracks.csv',
-        key='download_dataset'
-    )
-
-    # Growth download
-    with open(st.session_state.monitor.hist_path, 'rb') as history_file:
-        data_hist = history_file.read()
-
-    st.download_button(
-        label='Click to download tracks growth dataset',
-        data=data_hist,
-        file_name='dataset_growth.csv',
-        key='download_dataset_growth'
-    )
+    """Method prepares the `tracks.csv` and the `dataset_growth.csv` files for download.
+
+    The compressed, versioned export artifacts published at ingest are served (see `dataset_store.DatasetExports`).
+    If no artifacts have been published, the uncompressed files are served instead.
+    """
+    exports = DatasetExports.load()
+    labels = {'csv.gz': 'csv (gzip)', 'csv.zst': 'csv (zstd)', 'parquet': 'parquet'}
+    for name, label in [('tracks.csv', 'tracks dataset'), ('dataset_growth.csv', 'tracks growth dataset')]:
+        artifacts = exports.artifacts(name)
+        if len(artifacts) == 0:  # Fall back to the uncompressed dataset file
+            path = os.path.join(st.session_state.monitor.root_path, 'data', name)
+            with open(path, 'rb') as file:
+                st.download_button(label=f'Click to download {label}', data=file.read(), file_name=name,
+                                   key=f'download_{name}')
+            continue
+
+        for artifact_format, artifact in artifacts.items():
+            st.download_button(
+                label=f'Click to download {label} as {labels[artifact_format]} ({artifact["bytes"] / 1e6:.1f} MB)',
+                data=read_export(artifact['path']),
+                file_name=artifact['file'],
+                mime=DatasetExports.media_types[artifact_format],
+                key=f'download_{name}_{artifact_format}'
+            )
+        st.caption(f'{name} sha256 checksums: ' + ', '.join(f'{artifact["file"]}: {artifact["sha256"]}'
+                                                             for artifact in artifacts.values()))
+
+
+def scale_features(df: pd.DataFrame, columns: list, feature_range=(-1, 1)):
+    """Method min-max scales the given columns of a dataframe (in place) into the feature range.
+
+    Columns with a single value are scaled to the lower bound of the range.
+
+    Args:
+        df (DataFrame): The dataframe containing the features
+        columns (list): The columns to be scaled
+        feature_range (tuple): The (low, high) range of the scaled values
+
+    Returns:
+        (DataFrame): The dataframe with the scaled columns
+    """
+    if df.shape[0] == 0:
+        return df
+    values = df[columns].to_numpy(dtype=np.float64)
+    minimums = np.nanmin(values, axis=0)
+    ranges = np.nanmax(values, axis=0) - minimums
+    ranges[ranges == 0] = 1
+    low, high = feature_range
+    df[columns] = low + (values - minimums) / ranges * (high - low)
+    return df
 
 
 def create_feature_selection(maximum=12):
@@ -162,6 +273,9 @@ def generate_growth_plot(start, end):
     Returns:
         (PyPlot Figure): A line plot figure showcasing the dataset growth over time
     """
+    import seaborn as sns  # Plotting libraries are deferred to the plots, keeping them off the page start-up path
+    from matplotlib import pyplot as plt
+
     df = st.session_state.monitor.history
     history_filtered = df[(df['date'] >= start) & (df['date'] <= end)]
 
@@ -177,12 +291,17 @@ def generate_growth_plot(start, end):
 
 
 @st.cache_resource
-def generate_pair_plot():
+def generate_pair_plot(crawl_window: int = 0):
     """This function generates a pair plot showcasing the relationship between acoustic analysis features of the tracks in the dataset.
 
+    Args:
+        crawl_window (int): The crawl window of the monitor, such that a plot is generated (and cached) per window
+
     Returns:
         (PyPlot Figure): A pyplot figure showcasing the acoustic feature relationships
     """
+    import seaborn as sns
+
     df = st.session_state.monitor.access_acoustic_sample_features()
 
     sns.set()
@@ -201,11 +320,12 @@ def generate_distribution(selection: list):
     Returns:
         (PyPlot Figure): A figure showcasing the various acoustic feature distributions
     """
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+
     df = st.session_state.monitor.access_specific_features(selection)
 
-    scaler = MinMaxScaler(feature_range=(-1, 1))  # Normalize the data between [-1, 1] for visual purposes
-    columns = selection
-    df[columns] = scaler.fit_transform(df[columns])
+    df = scale_features(df, selection, feature_range=(-1, 1))  # Normalize the data between [-1, 1] for visual purposes
 
     sns.set()
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -229,14 +349,15 @@ def generate_artist_comparison(selection: list, artist_filter: list):
     Returns:
         (PyPlot Figure): A swarmplot showing comparable artist acoustic features
     """
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+
     selection.append('artist_names')
     df = st.session_state.monitor.access_specific_features(selection, sample=False)
     df = df[df['artist_names'].isin(artist_filter)]  # Filter df to keep arist only tracks
     selection.remove('artist_names')
 
-    scaler = MinMaxScaler(feature_range=(-1, 1))  # Normalize the data between [-1, 1] for visual purposes
-    columns = selection
-    df[columns] = scaler.fit_transform(df[columns])
+    df = scale_features(df, selection, feature_range=(-1, 1))  # Normalize the data between [-1, 1] for visual purposes
 
     sns.set()
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -292,12 +413,15 @@ with st.expander('Feature Definitions', expanded=False):
     feature_defs = st.session_state.monitor.access_feature_definitions()
     for definition in feature_defs.split('\\n'):
         st.markdown(definition)
+crawl_window = st.number_input('Only analyse tracks ingested by the last N crawls (0 = all crawls)',
+                               min_value=0, value=0, step=1)
+st.session_state.monitor.set_crawl_window(crawl_window)
 
 # Acoustic features (pairplot)
 st.markdown('#### Acoustic Features')
 st.markdown('Please note that the below graphic is rendered using a sample of the dataset and a select set of '
             'features to promote readability')
-fig_2 = generate_pair_plot()
+fig_2 = generate_pair_plot(st.session_state.monitor.crawl_window)
 st.pyplot(fig_2)
 
 # Track acoustic feature comparison
@@ -329,7 +453,7 @@ if len(search) != 0:
 
 # Dataset download
 st.header('Datasets Download')
-st.markdown('Please click the below button to download the Spotify tracks dataset as a csv file.')
+st.markdown('Please click the below button to download the Spotify tracks dataset as a compressed csv or parquet file.')
 st.markdown("**Disclaimer:** The dataset was collected to create a simple song recommendation system, based on track "
             "acoustic features, artist, popularity, etc. It does not include any propriety Spotify audio content or "
             "Spotify audio tracks. The dataset contains publicly available information from Spotify and is intended "
@@ -1,7 +1,10 @@
+import hashlib
+
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.feature_extraction.text import TfidfVectorizer
 
+from dataset_store import UriIndex
+from genres import GenreVocabulary
 from pipeline_interface import Pipeline
 
 
@@ -10,123 +13,259 @@ class CosinePipeline(Pipeline):
     carried out by the Cosine Similarity class."""
 
     @staticmethod
-    def select_columns(df):
-        """This method selects the columns to be included within feature calculations.
+    def data_pipeline(df):
+        """This method enacts the transformation pipeline to produce a set of track features.
 
-        This method, allows for the ignoring/ removal of peripheral or uneeded columns.
+        This pipeline makes use of the following transformations, encoded in a single pass by the `FeatureEncoder`:
+        - One-hot_encoding
+        - TFIDF transformation (of the interned artist genres)
+        - Min-Max Scaling of numerical values
+
+        It is essential to note that all features are normalized between [0, 1]
 
         Args:
             df (DataFrame): The dataframe containing the raw data from the `data/tracks.csv` file
 
         Returns:
-            (DataFrame): The modified dataframe object containing only the select columns.
+              (DataFrame): A dataframe containing all track features
         """
-        df = df[['uris', 'artist_pop',
-                 'artist_genres', 'track_pop', 'danceability', 'energy',
-                 'keys', 'loudness', 'modes', 'speechiness', 'acousticness',
-                 'instrumentalness', 'liveness', 'valences', 'tempos', 'durations_ms', 'time_signatures']]
-        return df
+        encoder = FeatureEncoder(vocabulary=GenreVocabulary.open(df)).fit(df)
+        return encoder.transform_frame(df)
 
     @staticmethod
-    def ohe_prep(df, column):
-        """This method performs a One-Hot-Encoding (OHE) on a specified column
+    def unique_tracks(df, df_target):
+        """Method ensures that df (tracks dataframe) does not contain the same tracks as the playlist (df_target)
 
         Args:
-            df (DataFrame): The dataframe containing the tracks information, now being processes by the pipeline.
-            column (str): The name of the column on which the OHE transformation should be performed.
+            df (DataFrame): The dataframe containing the tracks dataset.
+            df_target (DataFrame): The dataframe containing the tracks from the playlist
+
+        Returns:
+            (DataFrame): The tracks dataframe containing none of the same tracks as in the playlist.
         """
-        df_encoded = pd.get_dummies(df, columns=[column], dtype=int)
-        return df_encoded
+        uri_index = UriIndex.open()
+        track_ids = uri_index.encode(df.index)
+        in_target = uri_index.membership(uri_index.lookup(df_target['uris']))  # Playlist membership bitmap
+        return df[~in_target[track_ids]]
 
     @staticmethod
-    def tfidf_transformation(df_parm):
-        """This method performs the term frequency–inverse document frequency (tfidf) transformation on the `artist genre` column.
+    def extract_target(df, df_target):
+        """This method allows for the extraction of tracks in the playlist from the tracks dataset.
+        Note, for this method to work, the track uris should be the index in the tracks dataframe (df).
 
-        Note, more information on tfidf transformation can be found here: https://www.geeksforgeeks.org/understanding-tf-idf-term-frequency-inverse-document-frequency/
+        This method is largely used once the tracks dataset has been transformed into a set of features,
+        and the playlist track features are required to be extracted.
 
         Args:
-            df_parm (DataFrame): The dataframe containing the tracks information, now undergoing tfidg transfromation
+            df (DataFrame): The dataframe containing the tracks dataset.
+            df_target (DataFrame): The dataframe containing the tracks from the playlist
 
         Returns:
-            (DataFrame): The transformed dataframe containing the results of the tfidf transfromation.
+            (DataFrame): A resulting dataframe containing only the tracks from the playlist that were in the tracks dataset.
         """
-        tf = TfidfVectorizer(analyzer='word', ngram_range=(1, 1), min_df=0.0, max_features=50)
-        tfidf_matrix = tf.fit_transform(df_parm['artist_genres'])
+        uri_index = UriIndex.open()
+        track_ids = uri_index.encode(df.index)
+        in_target = uri_index.membership(uri_index.lookup(df_target['uris']))  # Playlist membership bitmap
+        return df[in_target[track_ids]]
 
-        genre_df = pd.DataFrame(tfidf_matrix.toarray(), columns=tf.get_feature_names_out())
-        genre_df.columns = ['genre' + "|" + i for i in genre_df.columns]
 
-        df_parm = df_parm.drop(columns=['artist_genres'])
 
-        combined_df = pd.concat([df_parm.reset_index(drop=True), genre_df.reset_index(drop=True)], axis=1)
-        return combined_df
+class FeatureSchema:
+    """This class declares the fixed column layout of the track feature matrix.
 
-    @staticmethod
-    def data_pipeline(df):
-        """This method enacts the transformation pipeline to produce a set of track features.
+    The layout is made up of the following blocks (in order):
+    - Passthrough numeric columns (popularity)
+    - Min-Max scaled numeric columns
+    - One-hot columns for each categorical column, over a fixed set of categories
+    - The genre TFIDF block
 
-        This pipeline makes use of the following transformation methods:
-        - One-hot_encoding
-        - TFIDF transformation
-        - Min-Max Scaling of numerical values
+    As the categories are declared rather than derived from the data, the layout of the numeric and one-hot blocks
+    never changes between dataset versions, allowing cached feature matrices and indexes to be reused.
 
-        It is essential to note that all features are normalized between [0, 1]
+    Attributes:
+        genre_terms (list): The genre terms of the genre block (fitted by the `FeatureEncoder`)
+    """
+    identifier = 'uris'
+    passthrough_columns = ['artist_pop', 'track_pop']
+    scaled_columns = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness',
+                      'liveness', 'valences', 'tempos', 'durations_ms']
+    categorical_columns = {'modes': list(range(2)),
+                           'keys': list(range(12)),
+                           'time_signatures': list(range(8))}
+    genre_features = 50
+
+    def __init__(self, genre_terms=None):
+        """The initialization of the Feature Schema class
 
         Args:
-            df (DataFrame): The dataframe containing the raw data from the `data/tracks.csv` file
+            genre_terms (list): The genre terms of the genre block. Empty until fitted by the `FeatureEncoder`.
+        """
+        self.genre_terms = list(genre_terms) if genre_terms is not None else []
+
+    def columns(self):
+        """Method lists the feature column names in layout order
 
         Returns:
-              (DataFrame): A dataframe containing all track features
+            (list): The feature column names
         """
+        columns = self.passthrough_columns + self.scaled_columns
+        for column, categories in self.categorical_columns.items():
+            columns = columns + [f'{column}_{category}' for category in categories]
+        return columns + ['genre' + "|" + term for term in self.genre_terms]
 
-        df_pipe = CosinePipeline.select_columns(df)
+    def width(self):
+        """Method determines the number of feature columns
 
-        # Perform OHE
-        df_pipe = CosinePipeline.ohe_prep(df_pipe, 'modes')
-        df_pipe = CosinePipeline.ohe_prep(df_pipe, 'keys')
-        df_pipe = CosinePipeline.ohe_prep(df_pipe, 'time_signatures')
+        Returns:
+            (int): The number of feature columns
+        """
+        return len(self.columns())
 
-        # Normalize popularity values
-        scaler = MinMaxScaler(feature_range=(0, 1))
-        columns = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valences', 'durations_ms', 'tempos']
-        df_pipe[columns] = scaler.fit_transform(df_pipe[columns])
+    def fingerprint(self):
+        """Method creates a short fingerprint of the column layout, identifying compatible cached feature matrices
 
-        # Perform TFID vectorization on genres
-        df_pipe = CosinePipeline.tfidf_transformation(df_parm=df_pipe)
+        Returns:
+            (str): The hex digest of the column layout
+        """
+        return hashlib.sha1("\n".join(self.columns()).encode('utf-8')).hexdigest()[:16]
 
-        df_pipe = df_pipe.set_index(keys='uris', drop=True)
 
-        return df_pipe
+class FeatureEncoder:
+    """This class encodes raw track data into features, writing each block of the `FeatureSchema` straight into one
+    preallocated contiguous array.
 
-    @staticmethod
-    def unique_tracks(df, df_target):
-        """Method ensures that df (tracks dataframe) does not contain the same tracks as the playlist (df_target)
+    Attributes:
+        schema (FeatureSchema): The column layout of the feature matrix
+        vocabulary (GenreVocabulary): The interned genre vocabulary, from which the genre block is computed
+        minimums (ndarray): The fitted minimum of each scaled column
+        ranges (ndarray): The fitted range (max - min) of each scaled column
+        genre_ids (ndarray): The vocabulary ids of the genres in the genre block (in schema order)
+        idf (ndarray): The fitted inverse document frequency of each genre in the genre block
+    """
+    def __init__(self, schema: FeatureSchema = None, vocabulary: GenreVocabulary = None):
+        """The initialization of the Feature Encoder class
 
         Args:
-            df (DataFrame): The dataframe containing the tracks dataset.
-            df_target (DataFrame): The dataframe containing the tracks from the playlist
+            schema (FeatureSchema): The column layout of the feature matrix. A default schema is used if not given.
+            vocabulary (GenreVocabulary): The interned genre vocabulary. If not given, it is built when fitting.
+        """
+        self.schema = schema if schema is not None else FeatureSchema()
+        self.vocabulary = vocabulary
+        self.minimums = None
+        self.ranges = None
+        self.genre_ids = None
+        self.idf = None
+
+    def fit(self, df):
+        """Method fits the Min-Max scaling and the genre TFIDF on the tracks dataset
+
+        The genre block holds the `genre_features` most frequent genres, weighted using a smoothed inverse document
+        frequency: idf = ln((1 + n) / (1 + df)) + 1
+
+        Args:
+            df (DataFrame): The dataframe containing the raw data from the `data/tracks.csv` file
 
         Returns:
-            (DataFrame): The tracks dataframe containing none of the same tracks as in the playlist.
+            (FeatureEncoder): The fitted encoder
         """
-        df = df.drop(df_target['uris'], errors='ignore')
-        return df
+        values = df[self.schema.scaled_columns].to_numpy(dtype=np.float64)
+        self.minimums = values.min(axis=0)
+        self.ranges = values.max(axis=0) - self.minimums
+        self.ranges[self.ranges == 0] = 1  # Constant columns are scaled to 0
+
+        if self.vocabulary is None:
+            self.vocabulary = GenreVocabulary.build(df)
+        else:
+            self.vocabulary.update(df)
+        frequency = self.vocabulary.document_frequency(self.vocabulary.artist_codes(df['artist_uris']))
+
+        present = np.flatnonzero(frequency)
+        ranked = present[np.argsort(-frequency[present], kind='stable')][:self.schema.genre_features]
+        self.genre_ids = np.asarray(sorted(ranked, key=lambda genre_id: self.vocabulary.terms[genre_id]), dtype=np.int64)
+        self.idf = np.log((1 + df.shape[0]) / (1 + frequency[self.genre_ids])) + 1
+        self.schema.genre_terms = [self.vocabulary.terms[genre_id] for genre_id in self.genre_ids]
+        return self
+
+    def state(self):
+        """Method captures the fitted state of the encoder, such that it can be persisted (e.g. in a feature store header)
 
-    @staticmethod
-    def extract_target(df, df_target):
-        """This method allows for the extraction of tracks in the playlist from the tracks dataset.
-        Note, for this method to work, the track uris should be the index in the tracks dataframe (df).
+        Returns:
+            (dict): The JSON serializable fitted state
+        """
+        return {'minimums': self.minimums.tolist(),
+                'ranges': self.ranges.tolist(),
+                'genre_terms': list(self.schema.genre_terms),
+                'idf': self.idf.tolist()}
 
-        This method is largely used once the tracks dataset has been transformed into a set of features,
-        and the playlist track features are required to be extracted.
+    @classmethod
+    def from_state(cls, state: dict, vocabulary: GenreVocabulary = None):
+        """Method restores a fitted encoder from its persisted state
 
         Args:
-            df (DataFrame): The dataframe containing the tracks dataset.
-            df_target (DataFrame): The dataframe containing the tracks from the playlist
+            state (dict): The fitted state, as returned by `state()`
+            vocabulary (GenreVocabulary): The interned genre vocabulary. An empty vocabulary is used if not given.
 
         Returns:
-            (DataFrame): A resulting dataframe containing only the tracks from the playlist that were in the tracks dataset.
+            (FeatureEncoder): The fitted encoder
         """
-        target_uris = df_target['uris'].tolist()
-        return df[df.index.isin(target_uris)]
+        vocabulary = vocabulary if vocabulary is not None else GenreVocabulary()
+        encoder = cls(schema=FeatureSchema(genre_terms=state['genre_terms']), vocabulary=vocabulary)
+        encoder.minimums = np.asarray(state['minimums'], dtype=np.float64)
+        encoder.ranges = np.asarray(state['ranges'], dtype=np.float64)
+        encoder.genre_ids = np.asarray([vocabulary.intern(term) for term in state['genre_terms']], dtype=np.int64)
+        encoder.idf = np.asarray(state['idf'], dtype=np.float64)
+        return encoder
 
+    def transform(self, df):
+        """Method encodes the raw track data into the feature matrix
+
+        Args:
+            df (DataFrame): The dataframe containing the raw track data
+
+        Returns:
+            (ndarray): The (n_tracks, schema width) feature matrix, in schema column order
+        """
+        n_tracks = df.shape[0]
+        rows = np.arange(n_tracks)
+        features = np.zeros((n_tracks, self.schema.width()), dtype=np.float64)  # Preallocated feature matrix
+
+        offset = len(self.schema.passthrough_columns)
+        features[:, :offset] = df[self.schema.passthrough_columns].to_numpy(dtype=np.float64)
+
+        scaled = features[:, offset: offset + len(self.schema.scaled_columns)]  # View into the feature matrix
+        scaled[:] = df[self.schema.scaled_columns].to_numpy(dtype=np.float64)
+        scaled -= self.minimums
+        scaled /= self.ranges
+        offset = offset + len(self.schema.scaled_columns)
+
+        for column, categories in self.schema.categorical_columns.items():  # One-hot encode declared categories
+            positions = np.searchsorted(categories, df[column].to_numpy())
+            positions = np.minimum(positions, len(categories) - 1)
+            known = np.asarray(categories)[positions] == df[column].to_numpy()  # Undeclared categories remain 0
+            features[rows[known], offset + positions[known]] = 1
+            offset = offset + len(categories)
+
+        self.vocabulary.update(df)  # Intern the genres of any unseen artists
+        genre_rows, genres = self.vocabulary.track_genres(self.vocabulary.artist_codes(df['artist_uris']))
+        positions = np.full(len(self.vocabulary.terms), -1, dtype=np.int64)  # Genre id -> genre block position
+        positions[self.genre_ids] = np.arange(len(self.genre_ids))
+        genre_positions = positions[genres]
+        selected = genre_positions >= 0
+        genre_rows, genre_positions = genre_rows[selected], genre_positions[selected]
+
+        weights = self.idf[genre_positions]  # Scatter the L2 normalized TFIDF weights into the genre block
+        norms = np.sqrt(np.bincount(genre_rows, weights=weights ** 2, minlength=n_tracks))
+        features[genre_rows, offset + genre_positions] = weights / norms[genre_rows]
+        return features
+
+    def transform_frame(self, df):
+        """Method encodes the raw track data into a feature dataframe indexed by the track uris
+
+        Args:
+            df (DataFrame): The dataframe containing the raw track data
+
+        Returns:
+            (DataFrame): A dataframe containing all track features
+        """
+        index = pd.Index(df[self.schema.identifier], name=self.schema.identifier)
+        return pd.DataFrame(self.transform(df), index=index, columns=self.schema.columns())
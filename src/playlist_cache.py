@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+from crawl_batching import AUDIO_FEATURES, CrawlBatcher
+
+"""This file provides the process-wide cache of extracted target playlists, keyed by playlist id and snapshot id.
+
+    Spotify assigns each version of a playlist a `snapshot_id`, which changes whenever the playlist is modified. A
+    resubmitted playlist is checked with a single cheap metadata call: an unchanged playlist is served from the cache,
+    while a changed playlist is listed again, requesting the artist and audio feature information of its new tracks
+    only.
+"""
+
+
+class PlaylistCache:
+    """The class caches the extracted track stores of target playlists, evicting the least recently used playlists.
+    All methods are thread-safe.
+
+    Attributes:
+        capacity (int): The maximum number of cached playlists
+        entries (OrderedDict): The (snapshot id, track store) of each cached playlist id, in order of use
+        hits (int): The number of lookups served from the cache
+        misses (int): The number of lookups of uncached or changed playlists
+        lock (Lock): Guards the entries
+    """
+    def __init__(self, capacity: int = 64):
+        """The initialization of the Playlist Cache class
+
+        Args:
+            capacity (int): The maximum number of cached playlists
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, playlist_id: str, snapshot_id: str):
+        """Method looks up the track store of a playlist version
+
+        Args:
+            playlist_id (str): The id (uri) of the playlist
+            snapshot_id (str): The snapshot id of the current playlist version
+
+        Returns:
+            (dict): A copy of the cached track store, or None if the playlist version is not cached
+        """
+        with self.lock:
+            entry = self.entries.get(playlist_id)
+            if entry is None or entry[0] != snapshot_id:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(playlist_id)
+            self.hits += 1
+            return {key: list(values) for key, values in entry[1].items()}
+
+    def put(self, playlist_id: str, snapshot_id: str, store: dict):
+        """Method caches the track store of a playlist version, replacing any previous version of the playlist
+
+        Args:
+            playlist_id (str): The id (uri) of the playlist
+            snapshot_id (str): The snapshot id of the playlist version
+            store (dict): The resolved track store of the playlist
+        """
+        with self.lock:
+            self.entries[playlist_id] = (snapshot_id, {key: list(values) for key, values in store.items()})
+            self.entries.move_to_end(playlist_id)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def seed(self, playlist_id: str, batcher: CrawlBatcher):
+        """Method seeds a batcher with the artist and audio feature information of the cached version of a playlist,
+        such that only the tracks (and artists) new to the playlist are requested
+
+        Args:
+            playlist_id (str): The id (uri) of the playlist
+            batcher (CrawlBatcher): The batcher resolving the listed tracks of the playlist
+        """
+        with self.lock:
+            entry = self.entries.get(playlist_id)
+            if entry is None:
+                return
+            store = entry[1]
+            for artist, popularity, genres in zip(store['artist_uris'], store['artist_pop'], store['artist_genres']):
+                batcher.artists[artist] = (popularity, genres)
+            for position, uri in enumerate(store['uris']):
+                batcher.audio_features[uri] = {feature: store[key][position] for key, feature in AUDIO_FEATURES.items()}
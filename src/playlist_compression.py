@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+"""This file provides playlist compression for multi-vector similarity scoring.
+
+    A playlist of P tracks is summarised into k representative centroids (with weights), such that a similarity
+    engine scores each track against k vectors instead of P, capping the per-request cost for large playlists.
+"""
+
+
+class PlaylistCompressor:
+    """The class compresses a playlist feature matrix into k weighted centroids using mini-batch k-means.
+
+    The number of centroids k adapts to the playlist size, growing with the square root of the number of tracks
+    and capped at `max_centroids`.
+
+    Attributes:
+        max_centroids (int): The upper bound on the number of centroids produced.
+        batch_size (int): The number of playlist tracks sampled in each mini-batch update.
+        iterations (int): The number of mini-batch updates performed.
+        random_state (int): The seed used for initialization and batch sampling, ensuring repeatable summaries.
+    """
+    def __init__(self, max_centroids=8, batch_size=64, iterations=50, random_state=1):
+        """The initialization of the Playlist Compressor class
+
+        Args:
+            max_centroids (int): The upper bound on the number of centroids produced.
+            batch_size (int): The number of playlist tracks sampled in each mini-batch update.
+            iterations (int): The number of mini-batch updates performed.
+            random_state (int): The seed used for initialization and batch sampling.
+        """
+        self.max_centroids = max_centroids
+        self.batch_size = batch_size
+        self.iterations = iterations
+        self.random_state = random_state
+
+    def choose_k(self, n_tracks: int):
+        """Method determines the number of centroids for a playlist of the given size.
+
+        Args:
+            n_tracks (int): The number of tracks in the playlist
+
+        Returns:
+            (int): The number of centroids, in the range [1, max_centroids]
+        """
+        k = math.ceil(math.sqrt(n_tracks / 2))
+        return int(max(1, min(self.max_centroids, k, n_tracks)))
+
+    def compress(self, playlist_features: pd.DataFrame):
+        """Method summarises the playlist features into k weighted centroids.
+
+        Args:
+            playlist_features (DataFrame): The playlist track features (after transformation pipeline)
+
+        Returns:
+            centroids (ndarray): A (k, n_features) matrix of centroid vectors.
+            weights (ndarray): The fraction of playlist tracks assigned to each centroid (sums to 1).
+        """
+        points = np.asarray(playlist_features, dtype=np.float64)
+        k = self.choose_k(points.shape[0])
+        if k == 1:  # A single centroid is the mean playlist vector
+            return points.mean(axis=0, keepdims=True), np.ones(1)
+
+        rng = np.random.default_rng(self.random_state)
+        centroids = self.initialize_centroids(points, k, rng)
+        counts = np.zeros(k)
+        batch_size = min(self.batch_size, points.shape[0])
+
+        for _ in range(self.iterations):  # Mini-batch updates with per-centroid learning rates
+            batch = points[rng.choice(points.shape[0], size=batch_size, replace=False)]
+            labels = self.assign(batch, centroids)
+            for point, label in zip(batch, labels):
+                counts[label] += 1
+                centroids[label] += (point - centroids[label]) / counts[label]
+
+        labels = self.assign(points, centroids)  # Final assignment determines the centroid weights
+        sizes = np.bincount(labels, minlength=k)
+        occupied = sizes > 0  # Drop centroids which no playlist track is assigned to
+        return centroids[occupied], sizes[occupied] / points.shape[0]
+
+    @staticmethod
+    def initialize_centroids(points, k, rng):
+        """Method selects the initial centroids using k-means++ seeding.
+
+        Args:
+            points (ndarray): The playlist feature matrix
+            k (int): The number of centroids to select
+            rng (Generator): The numpy random generator
+
+        Returns:
+            (ndarray): A (k, n_features) matrix of initial centroids.
+        """
+        centroids = [points[rng.integers(points.shape[0])]]
+        for _ in range(1, k):
+            distances = ((points[:, None, :] - np.asarray(centroids)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+            total = distances.sum()
+            if total == 0:  # All remaining points coincide with a centroid
+                centroids.append(points[rng.integers(points.shape[0])])
+            else:
+                centroids.append(points[rng.choice(points.shape[0], p=distances / total)])
+        return np.array(centroids, dtype=np.float64)
+
+    @staticmethod
+    def assign(points, centroids):
+        """Method assigns each point to its nearest centroid (squared euclidean distance).
+
+        Args:
+            points (ndarray): The points to be assigned
+            centroids (ndarray): The current centroids
+
+        Returns:
+            (ndarray): The index of the nearest centroid for each point.
+        """
+        distances = (points ** 2).sum(axis=1)[:, None] - 2 * points @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+        return distances.argmin(axis=1)
@@ -0,0 +1,177 @@
+import numpy as np
+
+from dataset_store import data_path, load_versioned, save_versioned
+from feature_store import FeatureStore, normalize_rows
+from quantised_similarity import QuantisedCosineSimilarity
+
+"""This file provides a reduced-rank projection of the track features, scanned before exact rescoring.
+
+    After one-hot encoding and the genre TFIDF block, the track feature matrix holds many correlated or near-empty
+    columns. A truncated SVD of the L2 normalized track vectors is fitted once per dataset version, and the projected
+    (reduced-rank) track vectors are persisted alongside the dataset. A first-pass scan over the projected vectors
+    selects the best candidates, which are then rescored exactly, as in the quantised similarity.
+
+    Note, the SVD is not centred (as in a TruncatedSVD), such that dot products are approximated directly. Weighted
+    features remain supported, as the weighted playlist vector is projected onto the same components.
+"""
+
+
+class FeatureProjection:
+    """The class holds the truncated SVD projection of the L2 normalized track vectors.
+
+    A normalized track vector x / |x| is approximated as `components @ vectors[row]`, such that its dot product with a
+    query vector q is approximated by `vectors[row] . (components.T @ q)`.
+
+    Attributes:
+        components (ndarray): The (columns, rank) orthonormal components of the projection
+        vectors (ndarray): The (rows, rank) float32 projected track vectors
+        kept (float): The fraction of the energy (the uncentred squared norm) of the normalized track vectors kept by the projection. Note, this is not the explained variance, and is inflated by columns common to all tracks.
+        version (str): The dataset version the projection was fitted on
+    """
+    file_name = 'track_features_svd.npz'
+    rank = 32  # The default number of components
+    chunk_rows = 4096  # Rows projected per block
+
+    def __init__(self, components, vectors, kept, version=None):
+        """The initialization of the Feature Projection class
+
+        Args:
+            components (ndarray): The (columns, rank) orthonormal components of the projection
+            vectors (ndarray): The (rows, rank) projected track vectors
+            kept (float): The fraction of the energy of the normalized track vectors kept by the projection
+            version (str): The dataset version the projection was fitted on
+        """
+        self.components = components
+        self.vectors = vectors
+        self.kept = kept
+        self.version = version
+
+    @classmethod
+    def build(cls, matrix, norms, version=None, rank: int = None):
+        """Method fits the truncated SVD of a track feature matrix and projects its rows
+
+        The components are the leading eigenvectors of the (columns, columns) Gram matrix of the normalized rows, which
+        is accumulated block by block, such that the (memory-mapped) feature matrix is never copied as a whole.
+
+        Args:
+            matrix (ndarray): The (rows, columns) track feature matrix
+            norms (ndarray): The L2 norm of each row of the matrix
+            version (str): The dataset version of the matrix
+            rank (int): The number of components. Defaults to the class `rank` (at most the number of columns).
+
+        Returns:
+            (FeatureProjection): The fitted projection
+        """
+        rank = min(rank if rank is not None else cls.rank, matrix.shape[1])
+        gram = np.zeros((matrix.shape[1], matrix.shape[1]), dtype=np.float64)
+        for start in range(0, matrix.shape[0], cls.chunk_rows):
+            block = normalize_rows(matrix[start: start + cls.chunk_rows], norms[start: start + cls.chunk_rows])
+            gram += block.T @ block
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        order = np.argsort(-eigenvalues, kind='stable')[:rank]
+        components = eigenvectors[:, order]
+        kept = float(eigenvalues[order].sum() / eigenvalues.sum()) if eigenvalues.sum() > 0 else 1.0
+
+        vectors = np.empty((matrix.shape[0], rank), dtype=np.float32)
+        for start in range(0, matrix.shape[0], cls.chunk_rows):
+            block = normalize_rows(matrix[start: start + cls.chunk_rows], norms[start: start + cls.chunk_rows])
+            vectors[start: start + cls.chunk_rows] = block @ components
+        return cls(components, vectors, kept, version)
+
+    def scan_recall(self, matrix, norms, queries: int = 20, k: int = 30, random_state: int = 1):
+        """Method estimates the recall@k of the scan alone (without exact rescoring), against an exact scan of the
+        normalized track vectors, using sampled tracks as queries
+
+        Args:
+            matrix (ndarray): The (rows, columns) track feature matrix the projection was fitted on
+            norms (ndarray): The L2 norm of each row of the matrix
+            queries (int): The number of sampled query tracks
+            k (int): The number of top tracks compared
+            random_state (int): The seed of the query sample
+
+        Returns:
+            (float): The mean fraction of the exact top-k tracks also in the top-k of the scan
+        """
+        rng = np.random.default_rng(random_state)
+        rows = np.sort(rng.choice(matrix.shape[0], size=min(queries, matrix.shape[0]), replace=False))
+        vectors = normalize_rows(matrix[rows], norms[rows])
+        exact = np.empty((matrix.shape[0], rows.shape[0]), dtype=np.float64)
+        for start in range(0, matrix.shape[0], self.chunk_rows):
+            block = normalize_rows(matrix[start: start + self.chunk_rows], norms[start: start + self.chunk_rows])
+            exact[start: start + self.chunk_rows] = block @ vectors.T
+        scanned = self.scan(vectors)
+        k = min(k, matrix.shape[0])
+        if k == 0 or rows.shape[0] == 0:
+            return 1.0
+        exact_top = np.argpartition(-exact, k - 1, axis=0)[:k]
+        scanned_top = np.argpartition(-scanned, k - 1, axis=0)[:k]
+        return float(np.mean([np.intersect1d(exact_top[:, query], scanned_top[:, query]).shape[0] / k
+                              for query in range(rows.shape[0])]))
+
+    @classmethod
+    def publish(cls, feature_store: FeatureStore, path: str = None, rank: int = None):
+        """Method fits the projection of a published feature store and persists it alongside the dataset
+
+        Args:
+            feature_store (FeatureStore): The published feature store
+            path (str): The path to the projection file. Defaults to the file alongside the tracks dataset.
+            rank (int): The number of components. Defaults to the class `rank`.
+
+        Returns:
+            (dict): The statistics of the projection: the number of features and components, the fraction of the energy kept (`energy_kept`, see `kept`) and the estimated recall@30 of the scan alone (`scan_recall`, see `scan_recall()`)
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        projection = cls.build(feature_store.features, feature_store.norms, feature_store.version(), rank)
+        save_versioned(path, projection.version, components=projection.components, vectors=projection.vectors,
+                       kept=projection.kept)
+        return {'features': projection.components.shape[0], 'components': projection.components.shape[1],
+                'energy_kept': projection.kept,
+                'scan_recall': projection.scan_recall(feature_store.features, feature_store.norms)}
+
+    @classmethod
+    def open(cls, feature_store: FeatureStore, path: str = None):
+        """Method loads the persisted projection of a feature store (it is not fitted if it is missing or stale)
+
+        Args:
+            feature_store (FeatureStore): The published feature store
+            path (str): The path to the projection file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (FeatureProjection): The projection matching the feature store version, None if it is missing or stale
+        """
+        stored = load_versioned(path if path is not None else data_path(cls.file_name), feature_store.version())
+        if stored is None:
+            return None
+        return cls(stored['components'], stored['vectors'], float(stored['kept']), feature_store.version())
+
+    def nbytes(self):
+        """Method determines the memory held by the projection
+
+        Returns:
+            (int): The number of bytes of the projected track vectors and components
+        """
+        return self.vectors.nbytes + self.components.nbytes
+
+    def scan(self, vectors, rows=None):
+        """Method approximates the dot product of each normalized track vector with the given unit vectors, in the
+        reduced-rank space
+
+        Args:
+            vectors (ndarray): A (k, columns) matrix of unit vectors (e.g. the weighted playlist vector)
+            rows (ndarray): The rows to be scanned. Defaults to all rows.
+
+        Returns:
+            (ndarray): A (rows, k) matrix of approximate cosine similarities
+        """
+        projected = (vectors @ self.components).astype(np.float32).T  # Project the query onto the components
+        return (self.vectors if rows is None else self.vectors[rows]) @ projected
+
+
+class ProjectedCosineSimilarity(QuantisedCosineSimilarity):
+    """The class implements a two-stage cosine similarity: a scan over the reduced-rank (truncated SVD) track vectors,
+        followed by the exact rescoring of the best candidates.
+
+        This class inherits the Quantised Cosine Similarity class, replacing its int8 index by a `FeatureProjection`.
+        The recall against an exact full scan can be measured using `measure_recall()`.
+        """
+    index_class = FeatureProjection
@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+
+from dataset_store import data_path, load_versioned, save_versioned
+from feature_store import FeatureStore, normalize_rows
+from genres import GenreIndex
+from playlist_compression import PlaylistCompressor
+from ranking import RankedCursor
+from similarity import TracksCosineSimilarity
+
+"""This file provides a quantised cosine similarity, scanning int8 track vectors before exact rescoring.
+
+    The L2 normalized track vectors are stored as int8 codes with a per-row scale, cutting the memory streamed by the
+    dominant full scan by 8x (compared to float64). The best candidates of the int8 scan are then rescored exactly
+    against the float feature matrix.
+
+    Note, as the raw popularity columns dominate the track vectors, normalized track vectors are tightly clustered.
+    The residual of each normalized vector from the dataset centre is therefore quantised, rather than the vector
+    itself, preserving the small differences that separate the most similar tracks.
+"""
+
+
+class QuantisedIndex:
+    """The class holds the int8 quantised, L2 normalized track vectors.
+
+    Each row is quantised as codes = round((x / |x| - centre) / scale * 127), where centre is the mean normalized track
+    vector and scale is the maximum absolute value of the row residual. A row is recovered as
+    centre + codes * scale / 127.
+
+    Attributes:
+        codes (ndarray): The (rows, columns) int8 codes of the normalized track vector residuals
+        scales (ndarray): The float32 scale of each row
+        centre (ndarray): The mean normalized track vector
+        version (str): The dataset version the index was built from
+    """
+    file_name = 'track_features_int8.npz'
+    chunk_rows = 4096  # Rows converted per block of the scan, keeping the converted block in cache
+
+    def __init__(self, codes, scales, centre, version=None):
+        """The initialization of the Quantised Index class
+
+        Args:
+            codes (ndarray): The (rows, columns) int8 codes of the normalized track vector residuals
+            scales (ndarray): The float32 scale of each row
+            centre (ndarray): The mean normalized track vector
+            version (str): The dataset version the index was built from
+        """
+        self.codes = codes
+        self.scales = scales
+        self.centre = centre
+        self.version = version
+
+    @classmethod
+    def build(cls, matrix, norms, version=None):
+        """Method quantises a track feature matrix
+
+        Args:
+            matrix (ndarray): The (rows, columns) track feature matrix
+            norms (ndarray): The L2 norm of each row of the matrix
+            version (str): The dataset version of the matrix
+
+        Returns:
+            (QuantisedIndex): The quantised index
+        """
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        scales = np.empty(matrix.shape[0], dtype=np.float32)
+        centre = np.zeros(matrix.shape[1], dtype=np.float64)
+        for start in range(0, matrix.shape[0], cls.chunk_rows):  # First pass determines the centre
+            centre += normalize_rows(matrix[start: start + cls.chunk_rows], norms[start: start + cls.chunk_rows]).sum(axis=0)
+        centre /= max(matrix.shape[0], 1)
+
+        for start in range(0, matrix.shape[0], cls.chunk_rows):  # Second pass quantises the residuals block by block
+            block = normalize_rows(matrix[start: start + cls.chunk_rows], norms[start: start + cls.chunk_rows]) - centre
+            block_scales = np.abs(block).max(axis=1, initial=0)
+            block_scales[block_scales == 0] = 1
+            codes[start: start + cls.chunk_rows] = np.rint(block / block_scales[:, None] * 127)
+            scales[start: start + cls.chunk_rows] = block_scales
+        return cls(codes, scales, centre, version)
+
+    @classmethod
+    def publish(cls, feature_store: FeatureStore, path: str = None):
+        """Method builds the quantised index of a published feature store and persists it alongside the dataset
+
+        Args:
+            feature_store (FeatureStore): The published feature store
+            path (str): The path to the quantised index file. Defaults to the file alongside the tracks dataset.
+        """
+        path = path if path is not None else data_path(cls.file_name)
+        index = cls.build(feature_store.features, feature_store.norms, feature_store.version())
+        save_versioned(path, index.version, codes=index.codes, scales=index.scales, centre=index.centre)
+
+    @classmethod
+    def open(cls, feature_store: FeatureStore, path: str = None):
+        """Method loads the persisted quantised index of a feature store
+
+        Note, the index is not built if it is missing or stale, as building it costs more than the exact scan it
+        speeds up. It is published with the dataset (see `publish()`).
+
+        Args:
+            feature_store (FeatureStore): The published feature store
+            path (str): The path to the quantised index file. Defaults to the file alongside the tracks dataset.
+
+        Returns:
+            (QuantisedIndex): The quantised index matching the feature store version, None if it is missing or stale
+        """
+        stored = load_versioned(path if path is not None else data_path(cls.file_name), feature_store.version())
+        if stored is None:
+            return None
+        return cls(stored['codes'], stored['scales'], stored['centre'], feature_store.version())
+
+    def nbytes(self):
+        """Method determines the memory held by the index
+
+        Returns:
+            (int): The number of bytes of the codes, scales and centre
+        """
+        return self.codes.nbytes + self.scales.nbytes + self.centre.nbytes
+
+    def scan(self, vectors, rows=None):
+        """Method approximates the dot product of each normalized track vector with the given unit vectors
+
+        The query vectors are quantised to int8 as well. Each block of codes is widened to float32 before the product,
+        which is exact for integer sums below 2^24 (i.e. up to ~1000 columns).
+
+        Args:
+            vectors (ndarray): A (k, columns) matrix of unit vectors
+            rows (ndarray): The rows to be scanned. Defaults to all rows.
+
+        Returns:
+            (ndarray): A (rows, k) matrix of approximate cosine similarities
+        """
+        vector_scales = np.abs(vectors).max(axis=1)
+        vector_scales[vector_scales == 0] = 1
+        vector_codes = np.rint(vectors / vector_scales[:, None] * 127).astype(np.float32).T
+
+        count = self.codes.shape[0] if rows is None else rows.shape[0]
+        scores = np.empty((count, vectors.shape[0]), dtype=np.float32)
+        for start in range(0, count, self.chunk_rows):
+            if rows is None:
+                block = self.codes[start: start + self.chunk_rows].astype(np.float32)
+            else:
+                block = self.codes[rows[start: start + self.chunk_rows]].astype(np.float32)
+            scores[start: start + self.chunk_rows] = block @ vector_codes
+        scores *= (self.scales if rows is None else self.scales[rows])[:, None] / 127
+        scores *= (vector_scales / 127).astype(np.float32)[None, :]
+        return scores + (vectors @ self.centre).astype(np.float32)[None, :]  # Add back the centre contribution
+
+
+class QuantisedCosineSimilarity(TracksCosineSimilarity):
+    """The class implements a two-stage cosine similarity: an int8 scan over the quantised track vectors, followed by
+        the exact rescoring of the best candidates.
+
+        This class inherits the Cosine Similarity class (and therefore the Similarity interface), sharing its features,
+        playlist vectors and feature weighting.
+
+        Note, when features are weighted, the scan is corrected by the ratio of the unweighted to weighted track norms,
+        computed from the weighted columns only. Heavier weighting still lowers the recall of the scan.
+
+        Without a published index (or a feature store), all tracks are scored exactly, as in the Cosine Similarity.
+
+        Attributes:
+            index (QuantisedIndex): The int8 quantised track vectors (or another index of the `index_class`), None if no index is published
+            rescore (int): The number of best scan candidates rescored exactly
+            candidates (ndarray): The scored track positions (into `similarity`) that were rescored exactly
+            vectors (ndarray): The playlist vector(s) of the last similarity calculation
+            blend (ndarray): The weight of each playlist vector of the last similarity calculation
+            recall (float): The recall of the last call to `measure_recall()`, None if it has not been measured
+        """
+    index_class = QuantisedIndex  # The approximate index scanned in the first stage
+
+    def __init__(self, playlist: pd.DataFrame, tracks: pd.DataFrame, weighted_features: list,
+                 compressor: PlaylistCompressor = None, feature_store: FeatureStore = None,
+                 index: QuantisedIndex = None, rescore: int = 500, genre_index: GenreIndex = None):
+        """The initialization of the Quantised Cosine Similarity class
+
+        Args:
+            playlist (DataFrame): The tracks dataset dataframe (before pipeline transformation)
+            tracks (DataFrame): The playlist tracks dataframe (before pipeline transformation)
+            weighted_features (list): A list of features to be weighted in order to prioritize feature importance in similarity calculation.
+            compressor (PlaylistCompressor): Optional playlist compressor, enabling multi-vector scoring against k playlist centroids.
+            feature_store (FeatureStore): Optional published feature store (see `TracksCosineSimilarity`).
+            index (QuantisedIndex): The quantised index of the track features. If not given, the persisted index of the feature store is used (the tracks are scored exactly if there is none).
+            rescore (int): The number of best scan candidates rescored exactly.
+            genre_index (GenreIndex): Optional inverted genre index, restricting the scan to the genre candidates (see `TracksCosineSimilarity.generate_candidates()`).
+        """
+        super().__init__(playlist, tracks, weighted_features, compressor=compressor, feature_store=feature_store,
+                         genre_index=genre_index)
+        if index is None and feature_store is not None:
+            index = self.index_class.open(feature_store)
+        self.index = index
+        self.rescore = rescore
+        self.candidates = None
+        self.vectors = None
+        self.blend = None
+        self.recall = None
+
+    def calculate_similarity(self):
+        """Method calculates the similarity between the playlist vector(s) and the tracks, using the int8 scan to
+        select candidates which are then rescored exactly.
+
+        This calculation populates the `self.similarity` field. Tracks outside the rescored candidates keep their
+        approximate score, capped below the lowest exact candidate score, such that ranking always favours the
+        exactly rescored tracks. Without an index, all tracks are scored exactly.
+        """
+        if self.index is None:
+            return super().calculate_similarity()
+        if self.compressor is None:
+            vectors, blend = self.vectorize_playlist(), np.ones(1)
+        else:
+            vectors, blend = self.vectorize_playlist_centroids()
+        self.vectors, self.blend = vectors, blend
+
+        weighted = vectors * self.weights  # cos(Wx, v) = (x / |x|).(Wv / |Wv|) * (|Wv| / |v|) * (|x| / |Wx|)
+        weighted_lengths = np.maximum(np.linalg.norm(weighted, axis=1), np.finfo(np.float64).tiny)
+        if 2 * self.track_positions.shape[0] > self.track_matrix.shape[0]:
+            approximate = self.index.scan(weighted / weighted_lengths[:, None])[self.track_positions]
+        else:
+            approximate = self.index.scan(weighted / weighted_lengths[:, None], rows=self.track_positions)
+        approximate = approximate.astype(np.float64)
+        approximate *= weighted_lengths / np.maximum(np.linalg.norm(vectors, axis=1), np.finfo(np.float64).tiny)
+        if np.any(self.weights != 1):
+            weighted_norms = self.weighted_norms(self.track_positions)
+            approximate *= np.divide(self.track_norms[self.track_positions], weighted_norms,
+                                     out=np.zeros_like(weighted_norms), where=weighted_norms > 0)[:, None]
+        approximate = approximate @ blend
+
+        count = min(self.rescore, approximate.shape[0])
+        self.candidates = np.argpartition(-approximate, count - 1)[:count] if 0 < count < approximate.shape[0] else np.arange(count)
+        exact = self.cosine_similarity(vectors, positions=self.track_positions[self.candidates]) @ blend
+
+        similarity_score = np.minimum(approximate, exact.min(initial=np.inf))  # Cap approximate scores below candidates
+        similarity_score[self.candidates] = exact
+
+        uris = self.tracks['uris'].to_numpy()[self.dataset_rows(self.track_positions)]
+        self.similarity = pd.Series(similarity_score, index=uris, name='sim_score')
+
+    def cursor(self):
+        """Method provides a cursor over the ranked tracks, which widens the exact rescoring as it advances. Each chunk
+        selected by the cursor (by approximate score, beyond the rescored candidates) is rescored exactly before it is
+        served.
+
+        Returns:
+            (RankedCursor): The cursor over the tracks scored by `calculate_similarity()`
+        """
+        if self.index is None:
+            return super().cursor()
+        return RankedCursor(self.similarity.to_numpy(), self.select_tracks,
+                            refine=lambda positions: self.cosine_similarity(
+                                self.vectors, positions=self.track_positions[positions]) @ self.blend)
+
+    def measure_recall(self, n: int = 30):
+        """Method measures the recall@n of the quantised similarity, against an exact full scan
+
+        Note, this method performs the exact full scan, and is intended for evaluation rather than serving.
+
+        Args:
+            n (int): The number of top tracks compared
+
+        Returns:
+            (float): The fraction of the exact top-n tracks also returned in the quantised top-n
+        """
+        if self.similarity is None:
+            self.calculate_similarity()
+        if self.compressor is None:
+            exact = self.cosine_similarity(self.vectorize_playlist())[:, 0]
+        else:
+            centroids, blend = self.vectorize_playlist_centroids()
+            exact = self.cosine_similarity(centroids) @ blend
+
+        scores = self.similarity.to_numpy()
+        n = min(n, scores.shape[0])
+        exact_top = set(np.argsort(-exact, kind='stable')[:n].tolist())
+        quantised_top = set(np.argsort(-scores, kind='stable')[:n].tolist())
+        self.recall = len(exact_top & quantised_top) / n if n > 0 else 1.0
+        return self.recall
@@ -0,0 +1,85 @@
+import numpy as np
+
+"""This file provides an incremental cursor over the ranked results of a similarity calculation.
+
+    Rather than sorting the full score array for every page of recommendations, the cursor partially selects the next
+    chunk of best tracks from the tracks not returned yet, and serves pages from the sorted chunk. Chunks grow
+    geometrically, such that paging through the results costs in proportion to the pages served, not the dataset size
+    per page.
+"""
+
+
+class RankedCursor:
+    """The class pages through the tracks of a similarity calculation, in descending order of similarity.
+
+    Attributes:
+        scores (ndarray): The similarity score of each scored track position
+        select (callable): Provides the tracks dataframe rows of the given scored positions, select(positions)
+        refine (callable): Optional rescoring of the given scored positions, refine(positions). Approximate engines use it to widen their exact rescoring as the cursor advances.
+        remaining (ndarray): The scored positions not selected into a chunk yet
+        buffer (ndarray): The sorted positions of the current chunk that have not been served yet
+        chunk_size (int): The size of the last selected chunk
+        served (int): The number of tracks served so far
+    """
+    def __init__(self, scores, select, refine=None):
+        """The initialization of the Ranked Cursor class
+
+        Args:
+            scores (ndarray): The similarity score of each scored track position
+            select (callable): Provides the tracks dataframe rows of the given scored positions
+            refine (callable): Optional rescoring of the given scored positions
+        """
+        self.scores = np.array(scores, dtype=np.float64) if refine is not None else np.asarray(scores)
+        self.select = select
+        self.refine = refine
+        self.remaining = np.arange(self.scores.shape[0])
+        self.buffer = self.remaining[:0]
+        self.chunk_size = 0
+        self.served = 0
+
+    def has_more(self):
+        """Method determines whether tracks remain to be served
+
+        Returns:
+            (bool): True if a further page holds at least one track
+        """
+        return self.buffer.shape[0] > 0 or self.remaining.shape[0] > 0
+
+    def next_chunk(self, n: int):
+        """Method selects the next best chunk of the remaining positions (at least `n`, doubling the previous chunk),
+        and sorts it into the buffer (merged with the unread buffer by score if the chunk is refined)
+
+        Args:
+            n (int): The minimum number of positions to be selected
+        """
+        count = min(max(n - self.buffer.shape[0], 2 * self.chunk_size), self.remaining.shape[0])
+        if count < self.remaining.shape[0]:
+            partition = np.argpartition(-self.scores[self.remaining], count - 1)
+            chunk, self.remaining = self.remaining[partition[:count]], self.remaining[partition[count:]]
+        else:
+            chunk, self.remaining = self.remaining, self.remaining[:0]
+        if self.refine is not None:  # Refined scores may exceed those of the unread buffer, the two are merged
+            self.scores[chunk] = self.refine(chunk)
+            chunk = np.concatenate([self.buffer, chunk])
+            self.buffer = chunk[:0]
+        chunk = chunk[np.argsort(-self.scores[chunk], kind='stable')]  # Order the chunk by descending similarity
+        self.buffer = np.concatenate([self.buffer, chunk])
+        self.chunk_size = count
+
+    def next_page(self, n: int):
+        """Method provides the next n most similar tracks
+
+        Args:
+            n (int): The number of tracks in the page
+
+        Returns:
+            (DataFrame): A dataframe containing the tracks of the page, with their `sim_score` (empty once exhausted)
+        """
+        if self.buffer.shape[0] < n and self.remaining.shape[0] > 0:
+            self.next_chunk(n)
+        page, self.buffer = self.buffer[:n], self.buffer[n:]
+        self.served += page.shape[0]
+
+        page_tracks = self.select(page).copy()
+        page_tracks.insert(0, 'sim_score', self.scores[page])
+        return page_tracks
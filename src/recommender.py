@@ -1,14 +1,17 @@
-import spotipy
 import streamlit as st
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from spotipy import SpotifyClientCredentials
 import os
 
 # Scripts
-from data_processing import target_playlist_extraction, save_data, update_tracking
+from data_processing import target_playlist_extraction
+from dataset_store import TrackPartitions, TrackSchema, dataset_version
+from feature_store import FeatureStore
+from genres import GenreIndex
+from playlist_cache import PlaylistCache
 from similarity import TracksCosineSimilarity
+from spotify_client import shared_client
+from track_filters import MetadataIndex
+from write_behind import TrackWriteQueue
 
 
 def feature_def_section():
@@ -65,26 +68,40 @@ def playlist_submission():
     """Method handles the process that follows the clicking of the `submit` button
 
     The process is as follows:
-    - The given playlist tracks are retrieved.
-    - The tracks dataset is read in
-    - Similarity is calculated
+    - The given playlist tracks are retrieved (and queued to be persisted asynchronously).
+    - The tracks dataset is read in (only the partitions of the last crawls, if a crawl window is selected)
+    - The published feature store is mapped (if it is current)
+    - The genre index is opened, if only tracks sharing the playlist's top genres are to be scored
+    - Any track filters are applied (against the metadata index shared by all sessions)
+    - Similarity is calculated, and the first page of recommendations is taken from its ranked cursor
     - Streamlit session states are updated
     """
     df_playlist = retrieve_target_playlist(playlist_url, playlist_name)
-    df_tracks = access_tracks()
-
-    st.session_state.similarity = TracksCosineSimilarity(df_playlist, df_tracks, st.session_state.weighted_features)
+    df_tracks = access_tracks(st.session_state.last_crawls)
+
+    genre_index = GenreIndex.open(df_tracks) if st.session_state.genre_candidates else None
+    metadata_index = None
+    if len(st.session_state.track_filters) != 0:
+        metadata_index = access_metadata_index(dataset_version(), st.session_state.last_crawls, df_tracks)
+    st.session_state.similarity = TracksCosineSimilarity(df_playlist, df_tracks, st.session_state.weighted_features,
+                                                         feature_store=access_feature_store(),
+                                                         genre_index=genre_index, metadata_index=metadata_index)
+    if len(st.session_state.track_filters) != 0:
+        st.session_state.similarity.filter_tracks(st.session_state.track_filters)  # Narrow candidates before scoring
     st.session_state.similarity.calculate_similarity()
-    update_tracking(df_tracks)
+    st.session_state.cursor = st.session_state.similarity.cursor()  # Ranked results, paged in by `show more`
+    st.session_state.recommendations = st.session_state.cursor.next_page(30)
 
     st.session_state.playlist_links.append(playlist_url)
     st.session_state.playlist_names.append(playlist_name)
 
 
 def retrieve_target_playlist(url: str, name: str):
-    """ This method gathers all the playlist song features and merges this data into the tracks dataset.
+    """ This method gathers all the playlist song features, and submits them to the write-behind queue to be merged
+        into the tracks dataset asynchronously. No disk writes occur on the request path.
 
-        Note: credentials are stored using Streamlit secrets keeper
+        Note: credentials are stored using Streamlit secrets keeper. The Spotify client (and its access token and
+        connections) is shared by all sessions of the process.
 
     Args:
         url (str): The url for the spotify playlist
@@ -92,38 +109,104 @@ def retrieve_target_playlist(url: str, name: str):
     Returns:
         playlist (DataFrame): The playlist features as a DataFrame
     """
-    client_credentials_manager = SpotifyClientCredentials(client_id=st.secrets['CLIENT_ID'],
-                                                          client_secret=st.secrets[
-                                                              'CLIENT_SECRET'])  # Set up Spotify Credentials
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-    playlist = target_playlist_extraction(sp, url, name)  # Generate target playlist dataframe
-    save_data(playlist)  # Save the playlist tracks into the larger tracks dataset
+    sp = access_spotify_client()
+    playlist = target_playlist_extraction(sp, url, name, cache=access_playlist_cache())  # Generate target playlist dataframe
+    access_write_queue().submit(playlist)  # Queue the playlist tracks to be saved into the larger tracks dataset
     playlist_df = playlist_to_df(playlist)
     return playlist_df
 
 
-def access_tracks():
+@st.cache_resource
+def access_spotify_client():
+    """Method provides the process-wide Spotify client, shared by all sessions.
+
+    Note, spotipy is imported on first use (the first submission), keeping it off the app start-up path.
+
+    Returns:
+        (Spotify): The authenticated spotipy client, reusing its access token and pooled connections across requests
+    """
+    return shared_client(st.secrets['CLIENT_ID'], st.secrets['CLIENT_SECRET'])
+
+
+@st.cache_resource
+def access_write_queue():
+    """Method provides the process-wide write-behind queue, shared by all sessions.
+
+    Returns:
+        (TrackWriteQueue): The queue persisting submitted playlists into the tracks dataset
+    """
+    return TrackWriteQueue()
+
+
+@st.cache_resource
+def access_playlist_cache():
+    """Method provides the process-wide cache of extracted playlists, shared by all sessions.
+
+    Returns:
+        (PlaylistCache): The cache serving unchanged (resubmitted) playlists without re-extraction
+    """
+    return PlaylistCache()
+
+
+def access_tracks(last_crawls: int = 0):
     """Method enables access to saved track information.
 
+    Args:
+        last_crawls (int): Only the tracks ingested by the last `last_crawls` crawls are read (0 reads all tracks). Only
+            the partitions within the window are read, such that recent windows are read in O(recent data).
+
     Returns:
-        df (DataFrame): The dataframe containing all feature information of saved tracks
+        df (DataFrame): The dataframe containing all feature information of saved tracks (see `dataset_store.TrackSchema`)
     """
+    partitions = TrackPartitions.load() if last_crawls > 0 else None
+    if partitions is not None:
+        return partitions.read(last=last_crawls)  # The feature store rows of tracks outside the window are not scored
+
     root_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
     file_path = os.path.join(root_path, 'data', 'tracks.csv')
-    df = pd.read_csv(file_path, index_col=0)  # Read in stored tracks dataframe
+    df = TrackSchema.read(file_path)  # Read in stored tracks dataframe (in the compact in-memory schema)
     return df
 
 
+@st.cache_resource(max_entries=4)
+def access_metadata_index(version: str, last_crawls: int, _tracks: pd.DataFrame):
+    """Method provides the metadata index of the tracks dataset, built once per dataset version and crawl window, and
+    shared by all sessions.
+
+    Args:
+        version (str): The version of the tracks dataset (the cache key)
+        last_crawls (int): The crawl window of the tracks (the cache key)
+        _tracks (DataFrame): The tracks dataframe of the version and crawl window (not hashed)
+
+    Returns:
+        (MetadataIndex): The metadata index, with the indexes of all metadata columns built
+    """
+    return MetadataIndex.build(_tracks)
+
+
+def access_feature_store():
+    """Method maps the published feature store, shared read-only with all other recommender processes on the host.
+
+    Returns:
+        (FeatureStore): The feature store, or None if it has not been published for the current tracks dataset.
+    """
+    feature_store = FeatureStore.open()
+    if feature_store is None or not feature_store.is_current():
+        return None
+    return feature_store
+
+
 def display_spotify_recommendations():
     """Method deals with displaying the Spotify recommendations in the form of Spotify iFrames for each recommendation.
 
-    This section is composed of two columns, with 30 recommendations split evenly between them creating a 15 x 2 table.
+    This section is composed of two columns, with the recommendations split evenly between them (initially 30
+    recommendations, creating a 15 x 2 table). A `Show more` button appends the next page of recommendations.
     """
     st.markdown("#### Recommended Tracks")
 
     col1, col2 = st.columns(2)
     count = 0
-    rec_df = st.session_state.similarity.get_top_n(30)
+    rec_df = st.session_state.recommendations
     for index, row in rec_df.iterrows():
         spotify_uri = row['uris']
         embed_code = f'<iframe src="https://open.spotify.com/embed/track/{spotify_uri.split(":")[-1]}" ' \
@@ -137,6 +220,20 @@ def display_spotify_recommendations():
                 st.markdown(embed_code, unsafe_allow_html=True)
         count += 1
 
+    if st.session_state.cursor.has_more():
+        st.button('Show more', on_click=show_more_recommendations)
+
+
+def show_more_recommendations(page_size: int = 30):
+    """Method appends the next page of recommendations from the ranked cursor of the session (the `Show more`
+    callback). Only the new page is selected, the recommendations already shown are not ranked again.
+
+    Args:
+        page_size (int): The number of recommendations added
+    """
+    page = st.session_state.cursor.next_page(page_size)
+    st.session_state.recommendations = pd.concat([st.session_state.recommendations, page])
+
 
 def playlist_to_df(playlist: dict):
     """Method transforms playlist information in dictionary form to a playlist dataframe
@@ -156,6 +253,9 @@ def similarity_visualization():
     Returns:
         (Pyplot Figure): Figure for visualization by Streamlit
     """
+    import seaborn as sns  # Plotting libraries are deferred until search results are first displayed
+    import matplotlib.pyplot as plt
+
     df = pd.DataFrame(st.session_state.similarity.access_similarity_scores(),
                            columns=['sim_score'])  # Access similarity scores of the process
 
@@ -191,6 +291,37 @@ def create_feature_weighting(maximum=12):
     return selected_option
 
 
+def create_track_filters():
+    """Creates the streamlit track filter inputs, allowing recommendations to be constrained by track metadata.
+
+    Only constraints differing from the unconstrained default are returned.
+
+    Returns:
+        (dict): The selected filters, mapping a column name to its constraint (see `track_filters.py`)
+    """
+    filters = {}
+    tempo_range = st.slider('Tempo range (BPM)', min_value=0, max_value=250, value=(0, 250))
+    if tempo_range != (0, 250):
+        filters['tempos'] = tempo_range
+
+    keys = st.multiselect('Keys (pitch class, 0 = C)', list(range(12)))
+    if len(keys) != 0:
+        filters['keys'] = keys
+
+    modes = st.multiselect('Modes (1 = major, 0 = minor)', [0, 1])
+    if len(modes) != 0:
+        filters['modes'] = modes
+
+    minimum_popularity = st.slider('Minimum track popularity', min_value=0, max_value=100, value=0)
+    if minimum_popularity != 0:
+        filters['track_pop'] = (minimum_popularity, None)
+
+    maximum_duration = st.slider('Maximum duration (minutes)', min_value=1, max_value=15, value=15)
+    if maximum_duration != 15:
+        filters['durations_ms'] = (None, maximum_duration * 60000)
+    return filters
+
+
 def retrieve_feature_defs():
     """Method retrieves the feature definitions from the `data/feature_def.txt` file.
 
@@ -209,6 +340,8 @@ if 'playlist_links' not in st.session_state:  # Initialize playlist history stat
     st.session_state.playlist_links = []
     st.session_state.playlist_names = []
     st.session_state.similarity = None
+    st.session_state.cursor = None
+    st.session_state.recommendations = None
 
 # Mias welcome
 st.title("MIAS")
@@ -227,6 +360,12 @@ feature_def_section()
 with st.expander('Feature weighting (Optional)', expanded=False):
     st.session_state.weighted_features = create_feature_weighting()
 
+with st.expander('Track filters (Optional)', expanded=False):
+    st.session_state.track_filters = create_track_filters()
+    st.session_state.genre_candidates = st.checkbox("Only consider tracks sharing the playlist's top genres (faster)")
+    st.session_state.last_crawls = st.number_input('Only consider tracks ingested by the last N crawls (0 = all crawls)',
+                                                   min_value=0, value=0, step=1)
+
 submit_button = st.button("Submit")
 if submit_button:
     if playlist_url != "" and playlist_name != "":
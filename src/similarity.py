@@ -1,41 +1,98 @@
+import numpy as np
 import pandas as pd
-from sklearn.metrics import pairwise as similarity_measures
 
+from dataset_store import UriIndex
+from feature_store import FeatureStore
+from genres import GenreIndex
 from pipeline import CosinePipeline
-from similarity_interface import Similarity
+from playlist_compression import PlaylistCompressor
+from similarity_interface import RankedSimilarity
+from track_filters import MetadataIndex
 
 
-class TracksCosineSimilarity(Similarity):
+class TracksCosineSimilarity(RankedSimilarity):
     """The class implements a Cosine similarity between a playlist vector and the tracks dataset to determine
         similar tracks to the playlist.
 
-        This class inherits the Similarity interface.
+        This class inherits the Similarity interface, and the ranking and filtering of `RankedSimilarity`.
 
         Attributes:
             additional_weighting (int): The weighting factor applied to weighted columns.
             playlist (DataFrame): The tracks dataset dataframe (before pipeline transformation)
             tracks (DataFrame): The playlist tracks dataframe (before pipeline transformation)
             playlist_features (DataFrame): The tracks dataset features (after transformation pipeline)
-            track_features (DataFrame): The playlist tracks features (after transformation pipeline)
+            features (DataFrame): The features of all rows of `track_matrix`, playlist tracks included (after transformation pipeline). When a feature store is used, this is a zero-copy view of the memory-mapped feature matrix.
+            track_features (DataFrame): The features of the scored dataset tracks, excluding the playlist tracks (see `track_positions`). The rows are selected on access.
+            track_matrix (ndarray): The numpy matrix underlying `features`
+            track_norms (ndarray): The (unweighted) L2 norm of each row of `track_matrix`
+            weights (ndarray): The weight of each feature column (see `weight_features()`)
             similarity (Series): The ordered ranking of track similarity to the playlist vector (The index is uris)
+            uri_index (UriIndex): The interned track ids of the dataset layer
+            row_ids (ndarray): The interned track id of each row of `features`
+            track_rows (ndarray): The row position in the tracks dataframe of each interned track id (-1 if absent)
+            track_positions (ndarray): The rows of `features` that are scored (dataset tracks not in the playlist, satisfying any metadata filters)
+            unfiltered_positions (ndarray): The rows of `features` that are scored when no metadata filters are applied
+            metadata_index (MetadataIndex): Optional prebuilt metadata index of the tracks dataframe, used to resolve filters. If None, filters are resolved by a plain mask.
+            compressor (PlaylistCompressor): Optional playlist compressor. If set, tracks are scored against weighted playlist centroids instead of the mean playlist vector.
+            candidate_genres (ndarray): The playlist genre ids whose tracks are scored, None if all tracks are scored (see `generate_candidates()`)
+            candidates_fallback (bool): True if a genre index was given, but too few tracks share the playlist's top genres, such that all tracks are scored
         """
-    def __init__(self, playlist: pd.DataFrame, tracks: pd.DataFrame, weighted_features: list):
+    def __init__(self, playlist: pd.DataFrame, tracks: pd.DataFrame, weighted_features: list,
+                 compressor: PlaylistCompressor = None, feature_store: FeatureStore = None,
+                 genre_index: GenreIndex = None, metadata_index: MetadataIndex = None):
         """The initialization of the Cosine Similarity class
 
         Args:
             playlist (DataFrame): The tracks dataset dataframe (before pipeline transformation)
             tracks (DataFrame): The playlist tracks dataframe (before pipeline transformation)
             weighted_features (list): A list of features to be weighted in order to prioritize feature importance in similarity calculation.
+            compressor (PlaylistCompressor): Optional playlist compressor, enabling multi-vector scoring against k playlist centroids.
+            feature_store (FeatureStore): Optional published feature store. If given, the track features are read from the memory-mapped store instead of being computed by the pipeline, and the playlist is encoded in the store's feature space.
+            genre_index (GenreIndex): Optional inverted genre index. If given, only the tracks sharing one of the playlist's top genres are scored (see `generate_candidates()`).
+            metadata_index (MetadataIndex): Optional metadata index of the tracks dataframe, built once and shared across requests (see `filter_tracks()`).
+
+        Note, the playlist tracks need not be part of the tracks dataframe. Without a feature store, the playlist tracks
+        missing from the dataset are encoded together with the dataset in memory.
 
         """
         self.additional_weighting = 2  # Feature weighting value
-        features = CosinePipeline.data_pipeline(tracks)  # Pass data through pipeline to extract features
 
         self.playlist = playlist
         self.tracks = tracks
-
-        self.playlist_features, self.track_features = self.separate_playlist_from_tracks(features)
+        self.uri_index = UriIndex.open()
+        track_ids = self.uri_index.encode(tracks['uris'])
+
+        if feature_store is None:
+            playlist_ids = self.uri_index.encode(playlist['uris'])
+            new_tracks = playlist[~self.uri_index.membership(track_ids)[playlist_ids]]  # Playlist tracks not in the dataset
+            combined = pd.concat([tracks, new_tracks], axis=0) if new_tracks.shape[0] != 0 else tracks
+            features = CosinePipeline.data_pipeline(combined)  # Pass data through pipeline to extract features
+            self.track_matrix = features.to_numpy()
+            self.track_norms = np.linalg.norm(self.track_matrix, axis=1)
+            self.row_ids = self.uri_index.encode(combined['uris'])
+        else:
+            features = pd.DataFrame(feature_store.features, columns=feature_store.columns, copy=False)
+            self.track_matrix = feature_store.features
+            self.track_norms = feature_store.norms
+            self.row_ids = feature_store.track_ids
+
+        self.track_rows = np.full(max(len(self.uri_index), int(self.row_ids.max(initial=-1)) + 1) + 1, -1, dtype=np.int64)
+        self.track_rows[track_ids] = np.arange(track_ids.shape[0])
+        self.track_positions = None
+
+        self.playlist_features, self.features = self.separate_playlist_from_tracks(features)
+        self.unfiltered_positions = self.track_positions
+        self.metadata_index = metadata_index
+        self.candidate_genres = None
+        self.candidates_fallback = False
+        if genre_index is not None:
+            self.generate_candidates(genre_index)
+        if feature_store is not None:
+            self.playlist_features = feature_store.encoder().transform_frame(playlist)
+
+        self.weights = None
         self.weight_features(weighted_features)
+        self.compressor = compressor
         self.similarity = None
 
     def calculate_similarity(self):
@@ -44,14 +101,55 @@ class TracksCosineSimilarity(Similarity):
         This calculation populates the `self.similarity` field.
 
         The playlist feature dataframe is mean of each feature, creating a playlist vector.
+        If a compressor is set, the playlist is instead summarised into k weighted centroids, and the similarity of
+        each track is the weighted sum of its cosine similarity to each centroid.
         """
-        playlist_vector = self.vectorize_playlist()
-        track_matrix = self.track_features.to_numpy()
+        if self.compressor is None:
+            similarity_score = self.cosine_similarity(self.vectorize_playlist())[:, 0]
+        else:
+            centroids, weights = self.vectorize_playlist_centroids()
+            similarity_score = self.cosine_similarity(centroids) @ weights
+
+        uris = self.tracks['uris'].to_numpy()[self.dataset_rows(self.track_positions)]
+        self.similarity = pd.Series(similarity_score, index=uris, name='sim_score')
+
+    def cosine_similarity(self, vectors, positions=None):
+        """Method calculates the cosine similarity between the weighted track features and the given vectors
 
-        similarity_score = similarity_measures.cosine_similarity(track_matrix, playlist_vector)
-        uris = self.track_features.index.tolist()
+        The weighted track matrix is never materialized. As cos(Wx, v) = x.(Wv) / (|Wx| |v|), the weights are applied to
+        the vectors instead, and the weighted norms |Wx| are derived from the stored norms and the weighted columns only.
 
-        self.similarity = pd.Series(similarity_score.T.tolist()[0], index=uris, name='sim_score')
+        Args:
+            vectors (ndarray): A (k, n_features) matrix of playlist vectors
+            positions (ndarray): The rows of `track_matrix` to be scored. Defaults to `self.track_positions`.
+
+        Returns:
+            (ndarray): A (n_tracks, k) matrix of the similarity of each scored track to each vector
+        """
+        if positions is None:
+            positions = self.track_positions
+        if 2 * positions.shape[0] > self.track_matrix.shape[0]:
+            dots = (self.track_matrix @ (vectors * self.weights).T)[positions]  # Full scan, avoiding a copy of the matrix
+        else:
+            dots = self.track_matrix[positions] @ (vectors * self.weights).T  # Scan of the selected rows only
+        norms = self.weighted_norms(positions)[:, None] * np.linalg.norm(vectors, axis=1)[None, :]
+        return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+    def weighted_norms(self, positions):
+        """Method calculates the L2 norm of the weighted track feature rows
+
+        Args:
+            positions (ndarray): The rows of `track_matrix`
+
+        Returns:
+            (ndarray): The weighted L2 norm of each given row of `track_matrix`
+        """
+        weighted = np.flatnonzero(self.weights != 1)
+        norms = self.track_norms[positions]
+        if weighted.shape[0] == 0:
+            return norms
+        squared = norms ** 2 + (self.track_matrix[np.ix_(positions, weighted)] ** 2) @ (self.weights[weighted] ** 2 - 1)
+        return np.sqrt(np.maximum(squared, 0))
 
     def access_similarity_scores(self):
         """Getter method to access the `similarity` class field.
@@ -61,21 +159,25 @@ class TracksCosineSimilarity(Similarity):
         """
         return self.similarity
 
-    def get_top_n(self, n: int):
-        """This method should return the top-n most similar tracks as a Dataframe with essential features included.
-
-        Note, due to the cosine similarity. A similarity value of 1 indicates a high similarity, while a value near 0 indicates a low similarity.
+    def dataset_rows(self, positions):
+        """Method maps rows of `features` to the rows of the tracks dataframe
 
         Args:
-            n (int): The top-n most similar tracks to the playlist vector
+            positions (ndarray): The rows of `features` (dataset tracks only)
+
+        Returns:
+            (ndarray): The row position in the tracks dataframe of each given row
+        """
+        return self.track_rows[self.row_ids[positions]]
+
+    @property
+    def track_features(self):
+        """Method provides the features of the scored dataset tracks, excluding the playlist tracks
 
         Returns:
-            (DataFrame): A dataframe containing the top-n tracks.
+            (DataFrame): The rows of `features` at `track_positions`
         """
-        sim_df = pd.DataFrame(self.similarity, columns=['sim_score'])
-        sorted_sim = sim_df.sort_values(by='sim_score', ascending=False)
-        sorted_top = sorted_sim.head(n)
-        return sorted_top.merge(self.tracks, left_index=True, right_on='uris')
+        return self.features.iloc[self.track_positions]
 
     def separate_playlist_from_tracks(self, features: pd.DataFrame):
         """Method separates the feature dataframe (from pipeline) into tracks and playlist feature dataframes
@@ -83,12 +185,41 @@ class TracksCosineSimilarity(Similarity):
         Args:
             features (DataFrame): The track dataset features dataframe (This contains the playlist tracks too)
 
+        Note, playlist membership is determined using a bitmap over the interned track ids. Rather than copying the
+        remaining tracks, the rows to be scored are recorded in `self.track_positions` (excluding playlist tracks and
+        tracks absent from the tracks dataframe).
+
         Returns:
             playlist_features (Dataframe): The playlist track features dataframe
-            tracks_features (DataFrame): The track dataset features dataframe
+            features (DataFrame): The features dataframe of all rows (the scored rows are given by `track_positions`)
         """
-        playlist_uris = self.playlist['uris'].tolist()
-        return features[features.index.isin(playlist_uris)], features[~features.index.isin(playlist_uris)]
+        in_playlist = self.uri_index.membership(self.uri_index.lookup(self.playlist['uris']))[self.row_ids]
+        in_tracks = self.track_rows[self.row_ids] >= 0
+        self.track_positions = np.flatnonzero(~in_playlist & in_tracks)
+        return features.iloc[np.flatnonzero(in_playlist)], features
+
+    def generate_candidates(self, genre_index: GenreIndex, top_genres: int = 5, min_candidates: int = 500):
+        """Method narrows the tracks to be scored to the candidates sharing at least one of the playlist's top genres,
+        using the inverted genre index. Tracks sharing no genre with the playlist score low in the genre features, and
+        are rarely among the most similar tracks.
+
+        If the playlist has no indexed genres, or fewer than `min_candidates` tracks share its top genres, all tracks
+        remain scored (a full scan), which is flagged by `candidates_fallback`. Metadata filters (see `filter_tracks()`)
+        are applied within the candidates.
+
+        Args:
+            genre_index (GenreIndex): The inverted genre index of the tracks dataset
+            top_genres (int): The number of most frequent playlist genres whose tracks are candidates
+            min_candidates (int): The minimum number of candidates, below which all tracks are scored
+        """
+        genre_ids = genre_index.top_genres(self.playlist, top_genres)
+        candidates = self.uri_index.membership(genre_index.tracks_of(genre_ids))
+        positions = self.unfiltered_positions[candidates[self.row_ids[self.unfiltered_positions]]]
+        if positions.shape[0] < min_candidates:
+            self.candidates_fallback = True
+            return
+        self.candidate_genres = genre_ids
+        self.track_positions = self.unfiltered_positions = positions
 
     def vectorize_playlist(self):
         """Method vectorizes the playlist track features by determining the mean value of each track feature
@@ -99,24 +230,32 @@ class TracksCosineSimilarity(Similarity):
         playlist_vector = self.playlist_features.mean(axis=0)
         return playlist_vector.to_numpy().reshape(1, -1)
 
+    def vectorize_playlist_centroids(self):
+        """Method compresses the playlist track features into k weighted centroids using the class compressor
+
+        Returns:
+            centroids (Numpy matrix): The (k, n_features) playlist centroid vectors
+            weights (Numpy vector): The weight of each centroid (the fraction of playlist tracks it represents)
+        """
+        return self.compressor.compress(self.playlist_features)
+
     def weight_features(self, weighted_columns: list):
         """Method weights the track dataset features (all features are normalized [0, 1]) by a scaler value
         to increase the effect of that feature in the similarity calculation.
 
         Wighting in cosine similarity increases the impact of the feature in the similarity calculation
 
-        Note, this method directly alters the `self.track_features` field.
+        Note, this method sets the `self.weights` field, which is applied during the similarity calculation (the
+        track features themselves are never altered).
 
         Args:
             weighted_columns: The columns to be weighted by the additional weighting factor.
 
         """
-        all_features = pd.Series(self.track_features.columns)
+        all_features = pd.Series(self.features.columns)
         feature_filter = all_features.isin(weighted_columns).tolist()   # Boolean filter based on if feature is in weighted columns
         binary_filter = [int(feature) for feature in feature_filter]  # Modify boolean filter into a binary filter
         filler = [1] * len(binary_filter)  # Create a filler of 1's to not effect features that have no weighting
         weights = [(self.additional_weighting * weight) + fill for weight, fill in zip(binary_filter, filler)]  # Calculate feature scaler weights
 
-        self.track_features = self.track_features.mul(weights, axis=1)  # Weight features
-
-
+        self.weights = np.asarray(weights, dtype=np.float64)  # Feature weights
@@ -1,5 +1,11 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+import pandas as pd
+
+from ranking import RankedCursor
+from track_filters import MetadataIndex
+
 
 class Similarity(ABC):
     """This class serves as an outline of the Similarity module for the MIAS application
@@ -8,9 +14,9 @@ class Similarity(ABC):
     This modular build allows others to add their own classes to try out various methods in
     a simple way
 
-    Note: The playlist has already been added to the tracks dataset, such that features are
-    calculated over the entire database. The playlist tracks are then removed from the tracks dataaset
-    in the similarity calculation.
+    Note: The playlist is not required to be part of the tracks dataset (it is scored in memory). Features are
+    calculated over the tracks dataset together with the playlist, and the playlist tracks are then removed from the
+    tracks dataset in the similarity calculation.
 
     Additionally: It is recommended that your class take in both `playlist` and `tracks` as done
     in the Cosine Similarity Class
@@ -45,3 +51,106 @@ class Similarity(ABC):
         """
         pass
 
+    @abstractmethod
+    def filter_tracks(self, filters: dict):
+        """This method narrows the tracks to be scored to those satisfying the given metadata filters
+        (e.g. a tempo range or a set of keys), such that only the remaining tracks are scored by `calculate_similarity()`.
+        Note, see `similarity.py` and `track_filters.py` for an example implementation.
+        """
+        pass
+
+    def cursor(self):
+        """This method provides a cursor over the ranked results of `calculate_similarity()`, such that further pages of
+        results (e.g. "show more") are served incrementally, without re-ranking the full score array.
+        Note, the default cursor ranks the scores of `access_similarity_scores()`, and selects the matching rows of the
+        `tracks` dataframe by uri. Implementations scoring rows by position should override it (see `RankedSimilarity`
+        and `ranking.py`).
+        """
+        scores = self.access_similarity_scores()
+        positions = pd.Series(np.arange(self.tracks.shape[0]), index=self.tracks['uris'].to_numpy())
+        rows = positions[~positions.index.duplicated()].reindex(scores.index).to_numpy()
+        return RankedCursor(scores.to_numpy(), lambda selected: self.tracks.iloc[rows[selected]])
+
+
+class RankedSimilarity(Similarity):
+    """This class provides the ranking and filtering shared by the similarity classes scoring a subset of positions
+
+    A subclass scores the positions `track_positions` (a subset of `unfiltered_positions`), and stores the score of each
+    scored position in `similarity`, in the order of `track_positions`. The dataframe row of a position is given by
+    `dataset_rows()`, by default the position itself (i.e. positions are rows of the tracks dataframe).
+
+    Attributes:
+        tracks (DataFrame): The tracks dataset dataframe
+        similarity (Series): The similarity of each scored position to the playlist (The index is uris)
+        track_positions (ndarray): The positions that are scored (satisfying any metadata filters)
+        unfiltered_positions (ndarray): The positions that are scored when no metadata filters are applied
+        metadata_index (MetadataIndex): Optional prebuilt metadata index of the tracks dataframe, used to resolve filters. If None, filters are resolved by a plain mask.
+    """
+    def dataset_rows(self, positions):
+        """Method maps scored positions to the rows of the tracks dataframe
+
+        Args:
+            positions (ndarray): The scored positions (elements of `unfiltered_positions`)
+
+        Returns:
+            (ndarray): The row position in the tracks dataframe of each given position
+        """
+        return positions
+
+    def select_tracks(self, positions):
+        """Method accesses the tracks of the given positions of the `similarity` scores, by row position
+
+        Args:
+            positions (ndarray): The positions into the `similarity` scores
+
+        Returns:
+            (DataFrame): The rows of the tracks dataframe
+        """
+        return self.tracks.iloc[self.dataset_rows(self.track_positions[positions])]
+
+    def get_top_n(self, n: int):
+        """Method returns the top-n most similar tracks as a Dataframe.
+
+        The top-n scores are selected by partial selection over the score array, and the matching tracks are accessed
+        by row position (no merge on uris is required).
+
+        Args:
+            n (int): The top-n most similar tracks to the playlist
+
+        Returns:
+            (DataFrame): A dataframe containing the top-n tracks.
+        """
+        scores = self.similarity.to_numpy()
+        n = min(n, scores.shape[0])
+        top = np.argpartition(-scores, n - 1)[:n] if 0 < n < scores.shape[0] else np.arange(n)
+        top = top[np.argsort(-scores[top], kind='stable')]  # Order the top-n by descending similarity
+
+        top_tracks = self.select_tracks(top).copy()
+        top_tracks.insert(0, 'sim_score', scores[top])
+        return top_tracks
+
+    def cursor(self):
+        """Method provides a cursor over the ranked tracks, serving successive pages of the most similar tracks by
+        incremental partial selection (see `ranking.RankedCursor`)
+
+        Returns:
+            (RankedCursor): The cursor over the tracks scored by `calculate_similarity()`
+        """
+        return RankedCursor(self.similarity.to_numpy(), self.select_tracks)
+
+    def filter_tracks(self, filters: dict):
+        """Method narrows the tracks to be scored to those satisfying the given metadata filters, such that only the
+        remaining tracks are scored by `calculate_similarity()`.
+
+        Filters are resolved against the sorted column indexes and categorical bitmaps of the shared `MetadataIndex`,
+        or by a plain mask over the tracks dataframe if no index is given. Each call replaces the filters of any
+        previous call.
+
+        Args:
+            filters (dict): The mapping of column name to constraint. Range columns take a (low, high) tuple of inclusive bounds (None for an open bound), categorical columns take a list of allowed values. E.g. {'tempos': (90, 120), 'modes': [1]}
+        """
+        if self.metadata_index is not None:
+            selected = self.metadata_index.select(filters)  # Bitmap over the rows of the tracks dataframe
+        else:
+            selected = MetadataIndex.mask(self.tracks, filters)
+        self.track_positions = self.unfiltered_positions[selected[self.dataset_rows(self.unfiltered_positions)]]
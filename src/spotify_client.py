@@ -0,0 +1,215 @@
+import threading
+import time
+
+"""This file provides the process-wide Spotify client, shared by all sessions and worker threads of a process.
+
+    Rather than authenticating a new client per request (a token request, followed by new TCP/TLS connections), a
+    single client is created per process and set of credentials. The client sends its requests through a pooled HTTP
+    session, keeping connections to the Spotify API alive, and authenticates them with a shared access token, which is
+    refreshed (once, by a single thread) shortly before it expires. Requests retried by the session are reported to
+    the registered retry listeners.
+
+    Note, spotipy is imported when the first client is created, keeping it off the start-up path of the importing
+    modules.
+"""
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # Retried with a backoff, honouring the Retry-After header of 429 responses
+
+retry_listeners = []  # The callables notified of each request retried by a pooled session, listener(status, error)
+
+
+def notify_retry(status, error):
+    """Method notifies the retry listeners (e.g. the API metrics of a crawl) of a request retried by a pooled session
+
+    Args:
+        status (int): The HTTP status of the retried response, None if the request failed without a response
+        error (Exception): The connection or read error of the retried request, None if a response was received
+    """
+    for listener in list(retry_listeners):
+        listener(status, error)
+
+
+def recording_retry(**kwargs):
+    """Method creates the urllib3 retry policy of a pooled session, notifying the retry listeners of each retried
+    request (see `notify_retry()`), such that retries (and rate limited responses) handled within the session remain
+    visible to the API metrics
+
+    Note, urllib3 is imported here (with spotipy), keeping it off the start-up path of the importing modules.
+
+    Args:
+        **kwargs: The arguments of the urllib3 `Retry` policy
+
+    Returns:
+        (Retry): The recording retry policy
+    """
+    from urllib3.util.retry import Retry
+
+    class RecordingRetry(Retry):
+        """The urllib3 retry policy notifying the retry listeners of each retried request"""
+        def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+            retry = super().increment(method, url, response, error, _pool, _stacktrace)  # Raises once exhausted
+            notify_retry(response.status if response is not None else None, error)  # Only retried requests count
+            return retry
+
+    return RecordingRetry(**kwargs)
+
+
+class SharedCredentials:
+    """The class caches the client credentials access token of a Spotify application, shared by all threads.
+
+    The token is refreshed once it is within `refresh_margin` seconds of its expiry. Concurrent requests for an expired
+    token wait on a single refresh, rather than each requesting a new token. The class implements the auth manager
+    interface used by `spotipy.Spotify`.
+
+    Attributes:
+        credentials (SpotifyClientCredentials): The spotipy credentials manager requesting new tokens
+        refresh_margin (int): The number of seconds before its expiry at which the token is refreshed
+        token (dict): The cached token information (`access_token` and `expires_at`), None before the first request
+        refreshes (int): The number of tokens requested
+        lock (Lock): Ensures the token is refreshed by a single thread
+    """
+    def __init__(self, credentials, refresh_margin: int = 60):
+        """The initialization of the Shared Credentials class
+
+        Args:
+            credentials (SpotifyClientCredentials): The spotipy credentials manager requesting new tokens
+            refresh_margin (int): The number of seconds before its expiry at which the token is refreshed
+        """
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.refreshes = 0
+        self.lock = threading.Lock()
+
+    def is_expiring(self, token: dict):
+        """Method determines whether a token must be refreshed
+
+        Args:
+            token (dict): The token information
+
+        Returns:
+            (bool): True if there is no token, or the token expires within the refresh margin
+        """
+        return token is None or token['expires_at'] - time.time() < self.refresh_margin
+
+    def get_access_token(self, as_dict: bool = True, check_cache: bool = True):
+        """Method provides the cached access token, refreshing it if it is about to expire
+
+        Args:
+            as_dict (bool): If True, the token information is returned. If False, the access token string is returned.
+            check_cache (bool): If False, a new token is requested regardless of the cached token
+
+        Returns:
+            (dict | str): The token information, or the access token
+        """
+        token = self.token
+        if not check_cache or self.is_expiring(token):
+            with self.lock:
+                token = self.token
+                if not check_cache or self.is_expiring(token):  # Not refreshed by another thread in the meantime
+                    token = self.credentials.get_access_token(as_dict=True, check_cache=False)
+                    token = dict(token, expires_at=token.get('expires_at', time.time() + token['expires_in']))
+                    self.token = token
+                    self.refreshes += 1
+        return token if as_dict else token['access_token']
+
+
+class SpotifyClientFactory:
+    """The class creates the Spotify client of a set of application credentials once, and provides it to all callers.
+
+    Note, there should be a single factory per process and set of credentials (see `shared_client()`).
+
+    Attributes:
+        client_id (str): The client id of the Spotify application
+        client_secret (str): The client secret of the Spotify application
+        pool_size (int): The maximum number of kept-alive connections to the Spotify API
+        timeout (float): The number of seconds a request may take
+        retries (int): The maximum number of retries of a failed request
+        credentials (SharedCredentials): The shared access token, None before the client is created
+        session (Session): The pooled HTTP session, None before the client is created
+        spotify (Spotify): The shared spotipy client, None before it is created
+        lock (Lock): Ensures the client is created once
+    """
+    def __init__(self, client_id: str, client_secret: str, pool_size: int = 16, timeout: float = 10,
+                 retries: int = 3):
+        """The initialization of the Spotify Client Factory class
+
+        Args:
+            client_id (str): The client id of the Spotify application
+            client_secret (str): The client secret of the Spotify application
+            pool_size (int): The maximum number of kept-alive connections to the Spotify API
+            timeout (float): The number of seconds a request may take
+            retries (int): The maximum number of retries of a failed request
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.credentials = None
+        self.session = None
+        self.spotify = None
+        self.lock = threading.Lock()
+
+    def build_session(self):
+        """Method creates the pooled HTTP session, keeping the connections to the Spotify API alive
+
+        The session retries failed requests as the default spotipy session does, honouring the Retry-After header of
+        rate limited (429) responses. Each retry is reported to the retry listeners (see `recording_retry()`).
+
+        Returns:
+            (Session): The pooled HTTP session
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        retry = recording_retry(total=self.retries, connect=None, read=False, status=self.retries, backoff_factor=0.3,
+                                status_forcelist=RETRY_STATUSES,
+                                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def client(self):
+        """Method provides the shared Spotify client, creating it on first use
+
+        Returns:
+            (Spotify): The authenticated spotipy client
+        """
+        if self.spotify is None:
+            with self.lock:
+                if self.spotify is None:  # Not created by another thread in the meantime
+                    import spotipy
+                    from spotipy import SpotifyClientCredentials
+
+                    self.session = self.build_session()
+                    self.credentials = SharedCredentials(SpotifyClientCredentials(
+                        client_id=self.client_id, client_secret=self.client_secret, requests_session=self.session,
+                        requests_timeout=self.timeout))
+                    self.spotify = spotipy.Spotify(auth_manager=self.credentials, requests_session=self.session,
+                                                   requests_timeout=self.timeout)
+        return self.spotify
+
+
+factories = {}  # The process-wide factory of each set of credentials
+factories_lock = threading.Lock()
+
+
+def shared_client(client_id: str, client_secret: str):
+    """Method provides the process-wide Spotify client of a set of application credentials
+
+    Args:
+        client_id (str): The client id of the Spotify application
+        client_secret (str): The client secret of the Spotify application
+
+    Returns:
+        (Spotify): The authenticated spotipy client, shared by all callers within the process
+    """
+    with factories_lock:
+        factory = factories.get(client_id)
+        if factory is None or factory.client_secret != client_secret:
+            factory = SpotifyClientFactory(client_id, client_secret)
+            factories[client_id] = factory
+    return factory.client()
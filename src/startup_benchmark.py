@@ -0,0 +1,117 @@
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+"""This file benchmarks the start-up (import) time of each MIAS entry point.
+
+    The module-level imports of each entry point script are extracted and executed in a fresh interpreter (with
+    `-X importtime`), such that the Streamlit UI code of the scripts is not run. The wall-clock import time of each
+    entry point is reported as the median over several runs, together with its slowest top-level imports.
+
+    Usage (from the project root):
+        python src/startup_benchmark.py --repeats 5
+"""
+
+SOURCE_PATH = os.path.abspath(os.path.dirname(__file__))
+ENTRY_POINTS = {'recommender': os.path.join(SOURCE_PATH, 'recommender.py'),
+                'dataset page': os.path.join(SOURCE_PATH, 'pages', 'dataset.py'),
+                'crawler': os.path.join(SOURCE_PATH, 'data_processing.py')}
+
+
+def extract_imports(path: str):
+    """Method extracts the module-level import statements of a script (imports nested in functions or in the
+    `__main__` block are deferred, and therefore excluded).
+
+    Args:
+        path (str): The path to the entry point script
+
+    Returns:
+        (str): The source code of the module-level import statements
+    """
+    with open(path, 'r') as file:
+        source = file.read()
+    tree = ast.parse(source)
+    statements = [ast.get_source_segment(source, node) for node in tree.body
+                  if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return '\n'.join(statements)
+
+
+def parse_import_times(report: str):
+    """Method parses the `-X importtime` report into the cumulative import time of each top-level import
+
+    Args:
+        report (str): The `-X importtime` output (stderr of the interpreter)
+
+    Returns:
+        (dict): The mapping of top-level module name to its cumulative import time in milliseconds
+    """
+    times = {}
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  ') and name.strip() != '':  # Nested imports are indented below their importer
+            times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def measure(path: str, repeats: int = 5):
+    """Method measures the import time of an entry point in fresh interpreters
+
+    Args:
+        path (str): The path to the entry point script
+        repeats (int): The number of fresh interpreter runs
+
+    Returns:
+        wall_times (list): The wall-clock time (ms) of each run, including interpreter start-up
+        import_times (dict): The cumulative import time (ms) of each top-level import in the fastest run
+    """
+    code = extract_imports(path)
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([SOURCE_PATH, os.environ.get('PYTHONPATH', '')]))
+    wall_times, import_times = [], {}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=SOURCE_PATH,
+                                env=environment, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        if result.returncode != 0:
+            raise RuntimeError(f'Importing {path} failed:\n{result.stderr.splitlines()[-1]}')
+        if len(wall_times) == 0 or elapsed < min(wall_times):
+            import_times = parse_import_times(result.stderr)
+        wall_times.append(elapsed)
+    return wall_times, import_times
+
+
+def report(repeats: int = 5, top: int = 5):
+    """Method prints the start-up benchmark of each entry point
+
+    Args:
+        repeats (int): The number of fresh interpreter runs per entry point
+        top (int): The number of slowest top-level imports listed per entry point
+    """
+    baseline, baseline_imports = measure(os.devnull, repeats)  # Interpreter start-up without any imports
+    print(f'Interpreter start-up: {statistics.median(baseline):.0f} ms (median of {repeats})')
+    for name, path in ENTRY_POINTS.items():
+        try:
+            wall_times, import_times = measure(path, repeats)
+        except RuntimeError as error:
+            print(f'{name}: {error}')
+            continue
+        print(f'{name}: {statistics.median(wall_times) - statistics.median(baseline):.0f} ms imports '
+              f'(median of {repeats}, min {min(wall_times) - statistics.median(baseline):.0f} ms)')
+        import_times = {module: milliseconds for module, milliseconds in import_times.items()
+                        if module not in baseline_imports}  # Exclude the modules imported at interpreter start-up
+        for module, milliseconds in sorted(import_times.items(), key=lambda item: -item[1])[:top]:
+            print(f'    {module:<30} {milliseconds:8.1f} ms')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the MIAS entry points')
+    parser.add_argument('--repeats', type=int, default=5, help='The number of fresh interpreter runs per entry point')
+    parser.add_argument('--top', type=int, default=5, help='The number of slowest imports listed per entry point')
+    arguments = parser.parse_args()
+    report(arguments.repeats, arguments.top)
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+"""This file provides indexed metadata filters over the tracks dataset.
+
+    Filters (e.g. a tempo range, a set of keys, a minimum track popularity or a duration cap) are resolved against
+    sorted column indexes and categorical bitmaps, such that a similarity class can narrow its candidate tracks before
+    scoring, rather than scoring every track and filtering afterwards.
+"""
+
+
+class MetadataIndex:
+    """The class indexes the metadata columns of the tracks dataframe for filtering.
+
+    Range columns are indexed by a sorted order of their values (range queries are resolved by binary search), while
+    categorical columns are indexed by a bitmap per category. Indexes are built lazily, on first use of a column, or
+    all at once by `build()`. As building the indexes costs more than a single filter, an index should be built once
+    per dataset version and shared across requests. A one-off filter is resolved by a plain mask (see `mask()`).
+
+    Filters are provided as a dictionary of column name to constraint:
+    - Range columns: a (low, high) tuple of inclusive bounds, where None leaves a bound open. E.g. {'tempos': (90, 120)}
+    - Categorical columns: a list of allowed values. E.g. {'keys': [0, 7], 'modes': [1]}
+
+    Attributes:
+        size (int): The number of rows of the indexed tracks dataframe
+        sorted_columns (dict): The sorted index (row order, sorted values) of each indexed range column
+        bitmaps (dict): The bitmaps (category -> boolean row bitmap) of each indexed categorical column
+    """
+    range_columns = ['artist_pop', 'track_pop', 'danceability', 'energy', 'loudness', 'speechiness', 'acousticness',
+                     'instrumentalness', 'liveness', 'valences', 'tempos', 'durations_ms']
+    categorical_columns = ['keys', 'modes', 'time_signatures']
+
+    def __init__(self, tracks: pd.DataFrame):
+        """The initialization of the Metadata Index class
+
+        Args:
+            tracks (DataFrame): The tracks dataframe (before pipeline transformation)
+        """
+        self.tracks = tracks
+        self.size = tracks.shape[0]
+        self.sorted_columns = {}
+        self.bitmaps = {}
+
+    @classmethod
+    def build(cls, tracks: pd.DataFrame):
+        """Method builds the indexes of all metadata columns of the tracks dataframe
+
+        Args:
+            tracks (DataFrame): The tracks dataframe (before pipeline transformation)
+
+        Returns:
+            (MetadataIndex): The metadata index, with all indexes built
+        """
+        index = cls(tracks)
+        for column in cls.range_columns:
+            if column in tracks.columns:
+                index.sorted_column(column)
+        for column in cls.categorical_columns:
+            if column in tracks.columns:
+                index.category_bitmaps(column)
+        return index
+
+    @classmethod
+    def mask(cls, tracks: pd.DataFrame, filters: dict):
+        """Method resolves a set of filters by a plain mask over the column values, without building any index
+
+        Args:
+            tracks (DataFrame): The tracks dataframe (before pipeline transformation)
+            filters (dict): The mapping of column name to constraint (see class documentation)
+
+        Returns:
+            (ndarray): A boolean bitmap over the rows of the tracks dataframe
+        """
+        selected = np.ones(tracks.shape[0], dtype=bool)
+        for column, constraint in filters.items():
+            if column in cls.categorical_columns:
+                selected &= tracks[column].isin(constraint).to_numpy()
+            elif column in cls.range_columns:
+                low, high = constraint
+                values = tracks[column].to_numpy(dtype=np.float64)
+                if low is not None:
+                    selected &= values >= low
+                if high is not None:
+                    selected &= values <= high
+            else:
+                raise ValueError(f'Filtering is not supported on column {column}')
+        return selected
+
+    def sorted_column(self, column: str):
+        """Method provides the sorted index of a range column, building it on first use
+
+        Args:
+            column (str): The name of the range column
+
+        Returns:
+            order (ndarray): The row positions in ascending order of the column values
+            values (ndarray): The column values in ascending order
+        """
+        if column not in self.sorted_columns:
+            values = self.tracks[column].to_numpy(dtype=np.float64)
+            order = np.argsort(values, kind='stable')
+            self.sorted_columns[column] = (order, values[order])
+        return self.sorted_columns[column]
+
+    def category_bitmaps(self, column: str):
+        """Method provides the category bitmaps of a categorical column, building them on first use
+
+        Args:
+            column (str): The name of the categorical column
+
+        Returns:
+            (dict): The mapping of each category to a boolean bitmap of the rows in that category
+        """
+        if column not in self.bitmaps:
+            categories, codes = np.unique(self.tracks[column].to_numpy(), return_inverse=True)
+            self.bitmaps[column] = {category: codes == code for code, category in enumerate(categories.tolist())}
+        return self.bitmaps[column]
+
+    def range_bitmap(self, column: str, low=None, high=None):
+        """Method determines the rows with a column value within the inclusive range [low, high]
+
+        Args:
+            column (str): The name of the range column
+            low (float): The lower bound, None for no lower bound
+            high (float): The upper bound, None for no upper bound
+
+        Returns:
+            (ndarray): A boolean bitmap over the rows of the tracks dataframe
+        """
+        order, values = self.sorted_column(column)
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = values.shape[0] if high is None else np.searchsorted(values, high, side='right')
+        bitmap = np.zeros(self.size, dtype=bool)
+        bitmap[order[start: end]] = True
+        return bitmap
+
+    def select(self, filters: dict):
+        """Method resolves a set of filters into the rows satisfying all of them
+
+        Args:
+            filters (dict): The mapping of column name to constraint (see class documentation)
+
+        Returns:
+            (ndarray): A boolean bitmap over the rows of the tracks dataframe
+        """
+        selected = np.ones(self.size, dtype=bool)
+        for column, constraint in filters.items():
+            if column in self.categorical_columns:
+                category_bitmaps = self.category_bitmaps(column)
+                allowed = np.zeros(self.size, dtype=bool)
+                for category in constraint:
+                    if category in category_bitmaps:
+                        allowed |= category_bitmaps[category]
+                selected &= allowed
+            elif column in self.range_columns:
+                low, high = constraint
+                selected &= self.range_bitmap(column, low, high)
+            else:
+                raise ValueError(f'Filtering is not supported on column {column}')
+        return selected
@@ -0,0 +1,194 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from data_processing import construct_storage, merge_stores, save_data, update_tracking
+from dataset_store import DatasetLock, data_path, write_csv
+
+"""This file provides the write-behind queue for persisting submitted playlists into the tracks dataset.
+
+    Playlists submitted through the recommender are scored in memory. Persisting them into `tracks.csv` (a full
+    dataset rewrite, followed by the rebuild of the derived dataset artifacts) is taken off the request path: submissions
+    from all sessions of the process are queued, batched and flushed asynchronously by a background thread. Failed
+    batches are retried, and pending submissions are flushed when the process exits.
+"""
+
+
+def persist_tracks(store):
+    """Method persists a batch of collected tracks into the tracks dataset, and records the dataset growth.
+
+    Batches without new tracks are not saved. The rebuild of the vector indexes and export artifacts is deferred to the
+    next crawl (see `data_processing.update_dataset_artifacts()`), keeping the flushes cheap.
+
+    Args:
+        store (dict): The track storage object containing the batched tracks
+    """
+    with DatasetLock():  # The growth record is written together with the dataset
+        df = save_data(store, source='submission')
+        if df is not None:
+            update_tracking(df, deferred=True)
+
+
+class TrackWriteQueue:
+    """The class batches track submissions from all sessions and flushes them to the tracks dataset asynchronously.
+
+    After the first submission of a batch arrives, further submissions are collected for up to `flush_interval`
+    seconds (or until `max_batch` submissions are collected), and the whole batch is written with a single dataset
+    rewrite.
+
+    A failed batch is kept pending and retried with the next flush. After `max_attempts` failed flushes (or a failed
+    flush at exit), the batch is persisted to `data/write_behind_failed`, from which it is resubmitted when a queue is
+    next created. Pending submissions are drained when the process exits.
+
+    Note, there should be a single queue per process (e.g. shared through `st.cache_resource`). Queues of different
+    processes are serialized by the cross-process `DatasetLock` taken by `save_data()`.
+
+    Attributes:
+        flush_interval (float): The number of seconds a batch collects submissions before being flushed
+        max_batch (int): The maximum number of submissions flushed in a single batch
+        max_attempts (int): The number of failed flushes after which a batch is persisted to the failed batches directory
+        writer (callable): The function persisting a merged track storage object
+        submissions (Queue): The queue of submitted track storage objects
+        pending (list): The submissions taken off the queue that have not been persisted yet
+        attempts (int): The number of failed flushes of the pending submissions
+        pending_lock (Lock): Guards the pending submissions
+        lock (Lock): Ensures batches are flushed one at a time
+        thread (Thread): The background thread flushing batches
+    """
+    failed_directory = 'write_behind_failed'
+
+    def __init__(self, flush_interval: float = 30.0, max_batch: int = 20, writer=persist_tracks, max_attempts: int = 3):
+        """The initialization of the Track Write Queue class, resubmitting previously failed batches, starting the
+        background flush thread and registering the drain of pending submissions at exit
+
+        Args:
+            flush_interval (float): The number of seconds a batch collects submissions before being flushed
+            max_batch (int): The maximum number of submissions flushed in a single batch
+            writer (callable): The function persisting a merged track storage object
+            max_attempts (int): The number of failed flushes after which a batch is persisted to the failed batches directory
+        """
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.writer = writer
+        self.submissions = queue.Queue()
+        self.pending = []
+        self.attempts = 0
+        self.pending_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.recover()
+        self.thread = threading.Thread(target=self.run, name='track-write-queue', daemon=True)
+        self.thread.start()
+        atexit.register(self.drain)
+
+    def submit(self, store):
+        """Method queues collected tracks to be persisted into the tracks dataset. This method does not block.
+
+        Args:
+            store (dict): The track storage object (see `data_processing.construct_storage()`)
+        """
+        self.submissions.put(store)
+
+    def take(self, timeout: float = None):
+        """Method moves a submission from the queue to the pending submissions
+
+        Args:
+            timeout (float): The number of seconds to wait for a submission, None to wait indefinitely
+
+        Raises:
+            queue.Empty: If no submission arrived within the timeout
+        """
+        store = self.submissions.get(timeout=timeout)
+        with self.pending_lock:
+            self.pending.append(store)
+
+    def pending_count(self):
+        """Method determines the number of pending submissions
+
+        Returns:
+            (int): The number of submissions taken off the queue that have not been persisted yet
+        """
+        with self.pending_lock:
+            return len(self.pending)
+
+    def run(self):
+        """Method runs the background flush loop, collecting submissions into batches and flushing them"""
+        while True:
+            if self.pending_count() == 0:
+                self.take()  # Block until the first submission of a batch arrives
+            deadline = time.monotonic() + self.flush_interval  # Also delays the retry of a failed batch
+            while self.pending_count() < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self.take(timeout=remaining)
+                except queue.Empty:
+                    break
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """Method merges the pending submissions and persists them with a single write
+
+        If the write fails, the submissions remain pending (to be retried by the next flush), unless the batch has
+        failed `max_attempts` times (or the flush is final), in which case it is persisted to the failed batches
+        directory.
+
+        Args:
+            final (bool): If True, no further flush will retry a failed batch (e.g. at exit)
+        """
+        with self.lock:
+            with self.pending_lock:
+                batch, self.pending = self.pending, []
+            if len(batch) == 0:
+                return
+            merged = construct_storage()
+            for store in batch:
+                merge_stores(merged, store)
+            try:
+                self.writer(merged)
+                self.attempts = 0
+            except Exception as error:
+                self.attempts += 1
+                print(f'Error persisting {len(batch)} submitted playlists (attempt {self.attempts}): {error}')
+                if final or self.attempts >= self.max_attempts:
+                    self.persist_failed(merged)
+                    self.attempts = 0
+                else:
+                    with self.pending_lock:
+                        self.pending = batch + self.pending  # Retried by the next flush
+
+    def drain(self):
+        """Method synchronously flushes all pending and queued submissions (registered to run at exit)"""
+        while True:
+            try:
+                self.take(timeout=0)
+            except queue.Empty:
+                break
+        self.flush(final=True)
+
+    def persist_failed(self, store):
+        """Method persists a batch that could not be written, such that it is resubmitted by the next queue
+
+        Args:
+            store (dict): The merged track storage object of the batch
+        """
+        os.makedirs(data_path(self.failed_directory), exist_ok=True)
+        path = os.path.join(data_path(self.failed_directory), f'batch_{time.time_ns()}.csv')
+        write_csv(pd.DataFrame.from_dict(store), path, index=False)
+        print(f'Persisted the failed batch to {path}')
+
+    def recover(self):
+        """Method resubmits the batches persisted by `persist_failed()`, removing their files"""
+        directory = data_path(self.failed_directory)
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.csv'):
+                path = os.path.join(directory, name)
+                self.submit(pd.read_csv(path).to_dict('list'))
+                os.remove(path)